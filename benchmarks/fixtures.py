@@ -0,0 +1,137 @@
+"""ベンチマーク用の合成環境を生成します
+
+`*.dist-info` を指定した数だけ持つ偽の site-packages と、大きな
+requirements_license.txt を作ります。ライセンスの書き方（License フィールド、
+Classifier のみ、License-Expression、長いライセンス本文、記載なし）と
+Requires-Dist（マーカー付き・extra 付きを含む）は実際の環境に近い割合で混ぜ、
+`chain-0000 → chain-0001 → ...` という深い依存の鎖も含めます。
+同じ引数からは常に同じ内容が生成されます。
+
+    python benchmarks/fixtures.py site-packages DIR --count 1000 [--chain-depth 50]
+    python benchmarks/fixtures.py requirements FILE --count 10000
+"""
+import argparse
+import os
+import random
+import re
+
+# License フィールドに書かれるライセンス（表記揺れを含む）
+LICENSES = [
+    "MIT", "MIT License", "BSD", "BSD-3-Clause", "BSD License", "Apache-2.0",
+    "Apache 2.0", "Apache Software License", "Apache License, Version 2.0",
+    "ISC", "MPL-2.0", "LGPL-3.0", "GPL-3.0", "GPLv2", "PSF", "Python Software Foundation License",
+    "Dual License", "Unlicense", "Proprietary",
+]
+CLASSIFIERS = [
+    "License :: OSI Approved :: MIT License",
+    "License :: OSI Approved :: BSD License",
+    "License :: OSI Approved :: Apache Software License",
+    "License :: OSI Approved :: Mozilla Public License 2.0 (MPL 2.0)",
+    "License :: OSI Approved :: GNU General Public License v3 (GPLv3)",
+    "License :: OSI Approved :: Python Software Foundation License",
+]
+EXPRESSIONS = ["MIT", "Apache-2.0 OR MIT", "BSD-3-Clause", "MIT AND (Apache-2.0 OR BSD-2-Clause)"]
+LONG_LICENSE = (
+    "Permission is hereby granted, free of charge, to any person obtaining a copy\n"
+    "        of this software and associated documentation files (the \"Software\"), to deal\n"
+    "        \n"
+    "        in the Software without restriction, including without limitation the rights\n"
+    "        to use, copy, modify, merge, publish, distribute, sublicense, and/or sell"
+)
+MARKERS = ['', '', '', '; python_version < "3.8"', '; sys_platform == "win32"', '; extra == "test"']
+
+HEADER = (
+    "# このファイルにはインストールされたパッケージとそのライセンスが記録されます\n"
+    "# format: [ステータス] package_name==version [license] [インストールタイプ]\n"
+    "# ステータス: ✅=許可済み, ❓=未確認\n"
+)
+
+
+def package_names(count, chain_depth):
+    """生成するパッケージ名の一覧（鎖のパッケージが先頭）を返します"""
+    chain = [f"chain-{i:04d}" for i in range(chain_depth)]
+    return chain + [f"pkg-{i:05d}" for i in range(count - chain_depth)]
+
+
+def _metadata(rng, name, version, requires):
+    lines = ["Metadata-Version: 2.1", f"Name: {name}", f"Version: {version}",
+             f"Summary: synthetic package {name}"]
+    kind = rng.random()
+    if kind < 0.45:
+        lines.append(f"License: {rng.choice(LICENSES)}")
+    elif kind < 0.47:
+        lines.append(f"License: {LONG_LICENSE}")
+    elif kind < 0.75:
+        lines.append("License: UNKNOWN" if rng.random() < 0.5 else "License: ")
+        lines.append(f"Classifier: {rng.choice(CLASSIFIERS)}")
+    elif kind < 0.85:
+        lines[0] = "Metadata-Version: 2.4"
+        lines.append(f"License-Expression: {rng.choice(EXPRESSIONS)}")
+    lines.append("Classifier: Programming Language :: Python :: 3")
+    for requirement in requires:
+        lines.append(f"Requires-Dist: {requirement}{rng.choice(MARKERS)}")
+    return "\n".join(lines) + "\n\n" + f"# {name}\n\nLong description.\n"
+
+
+def make_site_packages(directory, count, chain_depth=None, seed=0):
+    """偽の site-packages を生成し、パッケージ名の一覧を返します"""
+    rng = random.Random(seed)
+    if chain_depth is None:
+        chain_depth = min(50, max(1, count // 10))
+    names = package_names(count, chain_depth)
+    os.makedirs(directory, exist_ok=True)
+    for position, name in enumerate(names):
+        # 依存は自分より後ろのパッケージだけにして循環しない DAG にする（鎖は次の要素に依存）
+        later = names[position + 1:]
+        requires = []
+        if name.startswith("chain-") and position + 1 < chain_depth:
+            requires.append(f"{names[position + 1]}>=1.0")
+        if later:
+            for dep in rng.sample(later[:200], min(len(later[:200]), rng.randint(0, 3))):
+                if dep not in requires:
+                    requires.append(dep)
+        version = f"{rng.randint(0, 9)}.{rng.randint(0, 30)}.{rng.randint(0, 9)}"
+        dist_info = os.path.join(directory, f"{re.sub(r'[-.]+', '_', name)}-{version}.dist-info")
+        os.makedirs(dist_info, exist_ok=True)
+        with open(os.path.join(dist_info, "METADATA"), "w") as f:
+            f.write(_metadata(rng, name, version, requires))
+        with open(os.path.join(dist_info, "RECORD"), "w") as f:
+            f.write(f"{os.path.basename(dist_info)}/METADATA,,\n")
+    return names
+
+
+def make_requirements_license(path, count, seed=0):
+    """エントリー数 count の requirements_license.txt を生成します（ステータスは一部わざと不正確）"""
+    rng = random.Random(seed)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(HEADER)
+        for i in range(count):
+            status = "✅" if rng.random() < 0.5 else "❓"
+            install_type = "直接インストール" if rng.random() < 0.2 else "依存パッケージ"
+            f.write(f"{status} pkg-{i:05d}==1.{i % 50}.0 [{rng.choice(LICENSES)}] [{install_type}]\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ベンチマーク用の合成環境の生成")
+    subparsers = parser.add_subparsers(dest="kind", required=True)
+    site_parser = subparsers.add_parser("site-packages", help="偽の site-packages を生成")
+    site_parser.add_argument("directory")
+    site_parser.add_argument("--count", type=int, default=1000)
+    site_parser.add_argument("--chain-depth", type=int, default=None)
+    site_parser.add_argument("--seed", type=int, default=0)
+    requirements_parser = subparsers.add_parser("requirements", help="requirements_license.txt を生成")
+    requirements_parser.add_argument("path")
+    requirements_parser.add_argument("--count", type=int, default=10000)
+    requirements_parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind == "site-packages":
+        names = make_site_packages(args.directory, args.count, args.chain_depth, args.seed)
+        print(f"{len(names)} packages -> {args.directory}")
+    else:
+        make_requirements_license(args.path, args.count, args.seed)
+        print(f"{args.count} entries -> {args.path}")
+
+
+if __name__ == "__main__":
+    main()
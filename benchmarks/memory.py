@@ -0,0 +1,158 @@
+"""大きな requirements_license.txt を扱うときのピークメモリ（最大 RSS）のベンチマーク
+
+benchmarks/fixtures.py で指定した行数の requirements_license.txt と小さな
+site-packages を生成し、次の処理をそれぞれ新しいプロセスで実行して、
+モジュールを読み込んだ直後からのピーク RSS の増加量を計測します。
+
+- load: RequirementsLicenseFile.load（ファイル全体をモデルに読み込む）
+- update: update_license_status（全エントリーのステータスの確認と書き換え）
+- scan: scan_installed_packages（既存のファイルへのスキャン結果の反映）
+
+--revision で Git のリビジョンを指定すると、そのリビジョンの pip_license_checker.py でも
+同じ計測を行うため、変更の前後を比較できます。
+
+    python benchmarks/memory.py [--lines 100000,300000] [--revision HEAD~1] [--output result.json]
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fixtures  # noqa: E402
+
+SCHEMA_VERSION = 1
+SCENARIOS = ("load", "update", "scan")
+SITE_PACKAGES_COUNT = 200
+
+
+def _max_rss_kb():
+    """このプロセスのこれまでの最大 RSS（KB）です（macOS の ru_maxrss はバイト単位）"""
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss // 1024 if sys.platform == "darwin" else rss
+
+
+def worker(scenario, module_dir, site_dir):
+    """1つのシナリオをこのプロセスで実行し、結果を JSON で標準出力に書きます"""
+    import contextlib
+
+    sys.path.insert(0, module_dir)
+    import pip_license_checker as checker
+    sys.path.insert(0, site_dir)
+    baseline_kb = _max_rss_kb()
+
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        if scenario == "load":
+            inventory = checker.RequirementsLicenseFile.load()
+            entries = len(inventory)
+        elif scenario == "update":
+            checker.update_license_status()
+        elif scenario == "scan":
+            checker.scan_installed_packages()
+        wall_ms = (time.perf_counter() - start) * 1000
+
+    result = {"wall_ms": wall_ms, "baseline_kb": baseline_kb, "peak_kb": _max_rss_kb()}
+    if scenario == "load":
+        result["entries"] = entries
+    print(json.dumps(result))
+
+
+def _checkout_module(revision, directory):
+    """指定したリビジョンの pip_license_checker.py を directory に書き出します"""
+    source = subprocess.run(["git", "show", f"{revision}:pip_license_checker.py"], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, check=True).stdout
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, "pip_license_checker.py"), "wb") as f:
+        f.write(source)
+    return directory
+
+
+def _run_worker(scenario, module_dir, site_dir, requirements, env):
+    """新しいプロジェクトディレクトリでワーカープロセスを1回実行します"""
+    with tempfile.TemporaryDirectory() as project_dir:
+        shutil.copy(requirements, os.path.join(project_dir, "requirements_license.txt"))
+        with open(os.path.join(project_dir, "allowed_licenses.json"), "w") as f:
+            json.dump({"allowed_licenses": ["MIT", "BSD", "Apache-2.0", "Apache Software License"]}, f)
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", scenario, module_dir, site_dir],
+                                cwd=project_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace"))
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="大きな requirements_license.txt のピークメモリのベンチマーク")
+    parser.add_argument("--lines", default="100000,300000", help="requirements_license.txt の行数（カンマ区切り）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"実行するシナリオ（カンマ区切り: {', '.join(SCENARIOS)}）")
+    parser.add_argument("--revision", action="append", default=[],
+                        help="比較する Git のリビジョン（複数指定可、作業ツリーの版は常に計測）")
+    parser.add_argument("--output", default=None, help="結果の JSON の出力先（デフォルト: 標準出力）")
+    parser.add_argument("--worker", nargs=3, metavar=("SCENARIO", "MODULE_DIR", "SITE_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return 0
+
+    sizes = [int(size) for size in args.lines.split(",") if size]
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+
+    work_dir = tempfile.mkdtemp(prefix="pip-license-memory-")
+    env = dict(os.environ, PIP_LICENSE_NO_CACHE="1", PIP_LICENSE_NO_DAEMON="1", PIP_LICENSE_POLICY="warn")
+    results = []
+    try:
+        modules = [("working-tree", REPO_ROOT)]
+        for revision in args.revision:
+            modules.append((revision, _checkout_module(revision, os.path.join(work_dir, f"rev-{len(modules)}"))))
+        site_dir = os.path.join(work_dir, "site-packages")
+        fixtures.make_site_packages(site_dir, SITE_PACKAGES_COUNT)
+        for size in sizes:
+            requirements = os.path.join(work_dir, f"requirements-{size}.txt")
+            fixtures.make_requirements_license(requirements, size)
+            for scenario in scenarios:
+                for label, module_dir in modules:
+                    run = _run_worker(scenario, module_dir, site_dir, requirements, env)
+                    results.append({
+                        "scenario": scenario,
+                        "lines": size,
+                        "module": label,
+                        "wall_ms": run["wall_ms"],
+                        "peak_rss_kb": run["peak_kb"],
+                        "peak_rss_delta_kb": run["peak_kb"] - run["baseline_kb"],
+                    })
+                    print(f"{scenario:>7} {size:>7} {label:>14}: {run['peak_kb'] - run['baseline_kb']:>8} KB "
+                          f"{run['wall_ms']:9.1f} ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,107 @@
+"""pip コンソールスクリプト（pip_license_checker:main）の起動時間ベンチマーク
+
+素の pip と、このモジュールを経由した pip の両方で `pip --version` を実行して
+起動時間を比較します。あわせて -X importtime の結果から、このモジュールを経由する
+ことで追加で読み込まれるモジュールの時間を集計し、予算を超えた場合は
+終了コード 1 を返します（CI での回帰チェック用）。
+
+    python benchmarks/startup.py [--runs 20] [--budget-ms 5] [--command --version]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+BARE_PIP = (
+    "import sys\n"
+    "sys.argv = ['pip'] + sys.argv[1:]\n"
+    "from pip._internal.cli.main import main\n"
+    "sys.exit(main())\n"
+)
+SHIM_PIP = (
+    "import sys\n"
+    "sys.argv = ['pip'] + sys.argv[1:]\n"
+    "import pip_license_checker\n"
+    "sys.exit(pip_license_checker.main())\n"
+)
+
+
+def _environment(pycache_dir):
+    env = dict(os.environ)
+    # 実際のインストールと同じく .pyc が使われる状態で計測する
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    env["PYTHONPYCACHEPREFIX"] = pycache_dir
+    env["PYTHONPATH"] = REPO_ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+    return env
+
+
+def _run(code, args, env, importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code] + args
+    start = time.perf_counter()
+    result = subprocess.run(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    elapsed = time.perf_counter() - start
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace"))
+    return elapsed, result.stderr.decode("utf-8", "replace")
+
+
+def _import_times(stderr):
+    """-X importtime の出力からモジュールごとの自己時間（マイクロ秒）を取り出します"""
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, _, module = line[len("import time:"):].split("|")
+        times[module.strip()] = int(self_us)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pip シムの起動時間ベンチマーク")
+    parser.add_argument("--runs", type=int, default=20, help="各パターンの実行回数")
+    parser.add_argument("--budget-ms", type=float, default=5.0,
+                        help="シムが追加で読み込むモジュールに許容する時間（ミリ秒）")
+    parser.add_argument("--command", nargs="*", default=["--version"],
+                        help="pip に渡す引数（デフォルト: --version）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as pycache_dir:
+        env = _environment(pycache_dir)
+        # 1回目は .pyc の生成を含むため計測から除外する
+        _run(BARE_PIP, args.command, env)
+        _run(SHIM_PIP, args.command, env)
+
+        bare, shim = [], []
+        for _ in range(args.runs):
+            bare.append(_run(BARE_PIP, args.command, env)[0])
+            shim.append(_run(SHIM_PIP, args.command, env)[0])
+
+        bare_imports = _import_times(_run(BARE_PIP, args.command, env, importtime=True)[1])
+        shim_imports = _import_times(_run(SHIM_PIP, args.command, env, importtime=True)[1])
+
+    extra_modules = {name: us for name, us in shim_imports.items() if name not in bare_imports}
+    extra_import_ms = sum(extra_modules.values()) / 1000
+    report = {
+        "command": ["pip"] + args.command,
+        "runs": args.runs,
+        "bare_ms": {"median": statistics.median(bare) * 1000, "min": min(bare) * 1000},
+        "shim_ms": {"median": statistics.median(shim) * 1000, "min": min(shim) * 1000},
+        "overhead_ms": (statistics.median(shim) - statistics.median(bare)) * 1000,
+        "extra_import_ms": extra_import_ms,
+        "extra_modules": dict(sorted(extra_modules.items(), key=lambda item: -item[1])),
+        "budget_ms": args.budget_ms,
+        "ok": extra_import_ms <= args.budget_ms,
+    }
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+    return 0 if report["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
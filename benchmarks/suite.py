@@ -0,0 +1,276 @@
+"""合成環境に対するライセンスチェッカーのベンチマークスイート
+
+benchmarks/fixtures.py で 100 / 1,000 / 10,000 個の `*.dist-info` を持つ偽の
+site-packages と大きな requirements_license.txt を生成し、次の処理をそれぞれ
+新しいプロセスで端から端まで実行して計測します。
+
+- scan: scan_installed_packages（空のプロジェクトに対して）
+- update: update_license_status（パッケージ数 × --requirements-factor 件のファイル）
+- check: check_license（深い依存の鎖の先頭 chain-0000）
+- record: update_requirements_license（chain-0000 とその依存を既存のファイルに記録）
+
+実行時間とあわせて、起動したサブプロセスの数、書き込みで開いたファイルの数と
+書き込んだバイト数、リネームと fsync の回数を JSON で出力します。
+
+    python benchmarks/suite.py [--sizes 100,1000,10000] [--runs 3] [--output result.json]
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, BENCHMARKS_DIR)
+
+import fixtures  # noqa: E402
+
+SCHEMA_VERSION = 1
+SCENARIOS = ("scan", "update", "check", "record")
+CHAIN_ROOT = "chain-0000"
+
+
+class _CountingFile:
+    """書き込んだバイト数を数えるファイルオブジェクトのラッパーです"""
+
+    def __init__(self, f, counters):
+        self._f = f
+        self._counters = counters
+
+    def write(self, data):
+        self._counters["bytes_written"] += len(data.encode("utf-8") if isinstance(data, str) else data)
+        return self._f.write(data)
+
+    def __enter__(self):
+        self._f.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        return self._f.__exit__(*exc)
+
+    def __iter__(self):
+        return iter(self._f)
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+
+def _instrument():
+    """サブプロセスの起動とファイルへの書き込みを数えるカウンターを仕掛けます"""
+    import builtins
+    counters = {"subprocesses": 0, "file_writes": 0, "bytes_written": 0, "renames": 0, "fsyncs": 0}
+
+    popen_init = subprocess.Popen.__init__
+
+    def counting_popen_init(self, *args, **kwargs):
+        counters["subprocesses"] += 1
+        return popen_init(self, *args, **kwargs)
+
+    subprocess.Popen.__init__ = counting_popen_init
+
+    def wrap_open(real_open):
+        def counting_open(file, mode="r", *args, **kwargs):
+            f = real_open(file, mode, *args, **kwargs)
+            if any(flag in mode for flag in "wax+"):
+                counters["file_writes"] += 1
+                return _CountingFile(f, counters)
+            return f
+        return counting_open
+
+    builtins.open = wrap_open(builtins.open)
+    os.fdopen = wrap_open(os.fdopen)
+
+    def counting(name, real):
+        def wrapper(*args, **kwargs):
+            counters[name] += 1
+            return real(*args, **kwargs)
+        return wrapper
+
+    os.replace = counting("renames", os.replace)
+    os.rename = counting("renames", os.rename)
+    os.fsync = counting("fsyncs", os.fsync)
+    return counters
+
+
+def worker(scenario, site_dir):
+    """1つのシナリオをこのプロセスで実行し、結果を JSON で標準出力に書きます"""
+    import contextlib
+
+    start = time.perf_counter()
+    sys.path.insert(0, REPO_ROOT)
+    import pip_license_checker as checker
+    import_ms = (time.perf_counter() - start) * 1000
+
+    # 実際の環境のパッケージが混ざらないよう、合成した site-packages と標準ライブラリだけを見る
+    sys.path[:] = [site_dir] + [path for path in sys.path if path and path != REPO_ROOT
+                                and "site-packages" not in path and "dist-packages" not in path]
+    # 出力の捨て先は計測の対象外にする
+    devnull = open(os.devnull, "w")
+    counters = _instrument()
+
+    with devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        try:
+            if scenario == "scan":
+                checker.scan_installed_packages()
+            elif scenario == "update":
+                checker.update_license_status()
+            elif scenario == "check":
+                checker.check_license(CHAIN_ROOT)
+            elif scenario == "record":
+                version, license_info, requires = checker.get_package_info(CHAIN_ROOT)
+                checker.update_requirements_license(CHAIN_ROOT, version, license_info, requires, True)
+        finally:
+            # license_command と同じくコマンドの最後にまとめて保存する分も含めて計測する
+            checker.commit_allowed_licenses()
+            checker.flush_metadata_cache()
+        wall_ms = (time.perf_counter() - start) * 1000
+
+    print(json.dumps(dict(counters, wall_ms=wall_ms, import_ms=import_ms)))
+
+
+def _git_revision():
+    try:
+        result = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.decode().strip()
+
+
+def _prepare_fixtures(root, size, requirements_factor, chain_depth):
+    """サイズごとの合成環境を生成します（同じ条件で生成済みなら再利用）"""
+    directory = os.path.join(root, f"size-{size}")
+    site_dir = os.path.join(directory, "site-packages")
+    requirements = os.path.join(directory, "requirements_license.txt")
+    stamp_path = os.path.join(directory, "fixture.json")
+    stamp = {"schema": SCHEMA_VERSION, "size": size, "requirements_entries": size * requirements_factor,
+             "chain_depth": chain_depth}
+    try:
+        with open(stamp_path) as f:
+            if json.load(f) == stamp:
+                return site_dir, requirements, stamp
+    except (OSError, ValueError):
+        pass
+    shutil.rmtree(directory, ignore_errors=True)
+    fixtures.make_site_packages(site_dir, size, chain_depth)
+    fixtures.make_requirements_license(requirements, size * requirements_factor)
+    with open(stamp_path, "w") as f:
+        json.dump(stamp, f)
+    return site_dir, requirements, stamp
+
+
+def _run_worker(scenario, site_dir, requirements, env):
+    """新しいプロジェクトディレクトリでワーカープロセスを1回実行します"""
+    with tempfile.TemporaryDirectory() as project_dir:
+        if scenario in ("update", "record"):
+            shutil.copy(requirements, os.path.join(project_dir, "requirements_license.txt"))
+        with open(os.path.join(project_dir, "allowed_licenses.json"), "w") as f:
+            json.dump({"allowed_licenses": ["MIT", "BSD", "Apache-2.0", "Apache Software License"]}, f)
+        result = subprocess.run([sys.executable, os.path.abspath(__file__), "--worker", scenario, site_dir],
+                                cwd=project_dir, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode("utf-8", "replace"))
+    return json.loads(result.stdout.decode().strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="合成環境に対するライセンスチェッカーのベンチマーク")
+    parser.add_argument("--sizes", default="100,1000,10000", help="dist-info の数（カンマ区切り）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS),
+                        help=f"実行するシナリオ（カンマ区切り: {', '.join(SCENARIOS)}）")
+    parser.add_argument("--runs", type=int, default=3, help="各シナリオの実行回数")
+    parser.add_argument("--requirements-factor", type=int, default=10,
+                        help="requirements_license.txt のエントリー数（パッケージ数に対する倍率）")
+    parser.add_argument("--chain-depth", type=int, default=None, help="依存の鎖の長さ（デフォルト: 数の1/10、最大50）")
+    parser.add_argument("--backend", choices=("importlib", "subprocess"), default="importlib",
+                        help="メタデータの取得方法（PIP_LICENSE_METADATA_BACKEND）")
+    parser.add_argument("--cache", choices=("off", "warm"), default="off",
+                        help="off: メタデータキャッシュなし, warm: 事前に1回実行してキャッシュを温めてから計測")
+    parser.add_argument("--fixtures-dir", default=None, help="合成環境の保存先（指定すると次回以降も再利用）")
+    parser.add_argument("--output", default=None, help="結果の JSON の出力先（デフォルト: 標準出力）")
+    parser.add_argument("--worker", nargs=2, metavar=("SCENARIO", "SITE_DIR"), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        worker(*args.worker)
+        return 0
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    scenarios = [scenario for scenario in args.scenarios.split(",") if scenario]
+    for scenario in scenarios:
+        if scenario not in SCENARIOS:
+            parser.error(f"unknown scenario: {scenario}")
+
+    fixtures_dir = args.fixtures_dir or tempfile.mkdtemp(prefix="pip-license-bench-")
+    cache_dir = tempfile.mkdtemp(prefix="pip-license-bench-cache-")
+    env = dict(os.environ)
+    env["PIP_LICENSE_METADATA_BACKEND"] = args.backend
+    env["PIP_LICENSE_CACHE_DIR"] = cache_dir
+    # 確認は行わず、違反があっても続行して許可リストには追加しない
+    env["PIP_LICENSE_POLICY"] = "warn"
+    if args.cache == "off":
+        env["PIP_LICENSE_NO_CACHE"] = "1"
+    else:
+        env.pop("PIP_LICENSE_NO_CACHE", None)
+
+    results = []
+    try:
+        for size in sizes:
+            chain_depth = args.chain_depth or min(50, max(1, size // 10))
+            site_dir, requirements, stamp = _prepare_fixtures(fixtures_dir, size, args.requirements_factor,
+                                                              chain_depth)
+            # pip show を使う場合は子プロセスの pip からも合成した環境が見えるようにする
+            run_env = dict(env, PYTHONPATH=site_dir) if args.backend == "subprocess" else env
+            for scenario in scenarios:
+                if args.cache == "warm":
+                    _run_worker(scenario, site_dir, requirements, run_env)
+                runs = [_run_worker(scenario, site_dir, requirements, run_env) for _ in range(args.runs)]
+                walls = [run["wall_ms"] for run in runs]
+                last = runs[-1]
+                results.append({
+                    "scenario": scenario,
+                    "packages": size,
+                    "requirements_entries": stamp["requirements_entries"] if scenario in ("update", "record") else 0,
+                    "chain_depth": chain_depth,
+                    "wall_ms": {"median": statistics.median(walls), "min": min(walls), "max": max(walls)},
+                    "import_ms": statistics.median(run["import_ms"] for run in runs),
+                    "subprocesses": last["subprocesses"],
+                    "file_writes": last["file_writes"],
+                    "bytes_written": last["bytes_written"],
+                    "renames": last["renames"],
+                    "fsyncs": last["fsyncs"],
+                })
+                print(f"{scenario:>7} {size:>6}: {statistics.median(walls):9.1f} ms", file=sys.stderr)
+    finally:
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        if args.fixtures_dir is None:
+            shutil.rmtree(fixtures_dir, ignore_errors=True)
+
+    report = {
+        "schema": SCHEMA_VERSION,
+        "git_revision": _git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "backend": args.backend,
+        "cache": args.cache,
+        "runs": args.runs,
+        "results": results,
+    }
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,178 +1,415 @@
 # pip_license_checker.py
-import json
+# pip コマンド全体がこのモジュールを経由するため、モジュールの読み込み時には
+# 素の pip でも使われる軽いモジュールだけを読み込む。json / argparse / subprocess や
+# pip の install コマンドなどは license / install の処理の中で必要になった時点で読み込む
+import functools
 import os
+import re
 import sys
-import argparse
-import subprocess
-from pathlib import Path
-from pip._internal.commands import create_command
 
 # 現在のプロジェクトディレクトリを取得
 CURRENT_DIR = os.getcwd()
 REQUIREMENTS_LICENSE_PATH = os.path.join(CURRENT_DIR, "requirements_license.txt")
 LICENSE_CONFIG_PATH = os.path.join(CURRENT_DIR, "allowed_licenses.json")
 
+# パッケージ情報の取得方法
+# "importlib": 現在のプロセス内で importlib.metadata を読む（デフォルト）
+# "subprocess": パッケージごとに pip show を実行する（明示的に指定した場合のみ）
+METADATA_BACKENDS = ("importlib", "subprocess")
+METADATA_BACKEND = os.environ.get("PIP_LICENSE_METADATA_BACKEND", "importlib")
+
+# ライセンス解決結果の永続キャッシュ（ユーザーのキャッシュディレクトリに保存）
+CACHE_DIR = os.environ.get("PIP_LICENSE_CACHE_DIR") or os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "pip-license-checker",
+)
+METADATA_CACHE_ENABLED = os.environ.get("PIP_LICENSE_NO_CACHE", "") == ""
+DEFAULT_CACHE_MAX_ENTRIES = int(os.environ.get("PIP_LICENSE_CACHE_MAX_ENTRIES", "10000"))
+# プロジェクトや環境をまたいで共有するキャッシュ（CACHE_DIR/licenses）のエントリー数の上限
+DEFAULT_SHARED_CACHE_MAX_ENTRIES = int(os.environ.get("PIP_LICENSE_SHARED_CACHE_MAX_ENTRIES", "50000"))
+
+# メタデータにライセンスがない場合に LICENSE / COPYING の本文を照合する索引
+# （tools/build_license_index.py で生成し、pip_license_checker_data に同梱）
+LICENSE_TEXT_INDEX_PATH = os.environ.get("PIP_LICENSE_TEXT_INDEX") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "pip_license_checker_data", "license-index.json.gz")
+
+class _LazyPattern:
+    """初めて使われた時点でコンパイルする正規表現です
+
+    素の pip の起動を遅くしないよう、モジュールの読み込み時にはコンパイルしません。
+    一度取り出した match などのメソッドはインスタンスに保存し、次からは通常の属性として参照します。
+    """
+
+    def __init__(self, pattern, flags=0):
+        self._pattern = pattern
+        self._flags = flags
+
+    def __getattr__(self, name):
+        value = getattr(re.compile(self._pattern, self._flags), name)
+        setattr(self, name, value)
+        return value
+
+# dist-info / egg-info ディレクトリ名（name-version.dist-info）
+_DIST_INFO_DIR_RE = _LazyPattern(r"^(?P<name>[^-]+)(?:-(?P<version>[^-]+?))?(?:-py[^-]*)?\.(?:dist|egg)-info$")
+
+# フェーズごとの計測（--timings / --trace、または環境変数 PIP_LICENSE_TIMINGS / PIP_LICENSE_TRACE）
+PROFILE_TIMINGS = os.environ.get("PIP_LICENSE_TIMINGS", "") != ""
+PROFILE_TRACE_PATH = os.environ.get("PIP_LICENSE_TRACE") or None
+
+class Profiler:
+    """コマンドの各フェーズの所要時間とサブプロセス数・書き込みバイト数を記録します
+
+    記録したスパンは Chrome のトレースイベント形式で書き出すため、
+    chrome://tracing や Perfetto (https://ui.perfetto.dev) でそのまま読み込めます。
+    """
+
+    def __init__(self):
+        import threading
+        import time
+        self._clock = time.perf_counter
+        self._origin = self._clock()
+        self._lock = threading.Lock()
+        self._thread_id = threading.get_ident
+        self._pid = os.getpid()
+        self.events = []
+        self.counters = {"subprocesses": 0, "files_written": 0, "bytes_written": 0}
+        self._hooked = None
+
+    def now(self):
+        """計測開始からの経過時間（マイクロ秒）を返します"""
+        return (self._clock() - self._origin) * 1e6
+
+    def add_span(self, name, category, start, end, args):
+        event = {"name": name, "cat": category, "ph": "X", "ts": start, "dur": end - start,
+                 "pid": self._pid, "tid": self._thread_id()}
+        if args:
+            event["args"] = args
+        with self._lock:
+            self.events.append(event)
+
+    def count(self, name, amount=1):
+        """カウンターを増やし、トレースにもカウンターイベントとして記録します"""
+        with self._lock:
+            self.counters[name] += amount
+            self.events.append({"name": name, "ph": "C", "ts": self.now(), "pid": self._pid,
+                                "args": {name: self.counters[name]}})
+
+    def hook_subprocesses(self):
+        """このプロセスから起動されるサブプロセス（pip 自身が起動するものを含む）を数えます"""
+        import subprocess
+        original = subprocess.Popen.__init__
+        profiler = self
+
+        def counting_init(popen, args, *rest, **kwargs):
+            profiler.count("subprocesses")
+            start = profiler.now()
+            result = original(popen, args, *rest, **kwargs)
+            profiler.add_span("subprocess.spawn", "subprocess", start, profiler.now(),
+                              {"args": args if isinstance(args, str) else [str(arg) for arg in args]})
+            return result
+
+        subprocess.Popen.__init__ = counting_init
+        self._hooked = (subprocess.Popen, original)
+
+    def close(self):
+        if self._hooked is not None:
+            popen, original = self._hooked
+            popen.__init__ = original
+            self._hooked = None
+
+    def summary(self):
+        """フェーズごとの回数・合計時間・最大時間の表を返します"""
+        totals = {}
+        for event in self.events:
+            if event["ph"] != "X":
+                continue
+            entry = totals.setdefault((event["cat"], event["name"]), [0, 0.0, 0.0])
+            entry[0] += 1
+            entry[1] += event["dur"]
+            entry[2] = max(entry[2], event["dur"])
+        rows = [(f"{category}:{name}", count, total / 1000, longest / 1000)
+                for (category, name), (count, total, longest) in totals.items()]
+        rows.sort(key=lambda row: -row[2])
+        header = ("フェーズ", "回数", "合計(ms)", "最大(ms)")
+        table = [header] + [(name, str(count), f"{total_ms:.1f}", f"{longest_ms:.1f}")
+                            for name, count, total_ms, longest_ms in rows]
+        widths = [max(_display_width(row[column]) for row in table) for column in range(len(header))]
+        lines = []
+        for row in table:
+            cells = [row[0] + " " * (widths[0] - _display_width(row[0]))]
+            cells += [" " * (width - _display_width(cell)) + cell for cell, width in zip(row[1:], widths[1:])]
+            lines.append("  ".join(cells))
+        lines.append(f"全体: {self.now() / 1000:.1f} ms / サブプロセス: {self.counters['subprocesses']} 回 / "
+                     f"書き込み: {self.counters['files_written']} ファイル {self.counters['bytes_written']} バイト")
+        return "\n".join(lines)
+
+    def write_trace(self, path):
+        """トレースイベント形式の JSON を書き出します"""
+        import json
+        with open(path, 'w') as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms",
+                       "otherData": dict(self.counters, tool="pip-license-checker")}, f)
+
+def _display_width(text):
+    """端末での表示幅（全角文字は2）を返します"""
+    import unicodedata
+    return sum(2 if unicodedata.east_asian_width(char) in "WF" else 1 for char in text)
+
+class _Span:
+    """with 文で囲んだ区間をプロファイラーにスパンとして記録します"""
+
+    __slots__ = ("profiler", "name", "category", "args", "start")
+
+    def __init__(self, profiler, name, category, args):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = self.profiler.now()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.add_span(self.name, self.category, self.start, self.profiler.now(), self.args)
+        return False
+
+class _NullSpan:
+    """計測が無効な場合に使う何もしないスパンです"""
+
+    __slots__ = ()
+    args = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_SPAN = _NullSpan()
+_PROFILER = None
+
+def profile_span(name, category="phase", **args):
+    """計測が有効であればスパンを、無効であれば何もしないスパンを返します"""
+    if _PROFILER is None:
+        return _NULL_SPAN
+    return _Span(_PROFILER, name, category, args)
+
+def profiled(name, category="phase"):
+    """関数の呼び出しをスパンとして記録するデコレーターです"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _PROFILER is None:
+                return func(*args, **kwargs)
+            with _Span(_PROFILER, name, category, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def profile_count(name, amount=1):
+    """計測が有効であればカウンターを増やします"""
+    if _PROFILER is not None:
+        _PROFILER.count(name, amount)
+
+# デフォルトの許可ライセンスリスト
+DEFAULT_ALLOWED_LICENSES = [
+    "MIT", 
+    "BSD", 
+    "Apache-2.0", 
+    "Apache Software License",
+    "Apache License, Version 2.0",
+    "Python Software Foundation License",
+    "Copyright (c) 2005-2024, NumPy Developers.",
+    "Dual License"
+]
+
+class AllowlistStore:
+    """allowed_licenses.json の内容をプロセス内に保持する設定ストアです
+
+    ファイルは最初に必要になった時点で一度だけ読み込み、以降は mtime/サイズが
+    変わった場合にだけ読み直します。変更はメモリ上にまとめておき、commit() で
+    一時ファイルへの書き込みとリネームによって一度だけ（fsync 付きで）保存します。
+    保存は助言ロックを取って行い、読み込んだ後に別のプロセスが保存していた場合は
+    その内容にこのプロセスでの追加・削除を重ねるため、同時に実行しても変更は失われません。
+    "rules" のルール（パターンや拒否、パッケージごとの例外）は手で編集するものとして、
+    読み込んだ内容をそのまま保存し直します。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._licenses = None
+        self._rules = []
+        # 最後に読み込んだ（または保存した）ときのファイルの内容
+        self._base = []
+        self._stamp = None
+        self._dirty = False
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _read(self):
+        """ファイルを読み込みます（存在しない・空・破損の場合はデフォルト値にして保存を予約）"""
+        import json
+        stamp = self._stat()
+        if stamp is None:
+            self._licenses = list(DEFAULT_ALLOWED_LICENSES)
+            self._rules = []
+            self._base = []
+            self._dirty = True
+            print(f"✅ 許可ライセンス設定ファイルを作成します: {self.path}")
+            return
+        try:
+            with open(self.path, 'r') as f:
+                config = json.load(f)
+            licenses = config.get("allowed_licenses") if isinstance(config, dict) else None
+            self._rules = _rules_from_config(config)
+        except (OSError, ValueError) as e:
+            # 破損したJSONはデフォルト値で修復する
+            print(f"⚠️ 許可リストファイルの読み込みエラー: {e}")
+            print(f"✅ 破損した許可ライセンス設定ファイルを修復します: {self.path}")
+            licenses = None
+            self._rules = []
+        else:
+            if not licenses:
+                print("✅ 空の許可リストを検出したためデフォルト値を設定します")
+        self._stamp = stamp
+        self._base = list(licenses or [])
+        if licenses:
+            self._licenses = list(licenses)
+        else:
+            self._licenses = list(DEFAULT_ALLOWED_LICENSES)
+            self._dirty = True
+
+    def load(self):
+        """許可リストを返します（ファイルが外部で変更されていれば読み直します）"""
+        if self._licenses is None or (not self._dirty and self._stat() != self._stamp):
+            with profile_span("config.load", "config", path=self.path):
+                self._read()
+        return list(self._licenses)
+
+    def load_rules(self):
+        """ルールのリストを返します"""
+        self.load()
+        return list(self._rules)
+
+    def save(self, allowed_licenses):
+        """許可リストを更新します（ファイルへの書き込みは commit() で行います）"""
+        # Noneや空の値を除外し、順序を保ったまま重複を除去する
+        licenses = list(dict.fromkeys(lic for lic in allowed_licenses if lic and lic.strip()))
+        if not licenses:
+            print("⚠️ 警告: 空のライセンスリストが渡されました。デフォルト値を使用します。")
+            licenses = list(DEFAULT_ALLOWED_LICENSES)
+        if self._licenses is None:
+            self._read()
+        if licenses != self._licenses:
+            self._licenses = licenses
+            self._dirty = True
+
+    def commit(self):
+        """保留中の変更を一度だけアトミックにファイルへ書き込みます"""
+        import json
+        if not self._dirty:
+            return False
+        with profile_span("config.commit", "config", path=self.path), _FileLock(_lock_path(self.path)):
+            if self._stat() != self._stamp:
+                self._licenses = self._merge_saved()
+            config = {"allowed_licenses": self._licenses}
+            if self._rules:
+                config["rules"] = self._rules
+            _write_text_atomic(self.path, json.dumps(config, indent=2), durable=True)
+            self._stamp = self._stat()
+        self._base = list(self._licenses)
+        self._dirty = False
+        print(f"✅ 許可リストを保存しました: {len(self._licenses)}個のライセンス")
+        return True
+
+    def _merge_saved(self):
+        """別のプロセスが保存した内容に、このプロセスでの追加・削除を重ねた許可リストを返します"""
+        import json
+        try:
+            with open(self.path, 'r') as f:
+                config = json.load(f)
+            saved = config.get("allowed_licenses") or []
+        except (OSError, ValueError, AttributeError):
+            return self._licenses
+        # ルールは保存されている方を使う
+        self._rules = _rules_from_config(config)
+        added = [lic for lic in self._licenses if lic not in self._base]
+        removed = set(self._base) - set(self._licenses)
+        merged = [lic for lic in saved if lic not in removed] + [lic for lic in added if lic not in saved]
+        return list(dict.fromkeys(merged)) or self._licenses
+
+def _rules_from_config(config):
+    """allowed_licenses.json の "rules" を返します（ない場合や形式が違う場合は空）"""
+    rules = config.get("rules") if isinstance(config, dict) else None
+    return [rule for rule in rules if isinstance(rule, dict)] if isinstance(rules, list) else []
+
+_ALLOWLIST_STORE = None
+
+def get_allowlist_store():
+    """プロセス内で共有する許可リストのストアを返します"""
+    global _ALLOWLIST_STORE
+    if _ALLOWLIST_STORE is None or _ALLOWLIST_STORE.path != LICENSE_CONFIG_PATH:
+        _ALLOWLIST_STORE = AllowlistStore(LICENSE_CONFIG_PATH)
+    return _ALLOWLIST_STORE
+
+def commit_allowed_licenses():
+    """許可リストへの変更をまとめてファイルに書き込みます"""
+    if _ALLOWLIST_STORE is not None:
+        _ALLOWLIST_STORE.commit()
+
 def ensure_config_exists():
     """設定ファイルが存在することを確認し、存在しない場合は作成します"""
-    # デフォルトの許可ライセンスリスト
-    default_allowed_licenses = [
-        "MIT", 
-        "BSD", 
-        "Apache-2.0", 
-        "Apache Software License",
-        "Apache License, Version 2.0",
-        "Python Software Foundation License",
-        "Copyright (c) 2005-2024, NumPy Developers.",
-        "Dual License"
-    ]
-    
-    # ファイルが存在しない場合は作成
-    if not os.path.exists(LICENSE_CONFIG_PATH):
-        with open(LICENSE_CONFIG_PATH, 'w') as f:
-            json.dump({"allowed_licenses": default_allowed_licenses}, f, indent=2)
-        print(f"✅ 許可ライセンス設定ファイルを作成しました: {LICENSE_CONFIG_PATH}")
-        return
-    
-    # ファイルは存在するが、内容を確認する
-    try:
-        with open(LICENSE_CONFIG_PATH, 'r') as f:
-            config = json.load(f)
-            
-        # 許可リストが空または存在しない場合はデフォルト値を設定
-        if "allowed_licenses" not in config or not config["allowed_licenses"]:
-            print("✅ 空の許可リストを検出したためデフォルト値を設定します")
-            config["allowed_licenses"] = default_allowed_licenses
-            
-            with open(LICENSE_CONFIG_PATH, 'w') as f:
-                json.dump(config, f, indent=2)
-                f.flush()
-                os.fsync(f.fileno())
-            print(f"✅ 空の許可リストにデフォルト値を設定しました: {LICENSE_CONFIG_PATH}")
-            
-    except (json.JSONDecodeError, FileNotFoundError, IOError) as e:
-        # 破損したJSONを修復
-        print(f"⚠️ 許可リストファイルの読み込みエラー: {e}")
-        with open(LICENSE_CONFIG_PATH, 'w') as f:
-            json.dump({"allowed_licenses": default_allowed_licenses}, f, indent=2)
-            f.flush()
-            os.fsync(f.fileno())
-        print(f"✅ 破損した許可ライセンス設定ファイルを修復しました: {LICENSE_CONFIG_PATH}")
+    store = get_allowlist_store()
+    store.load()
+    store.commit()
 
 def ensure_requirements_license_exists():
     """requirements_license.txtが存在することを確認し、存在しない場合は作成します"""
     if not os.path.exists(REQUIREMENTS_LICENSE_PATH):
+        profile_count("files_written")
+        profile_count("bytes_written", len(REQUIREMENTS_LICENSE_HEADER.encode('utf-8')))
         with open(REQUIREMENTS_LICENSE_PATH, 'w') as f:
-            f.write("# このファイルにはインストールされたパッケージとそのライセンスが記録されます\n")
-            f.write("# format: [ステータス] package_name==version [license] [インストールタイプ]\n")
-            f.write("# ステータス: ✅=許可済み, ❓=未確認\n")
+            f.write(REQUIREMENTS_LICENSE_HEADER)
         print(f"✅ ライセンス要件ファイルを作成しました: {REQUIREMENTS_LICENSE_PATH}")
 
 def load_allowed_licenses():
     """許可されたライセンスのリストを読み込みます"""
-    # 設定ファイルの存在確認（空の場合はデフォルト値が設定される）
-    ensure_config_exists()
-    
-    # デフォルトの許可リスト（フォールバック用）
-    default_allowed_licenses = [
-        "MIT", 
-        "BSD", 
-        "Apache-2.0", 
-        "Apache Software License",
-        "Apache License, Version 2.0",
-        "Python Software Foundation License",
-        "Copyright (c) 2005-2024, NumPy Developers.",
-        "Dual License"
-    ]
-    
-    try:
-        with open(LICENSE_CONFIG_PATH, 'r') as f:
-            config = json.load(f)
-        
-        # 許可リストを取得（空の場合はデフォルト値を使用）
-        allowed_licenses = config.get("allowed_licenses", [])
-        if not allowed_licenses:
-            print("⚠️ 許可リストが空のため、デフォルト値を使用します")
-            return default_allowed_licenses
-        
-        return allowed_licenses
-    except Exception as e:
-        print(f"⚠️ 許可リストの読み込み中にエラーが発生しました: {e}")
-        print("⚠️ デフォルトの許可リストを使用します")
-        return default_allowed_licenses
+    return get_allowlist_store().load()
+
+def load_license_rules():
+    """allowed_licenses.json のルール（パターン・拒否・パッケージごとの例外）を読み込みます"""
+    return get_allowlist_store().load_rules()
 
 def save_allowed_licenses(allowed_licenses):
-    """許可されたライセンスのリストを保存します"""
-    # 空のリストが渡された場合は、デフォルト値を使用する
-    if not allowed_licenses:
-        print("⚠️ 警告: 空のライセンスリストが渡されました。デフォルト値を使用します。")
-        allowed_licenses = [
-            "MIT", 
-            "BSD", 
-            "Apache-2.0", 
-            "Apache Software License",
-            "Apache License, Version 2.0",
-            "Python Software Foundation License",
-            "Copyright (c) 2005-2024, NumPy Developers.",
-            "Dual License"
-        ]
-    
-    # 設定ファイルの存在を確認
-    ensure_config_exists()
-    
-    # 保存前にライセンスリストからNoneや空の値を除外
-    allowed_licenses = [lic for lic in allowed_licenses if lic and lic.strip()]
-    
-    # それでも空の場合はデフォルト値を使用
-    if not allowed_licenses:
-        print("⚠️ 警告: フィルタリング後も許可リストが空です。デフォルト値を使用します。")
-        allowed_licenses = [
-            "MIT", 
-            "BSD", 
-            "Apache-2.0", 
-            "Apache Software License",
-            "Apache License, Version 2.0",
-            "Python Software Foundation License",
-            "Copyright (c) 2005-2024, NumPy Developers.",
-            "Dual License"
-        ]
-    
-    # 重複を除去
-    allowed_licenses = list(set(allowed_licenses))
-    
-    print(f"許可リストに保存されるライセンス: {allowed_licenses}")
-    
-    # 保存処理を実行
-    try:
-        # ファイルに書き込む
-        with open(LICENSE_CONFIG_PATH, 'w') as f:
-            json.dump({"allowed_licenses": allowed_licenses}, f, indent=2)
-            f.flush()  # 確実にディスクに書き込む
-            os.fsync(f.fileno())  # OSレベルでのフラッシュを確実に行う
-        
-        # 書き込み後に再度読み込んで確認
-        with open(LICENSE_CONFIG_PATH, 'r') as f:
-            saved_config = json.load(f)
-        
-        if saved_config.get("allowed_licenses") == allowed_licenses:
-            print(f"✅ 許可リストを正常に更新しました: {len(allowed_licenses)}個のライセンス")
-        else:
-            print("❌ 許可リストの保存に問題がありました")
-            # 問題があった場合は再度保存を試みる
-            with open(LICENSE_CONFIG_PATH, 'w') as f:
-                json.dump({"allowed_licenses": allowed_licenses}, f, indent=2)
-                f.flush()
-                os.fsync(f.fileno())
-            print("✅ 2回目の試行で許可リストを保存しました")
-    except Exception as e:
-        print(f"❌ 許可リストの保存中にエラーが発生しました: {e}")
-        # エラー時のフォールバック処理
-        try:
-            with open(LICENSE_CONFIG_PATH, 'w') as f:
-                json.dump({"allowed_licenses": allowed_licenses}, f, indent=2)
-            print("✅ フォールバック処理で許可リストを保存しました")
-        except Exception as e2:
-            print(f"❌ フォールバック処理でもエラーが発生しました: {e2}")
+    """許可されたライセンスのリストを保存します（コマンドの最後にまとめて書き込まれます）"""
+    get_allowlist_store().save(allowed_licenses)
+
+# 標準形式への変換マッピング
+_LICENSE_MAPPING = {
+    "mit": "MIT",
+    "bsd": "BSD",
+    "apache": "Apache",
+    "apache2": "Apache-2.0",
+    "apache-2.0": "Apache-2.0",
+    "apache 2.0": "Apache-2.0",
+    "apache license 2.0": "Apache-2.0",
+    "apache software license": "Apache-2.0",
+    "gnu gpl": "GPL",
+    "gnu general public license": "GPL",
+    "gnu lesser general public license": "LGPL",
+    "gnu library or lesser general public license": "LGPL",
+    "mozilla public license": "MPL",
+    "python software foundation": "PSF",
+    "python software foundation license": "PSF",
+}
 
+@functools.lru_cache(maxsize=None)
 def normalize_license_name(license_name):
     """ライセンス名を正規化します（大文字小文字やハイフンなどの違いを無視）"""
     if not license_name:
@@ -180,90 +417,1006 @@ def normalize_license_name(license_name):
     
     # 特定のライセンス表記を標準化
     normalized = license_name.lower().strip()
-    
-    # 標準形式への変換マッピング
-    license_mapping = {
-        "mit": "MIT",
-        "bsd": "BSD",
-        "apache": "Apache",
-        "apache2": "Apache-2.0",
-        "apache-2.0": "Apache-2.0",
-        "apache 2.0": "Apache-2.0",
-        "apache license 2.0": "Apache-2.0",
-        "apache software license": "Apache-2.0",
-        "gnu gpl": "GPL",
-        "gnu general public license": "GPL",
-        "gnu lesser general public license": "LGPL",
-        "gnu library or lesser general public license": "LGPL",
-        "mozilla public license": "MPL",
-        "python software foundation": "PSF",
-        "python software foundation license": "PSF",
-    }
+    squashed = normalized.replace(" ", "").replace("-", "").replace("_", "")
     
     # 正規化された名前をライセンスマッピングで検索
-    for key, value in license_mapping.items():
-        if key in normalized.replace(" ", "").replace("-", "").replace("_", ""):
+    for key, value in _LICENSE_MAPPING.items():
+        if key in squashed:
             return value
     
     # マッピングにない場合は元の値を返す（小文字や空白の処理などは行わない）
     return license_name
 
-def update_requirements_license(package_name, version, license_info, requires=None, is_direct=True):
-    """requirements_license.txtファイルを更新します"""
-    ensure_requirements_license_exists()
-    
-    # 既存のファイルを読み込む
-    lines = []
-    if os.path.exists(REQUIREMENTS_LICENSE_PATH):
-        with open(REQUIREMENTS_LICENSE_PATH, 'r') as f:
-            lines = f.readlines()
+# ライセンスの判定方法の版（判定の仕組みを変えた場合に上げると、保存済みの判定結果が無効になる）
+LICENSE_MATCHING_VERSION = 3
+
+# SPDX ライセンス式（PEP 639 の License-Expression）の字句: 括弧、またはライセンス識別子・演算子
+_SPDX_TOKEN_RE = _LazyPattern(r"\s*(?:([()])|([A-Za-z0-9][A-Za-z0-9.+:-]*))")
+_SPDX_OPERATORS = ("and", "or", "with")
+
+@functools.lru_cache(maxsize=None)
+def parse_license_expression(expression):
+    """SPDX ライセンス式（AND / OR / WITH と括弧）を構文木にします
+
+    構文木は ("license", 識別子, 例外またはNone) / ("and", (子, ...)) / ("or", (子, ...)) の
+    タプルです。"MIT License" のように式として解釈できない文字列の場合は None を返します。
+    同じ式は一度だけ解析します。
+    """
+    if not expression:
+        return None
+    tokens = []
+    position = 0
+    expression = expression.strip()
+    while position < len(expression):
+        match = _SPDX_TOKEN_RE.match(expression, position)
+        if match is None or match.end() == position:
+            return None
+        paren, word = match.groups()
+        if paren:
+            tokens.append(paren)
+        else:
+            # 演算子は大文字小文字を区別しない（"MIT or Apache-2.0" も式として扱う）
+            tokens.append(word.lower() if word.lower() in _SPDX_OPERATORS else ("id", word))
+        position = match.end()
+
+    def parse_or(index):
+        node, index = parse_and(index)
+        children = [node]
+        while index < len(tokens) and tokens[index] == "or":
+            node, index = parse_and(index + 1)
+            children.append(node)
+        return (children[0] if len(children) == 1 else ("or", tuple(children))), index
+
+    def parse_and(index):
+        node, index = parse_with(index)
+        children = [node]
+        while index < len(tokens) and tokens[index] == "and":
+            node, index = parse_with(index + 1)
+            children.append(node)
+        return (children[0] if len(children) == 1 else ("and", tuple(children))), index
+
+    def parse_with(index):
+        if index >= len(tokens):
+            raise ValueError("式が途中で終わっています")
+        token = tokens[index]
+        if token == "(":
+            node, index = parse_or(index + 1)
+            if index >= len(tokens) or tokens[index] != ")":
+                raise ValueError("括弧が閉じていません")
+            return node, index + 1
+        if not isinstance(token, tuple):
+            raise ValueError(f"ライセンス識別子が必要です: {token}")
+        if index + 1 < len(tokens) and tokens[index + 1] == "with":
+            if index + 2 >= len(tokens) or not isinstance(tokens[index + 2], tuple):
+                raise ValueError("WITH の後に例外の識別子が必要です")
+            return ("license", token[1], tokens[index + 2][1]), index + 3
+        return ("license", token[1], None), index + 1
+
+    try:
+        tree, index = parse_or(0)
+    except ValueError:
+        return None
+    return tree if index == len(tokens) else None
+
+# ルールで指定できる項目（"allow" / "deny" のどちらか1つとパターンは必須）
+_RULE_ACTIONS = ("deny", "allow")
+_RULE_KEYS = frozenset(_RULE_ACTIONS + ("regex", "package", "version", "comment"))
+
+def _glob_to_regex(pattern):
+    """* と ? だけを特別扱いするグロブを、1行（照合対象の1項目）の中だけに一致する正規表現にします"""
+    return "".join(".*" if c == "*" else "." if c == "?" else re.escape(c) for c in pattern)
+
+def _compile_license_rule(rule):
+    """ルールを (許可するか, 具体度, パッケージとバージョンの正規表現, ライセンス名の正規表現) にします
+
+    ルールが不正な場合は ValueError を送出します。
+    """
+    actions = [action for action in _RULE_ACTIONS if action in rule]
+    if len(actions) != 1:
+        raise ValueError(f'"allow" か "deny" のどちらか1つを指定してください: {rule}')
+    unknown = set(rule) - _RULE_KEYS
+    if unknown:
+        raise ValueError(f"不明な項目です（{', '.join(sorted(unknown))}）: {rule}")
+    pattern = rule[actions[0]]
+    if not isinstance(pattern, str) or not pattern.strip():
+        raise ValueError(f"ライセンスのパターンが空です: {rule}")
+    if rule.get("regex"):
+        # 1つの正規表現に連結するため、グループの名前や番号に依存するものは使えない
+        if re.search(r"\\[1-9]|\(\?P[<=]", pattern):
+            raise ValueError(f"正規表現のルールでは名前付きグループと後方参照は使えません: {pattern}")
+        license_re = f".*?(?:{pattern}).*"
+    else:
+        license_re = _glob_to_regex(pattern.strip())
     
-    # 許可されたライセンスのリストを取得
-    allowed_licenses = load_allowed_licenses()
+    package, version = rule.get("package"), rule.get("version")
+    if version is not None and package is None:
+        raise ValueError(f'"version" は "package" と一緒に指定してください: {rule}')
+    scope_re = None
+    if package is not None:
+        scope_re = (_glob_to_regex(_canonical_name(str(package))) + r"\n"
+                    + (_glob_to_regex(str(version)) if version is not None else ".*"))
+    re.compile(license_re, re.IGNORECASE | re.MULTILINE)
+    return actions[0] == "allow", 2 if version is not None else 1 if package is not None else 0, scope_re, license_re
+
+class LicenseRules:
+    """allowed_licenses.json の "rules" を1つの選択の正規表現にまとめた照合器です
+
+    ルールは具体的なもの（バージョン指定 > パッケージ指定 > 指定なし）から順に、同じ具体度では
+    拒否を先にして選択肢に並べます。Python の正規表現は選択肢を左から試すため、最初に一致した
+    選択肢（lastgroup）が優先されるルールそのものになり、ルールの数によらず1回の照合で判定できます。
+    照合対象は「正規化したパッケージ名\nバージョン\nライセンス名」で、パッケージを指定したルールと
+    しないルールはそれぞれ別の正規表現にまとめます。ライセンス名は元の表記と（normalize が真なら）
+    正規化した表記の両方で照合し、優先される方のルールを使います。
+    """
+
+    def __init__(self, rules):
+        compiled = []
+        for position, rule in enumerate(rules):
+            try:
+                compiled.append((position,) + _compile_license_rule(rule))
+            except (ValueError, re.error) as e:
+                print(f"⚠️ 許可リストのルールを無視します: {e}")
+        compiled.sort(key=lambda item: (-item[2], item[1], item[0]))
+        
+        # グループ名 → (優先順位, 許可するか)
+        self._rules = {}
+        scoped, unscoped, scopes = [], [], []
+        for rank, (position, allow, _, scope_re, license_re) in enumerate(compiled):
+            group = f"r{position}"
+            self._rules[group] = (rank, allow)
+            if scope_re is None:
+                unscoped.append(f"(?P<{group}>(?:{license_re})\\Z)")
+            else:
+                scoped.append(f"(?P<{group}>{scope_re}\\n(?:{license_re})\\Z)")
+                scopes.append(f"(?:{scope_re})\\Z")
+        flags = re.IGNORECASE | re.MULTILINE
+        self._unscoped = re.compile("|".join(unscoped), flags) if unscoped else None
+        self._scoped = re.compile("|".join(scoped), flags) if scoped else None
+        self._scopes = re.compile("|".join(scopes), flags) if scopes else None
+
+    def __len__(self):
+        return len(self._rules)
+
+    @property
+    def has_package_rules(self):
+        return self._scoped is not None
+
+    def applies_to(self, name, version):
+        """パッケージを指定したルールのどれかがこのパッケージに当てはまるかを返します"""
+        return self._scopes is not None and \
+            self._scopes.match(f"{_canonical_name(name)}\n{version or ''}") is not None
+
+    def verdict(self, license_info, name=None, version=None, normalize=True):
+        """最も優先されるルールの判定（許可なら True、拒否なら False、どれにも一致しなければ None）を返します"""
+        license_info = (license_info or "").replace("\n", " ")
+        spellings = dict.fromkeys((license_info, normalize_license_name(license_info) if normalize else license_info))
+        if name is not None and self._scoped is not None:
+            prefix = f"{_canonical_name(name)}\n{version or ''}\n"
+            verdict = self._best(self._scoped.match(prefix + spelling) for spelling in spellings)
+            if verdict is not None:
+                return verdict
+        if self._unscoped is not None:
+            return self._best(self._unscoped.match(spelling) for spelling in spellings)
+        return None
+
+    def _best(self, matches):
+        found = [self._rules[match.lastgroup] for match in matches if match is not None]
+        return min(found)[1] if found else None
+
+class LicenseMatcher:
+    """許可リストから一度だけ構築するライセンス照合器です
+
+    許可ライセンスを正規化した集合と、照合済みライセンスの結果表を持つため、
+    同じライセンス名の2回目以降の判定は辞書の参照だけで済みます。照合器は
+    許可リストごとに作られるため、結果表は (ライセンス式, 許可リスト) ごとのメモになります。
+
+    "MIT OR Apache-2.0" のような SPDX ライセンス式は構文木にして、AND はすべて、
+    OR はいずれかの識別子が許可されていれば許可と判定します（X WITH 例外は X が
+    許可されていれば許可）。式として解釈できない文字列は従来どおり正規化して比較します。
+
+    rules（LicenseRules）がある場合は、一致したルールの判定を許可リストより優先します。
+    式は識別子ごとにルールと照合し、AND / OR はその結果で判定します。式全体をルールと
+    照合するのは、式として解釈できない場合と、許可リストにそのまま書かれた式の場合だけです
+    （後者は元の表記のみ。正規化は部分一致なので "GPL-3.0 AND MIT" が "MIT" になってしまう）。
+    許可リストにそのまま書かれた式では、ルールに一致しない識別子を許可として扱います。
+    パッケージを指定したルールが当てはまらないパッケージの判定は、ライセンスごとの結果表をそのまま共有します。
+    """
+
+    def __init__(self, allowed_licenses, rules=()):
+        self.allowed_licenses = list(allowed_licenses)
+        self.rules = list(rules)
+        self._allowed = {normalize_license_name(allowed) for allowed in self.allowed_licenses}
+        # 許可リストにそのまま書かれた式（"MIT OR GPL-3.0" など）は式全体で許可する
+        self._exact = {allowed.strip().casefold() for allowed in self.allowed_licenses if allowed}
+        self._rules = LicenseRules(self.rules) if self.rules else None
+        self._verdicts = {}
+
+    @property
+    def has_package_rules(self):
+        """パッケージやバージョンを指定したルールがあるか（同じライセンスでも判定が分かれうるか）"""
+        return self._rules is not None and self._rules.has_package_rules
+
+    def is_allowed(self, license_info, name=None, version=None):
+        """ライセンスが許可リストに含まれているか正規化して確認します（name / version はルールの例外の判定用）"""
+        if name is not None and self._rules is not None and self._rules.applies_to(name, version):
+            key = (license_info, _canonical_name(name), version)
+        else:
+            key, name, version = license_info, None, None
+        verdict = self._verdicts.get(key)
+        if verdict is None:
+            verdict = self._verdicts[key] = self._evaluate(license_info, name, version)
+        return verdict
+
+    def _evaluate(self, license_info, name=None, version=None, exact=False):
+        """exact が真なら、license_info が許可リストにそのまま書かれているものとして判定します"""
+        tree = parse_license_expression(license_info) if license_info else None
+        exact = exact or bool(license_info) and license_info.strip().casefold() in self._exact
+        if tree is None or exact:
+            if self._rules is not None:
+                # 単一の識別子や式でない名前だけを正規化した表記でも照合する
+                verdict = self._rules.verdict(license_info, name, version,
+                                              normalize=tree is None or tree[0] == "license")
+                if verdict is not None:
+                    return verdict
+            if tree is None:
+                return exact or normalize_license_name(license_info) in self._allowed
+        return self._satisfies(tree, name, version, True if exact else None)
+
+    def _satisfies(self, node, name=None, version=None, default=None):
+        kind = node[0]
+        if kind == "and":
+            return all(self._satisfies(child, name, version, default) for child in node[1])
+        if kind == "or":
+            return any(self._satisfies(child, name, version, default) for child in node[1])
+        _, identifier, exception = node
+        if self._rules is not None:
+            verdict = self._rules.verdict(identifier, name, version)
+            if verdict is not None:
+                return verdict
+        if default is not None:
+            return default
+        if exception and f"{identifier} with {exception}".casefold() in self._exact:
+            return True
+        return normalize_license_name(identifier) in self._allowed
+
+    def is_denied(self, license_info, name=None, version=None):
+        """ルールで拒否されているため、許可リストに追加しても許可にならないかを返します"""
+        return self._rules is not None and not self._evaluate(license_info, name, version, exact=True)
+
+    def add(self, license_info):
+        """許可ライセンスを追加します（照合器を作り直さずに反映）"""
+        self.allowed_licenses.append(license_info)
+        self._allowed.add(normalize_license_name(license_info))
+        if license_info:
+            self._exact.add(license_info.strip().casefold())
+        # 不許可と判定済みの結果だけが変わりうる
+        self._verdicts = {key: value for key, value in self._verdicts.items() if value}
+
+_LICENSE_MATCHERS = {}
+
+def get_license_matcher(allowed_licenses=None, rules=None):
+    """許可リストとルールに対応する照合器を返します（同じ内容には同じ照合器を共有）"""
+    if allowed_licenses is None:
+        allowed_licenses = load_allowed_licenses()
+    if rules is None:
+        rules = load_license_rules()
+    key = (tuple(allowed_licenses), _rules_key(rules))
+    matcher = _LICENSE_MATCHERS.get(key)
+    if matcher is None:
+        matcher = _LICENSE_MATCHERS[key] = LicenseMatcher(allowed_licenses, rules)
+    return matcher
+
+def _rules_key(rules):
+    """ルールのリストを比較・指紋用の文字列にします"""
+    if not rules:
+        return ""
+    import json
+    return json.dumps(rules, sort_keys=True, ensure_ascii=False)
+
+# requirements_license.txt のヘッダー
+REQUIREMENTS_LICENSE_HEADER = (
+    "# このファイルにはインストールされたパッケージとそのライセンスが記録されます\n"
+    "# format: [ステータス] package_name==version [license] [インストールタイプ]\n"
+    "# ステータス: ✅=許可済み, ❓=未確認\n"
+)
+INSTALL_TYPE_DIRECT = "直接インストール"
+INSTALL_TYPE_DEPENDENCY = "依存パッケージ"
+
+class LicenseRecord:
+    """requirements_license.txt の1エントリー（ステータス・名前・バージョン・ライセンス・インストールタイプ）です
+
+    数十万行のファイルも扱えるよう __slots__ で属性を固定し、種類の少ないライセンスと
+    インストールタイプの文字列は intern して同じ値を共有します。
+    """
+
+    __slots__ = ("status", "name", "version", "license", "install_type", "line")
+
+    def __init__(self, status, name, version, license_info, install_type, line=None):
+        self.status = status
+        self.name = name
+        self.version = version
+        self.license = sys.intern(license_info)
+        self.install_type = sys.intern(install_type)
+        # 整形し直すと変わってしまう行だけ、元の行をそのまま書き戻すために保持する
+        self.line = line
+
+    @property
+    def is_direct(self):
+        return self.install_type == INSTALL_TYPE_DIRECT
+
+    @classmethod
+    def parse(cls, line):
+        """1行を解析します（エントリーとして解釈できない行はNone）"""
+        text = line.rstrip('\n')
+        if not text or text.startswith('#') or ' ' not in text:
+            return None
+        status, rest = text.split(' ', 1)
+        name_version, sep, tail = rest.partition(' [')
+        if not sep or '==' not in name_version:
+            return None
+        name, _, version = name_version.partition('==')
+        # 末尾の [インストールタイプ] を切り離す（ライセンス名に ] が含まれていてもよい）
+        type_start = tail.rfind('] [')
+        if type_start == -1:
+            license_info, install_type = tail.rstrip(']'), ""
+        else:
+            license_info, install_type = tail[:type_start], tail[type_start + 3:].rstrip(']')
+        status = "✅" if status == "✅" else "❓"
+        record = cls(status, name.strip(), version.strip(), license_info, install_type)
+        if record.format() != line:
+            record.line = line
+        return record
+
+    def assign(self, status, name, version, license_info, install_type):
+        """内容を置き換えます（変わった場合は True）"""
+        if (self.status, self.name, self.version, self.license, self.install_type) == \
+                (status, name, version, license_info, install_type):
+            return False
+        self.status = status
+        self.name = name
+        self.version = version
+        self.license = sys.intern(license_info)
+        self.install_type = sys.intern(install_type)
+        self.line = None
+        return True
+
+    def format(self):
+        """requirements_license.txt の1行に整形します"""
+        if self.line is not None:
+            return self.line
+        install_type = f" [{self.install_type}]" if self.install_type else ""
+        return f"{self.status} {self.name}=={self.version} [{self.license}]{install_type}\n"
+
+class RequirementsLicenseFile:
+    """requirements_license.txt を解析したモデルです
+
+    コメント行や解釈できない行はそのまま保持し、エントリーは正規化した
+    パッケージ名で索引します。更新はメモリ上でまとめて行い、flush() で
+    一時ファイルへの書き込みとリネームによって一度だけ反映します。
+    flush() は助言ロックを取って行い、読み込んだ後に別のプロセスがファイルを
+    書き換えていた場合は、その内容にこのプロセスでの変更を適用し直してから書き込みます。
+    """
+
+    def __init__(self, path, lines=None, stamp=None):
+        self.path = path
+        self.exists = lines is not None
+        self._items = []
+        self._index = {}
+        self._dirty = not self.exists
+        self._stamp = stamp
+        # 読み込んだ後の変更の記録（flush 時に他のプロセスの変更と重ねるために使う）
+        self._changes = []
+        for line in (lines if lines is not None else REQUIREMENTS_LICENSE_HEADER.splitlines(True)):
+            if not line.endswith('\n'):
+                line += '\n'
+            record = LicenseRecord.parse(line)
+            if record is None:
+                self._items.append(line)
+            else:
+                key = _canonical_name(record.name)
+                # 正規化しても変わらない名前は同じ文字列オブジェクトを索引のキーにする
+                self._index.setdefault(record.name if key == record.name else key, len(self._items))
+                self._items.append(record)
+
+    @classmethod
+    @profiled("requirements.load", "io")
+    def load(cls, path=None):
+        """ファイルを読み込みます（存在しない場合はヘッダーだけの新しいモデル）"""
+        path = path or REQUIREMENTS_LICENSE_PATH
+        if not os.path.exists(path):
+            return cls(path)
+        with open(path, 'r') as f:
+            # 読み込む内容と同じファイルのスタンプ（開いた後に置き換えられても混ざらない）
+            st = os.fstat(f.fileno())
+            return cls(path, f, (st.st_mtime_ns, st.st_size))
+
+    def __iter__(self):
+        return (item for item in self._items if isinstance(item, LicenseRecord))
+
+    def __len__(self):
+        return len(self._index)
+
+    def get(self, name):
+        """パッケージ名（表記揺れは正規化）でエントリーを探します"""
+        position = self._index.get(_canonical_name(name))
+        return None if position is None else self._items[position]
+
+    def upsert(self, name, version, license_info, status, is_direct):
+        """エントリーを追加または置き換えます（直接インストールの記録は依存パッケージで上書きしない）"""
+        change = ("upsert", name, version, license_info, status, is_direct)
+        record = self.get(name)
+        if record is not None and record.is_direct:
+            is_direct = True
+        install_type = INSTALL_TYPE_DIRECT if is_direct else INSTALL_TYPE_DEPENDENCY
+        if record is None:
+            self._index[_canonical_name(name)] = len(self._items)
+            self._items.append(LicenseRecord(status, name, version, license_info, install_type))
+            self._dirty = True
+            self._changes.append(change)
+        elif record.assign(status, name, version, license_info, install_type):
+            self._dirty = True
+            self._changes.append(change)
+
+    def set_status(self, record, status):
+        """エントリーのステータスを変更します"""
+        if record.status != status:
+            record.status = status
+            record.line = None
+            self._dirty = True
+            self._changes.append(("status", record.name, status))
+
+    def flush(self):
+        """変更があればファイルに一度だけ書き込みます"""
+        if not self._dirty:
+            return False
+        with _FileLock(_lock_path(self.path)):
+            if _file_stamp(self.path) != self._stamp:
+                self._replay_onto_saved()
+            _write_text_atomic(self.path, "".join(
+                item.format() if isinstance(item, LicenseRecord) else item for item in self._items))
+            self._stamp = _file_stamp(self.path)
+        self._changes = []
+        if not self.exists:
+            print(f"✅ ライセンス要件ファイルを作成しました: {self.path}")
+            self.exists = True
+        self._dirty = False
+        return True
+
+    def _replay_onto_saved(self):
+        """別のプロセスが書き込んだ内容を読み込み、このプロセスでの変更を適用し直します"""
+        saved = RequirementsLicenseFile.load(self.path)
+        for change in self._changes:
+            if change[0] == "upsert":
+                saved.upsert(*change[1:])
+            else:
+                record = saved.get(change[1])
+                if record is not None:
+                    saved.set_status(record, change[2])
+        self._items, self._index = saved._items, saved._index
+        self.exists = self.exists or saved.exists
+
+def iter_requirements_license(lines):
+    """requirements_license.txt の行を1行ずつ (行, LicenseRecord または None) にします（エントリーでない行は None）"""
+    for line in lines:
+        if not line.endswith('\n'):
+            line += '\n'
+        yield line, LicenseRecord.parse(line)
+
+@profiled("requirements.rewrite", "io")
+def rewrite_requirements_license(path, update, append=None):
+    """requirements_license.txt を1回の走査で読みながら一時ファイルに書き出し、変更があれば置き換えます
+
+    ファイル全体をメモリに載せないため、行数によらず使うメモリはほぼ一定です。
+    update(record) はエントリーを必要に応じて書き換え、変更した場合に True を返します。
+    append() は走査の後に末尾へ追加するエントリーを返します。変更した件数を返します。
+    """
+    import contextlib
+    changed = 0
+    with _FileLock(_lock_path(path)):
+        exists = os.path.exists(path)
+        writer = _AtomicWriter(path)
+        source = open(path, 'r') if exists else contextlib.nullcontext(REQUIREMENTS_LICENSE_HEADER.splitlines(True))
+        with source as lines, writer as out:
+            for line, record in iter_requirements_license(lines):
+                if record is not None and update(record):
+                    changed += 1
+                    line = record.format()
+                out.write(line)
+            for record in (append() if append is not None else ()):
+                changed += 1
+                out.write(record.format())
+            if not changed and exists:
+                writer.discard()
+    if not exists:
+        print(f"✅ ライセンス要件ファイルを作成しました: {path}")
+    return changed
+
+def iter_license_records(path=None):
+    """requirements_license.txt のエントリーを1件ずつ返します（ファイル全体は読み込まない）"""
+    path = path or REQUIREMENTS_LICENSE_PATH
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for _, record in iter_requirements_license(f):
+            if record is not None:
+                yield record
+
+def update_requirements_license(package_name, version, license_info, requires=None, is_direct=True, inventory=None):
+    """requirements_license.txtファイルを更新します"""
+    owns_inventory = inventory is None
+    if owns_inventory:
+        inventory = RequirementsLicenseFile.load()
+    matcher = get_license_matcher()
     
-    # ライセンスのステータスを設定（正規化して比較）
-    normalized_license = normalize_license_name(license_info)
-    is_allowed = False
+    # ライセンスのステータスを設定（許可リストの照合器で正規化して比較）
+    status = "✅" if matcher.is_allowed(license_info, package_name, version) else "❓"
+    inventory.upsert(package_name, version, license_info, status, is_direct)
     
-    for allowed in allowed_licenses:
-        if normalize_license_name(allowed) == normalized_license:
-            is_allowed = True
-            break
+    # 依存パッケージの情報も追加（間接的な依存パッケージも含めてすべて記録する）
+    if requires and is_direct:
+        graph = build_dependency_graph(requires)
+        for req, req_version, req_license, _ in graph.nodes.values():
+            req_status = "✅" if matcher.is_allowed(req_license, req, req_version) else "❓"
+            if req_status == "❓":
+                print(f"⚠️ {req} ({req_license}) は許可リストにありません: "
+                      f"{' → '.join([package_name] + graph.path_to(req))}")
+            inventory.upsert(req, req_version, req_license, req_status, False)
     
-    status = "✅" if is_allowed else "❓"
+    if owns_inventory:
+        inventory.flush()
+
+@profiled("requirements.record", "phase")
+def record_dependency_graph(graph, inventory=None):
+    """依存関係グラフのパッケージをまとめてrequirements_license.txtに記録します（ルートは直接インストール）"""
+    owns_inventory = inventory is None
+    if owns_inventory:
+        inventory = RequirementsLicenseFile.load()
+    matcher = get_license_matcher()
+    root_keys = {_canonical_name(_requirement_name(root)) for root in graph.roots}
     
-    # パッケージがすでに存在するか確認
-    install_type = "[直接インストール]" if is_direct else "[依存パッケージ]"
-    package_entry = f"{status} {package_name}=={version} [{license_info}] {install_type}\n"
-    package_found = False
+    for key, (name, version, license_info, _) in graph.nodes.items():
+        status = "✅" if matcher.is_allowed(license_info, name, version) else "❓"
+        inventory.upsert(name, version, license_info, status, key in root_keys)
     
-    for i, line in enumerate(lines):
-        if package_name + "==" in line and not line.startswith('#'):
-            lines[i] = package_entry
-            package_found = True
-            break
+    if owns_inventory:
+        inventory.flush()
+
+def get_package_info(package_name, backend=None):
+    """パッケージの情報（バージョンとライセンス）を取得します"""
+    backend = backend or METADATA_BACKEND
+    if backend == "subprocess":
+        return _get_package_info_subprocess(package_name)
+    return _get_package_info_importlib(package_name)
+
+def _get_package_info_importlib(package_name):
+    """importlib.metadataからパッケージの情報をプロセス内で取得します"""
+    import importlib.metadata as metadata
+    try:
+        dist = metadata.distribution(_requirement_name(package_name))
+    except metadata.PackageNotFoundError:
+        return "Unknown", "Unknown", []
+    except Exception as e:
+        print(f"エラー: {e}")
+        return "Unknown", "Unknown", []
+    return _package_info_from_distribution(dist, _requirement_name(package_name))
+
+def _package_info_from_distribution(dist, package_name=None):
+    """importlib.metadataのDistributionから(version, license, requires)を組み立てます"""
+    return _load_distribution(dist, package_name)[1]
+
+def _load_distribution(dist, package_name=None):
+    """Distributionを読み込み (name, (version, license, requires)) を返します（永続キャッシュがあれば利用）"""
+    if _PROFILER is None:
+        return _read_distribution(dist, package_name)
+    with profile_span("metadata", "metadata") as span:
+        name, info = _read_distribution(dist, package_name)
+        span.args["package"] = name
+    return name, info
+
+def _read_distribution(dist, package_name=None):
+    """_load_distribution の本体です"""
+    name, version, license_info, requires, _ = _resolve_distribution(dist, package_name)
+    return name, (version, license_info, requires)
+
+# METADATA の内容だけで決まる取得元（共有キャッシュに保存してよいもの）
+_METADATA_LICENSE_SOURCES = ("License-Expression", "License", "Classifier")
+
+def _resolve_distribution(dist, package_name=None):
+    """Distributionを (name, version, license, requires, source) に解決します（永続キャッシュがあれば利用）"""
+    cache = get_metadata_cache()
+    identity = cache.identify(dist) if cache is not None else None
+    if identity is not None:
+        entry = cache.get(identity)
+        if entry is not None:
+            return (entry["name"], entry["version"], entry["license"],
+                    _requires_from_metadata(entry["requires_dist"]), entry.get("source"))
     
-    # パッケージが存在しない場合は追加
-    if not package_found:
-        lines.append(package_entry)
+    # パスでは見つからなくても、同じ内容の METADATA を別の環境で解決済みなら共有キャッシュから使う
+    shared_key, text, entry = _shared_metadata_lookup(dist)
+    if entry is not None:
+        if identity is not None:
+            cache.put(identity, entry["name"], entry["version"], entry["license"], entry["requires_dist"],
+                      entry["source"])
+        return (entry["name"], entry["version"], entry["license"],
+                _requires_from_metadata(entry["requires_dist"]), entry["source"])
     
-    # ファイルに書き込む
-    with open(REQUIREMENTS_LICENSE_PATH, 'w') as f:
-        f.writelines(lines)
+    name, version, license_info, requires_dist, source = _parse_distribution(dist, package_name, text)
+    if identity is not None and name and source is not None:
+        cache.put(identity, name, version, license_info, requires_dist, source)
+    _shared_metadata_store(shared_key, name, version, license_info, requires_dist, source)
+    return name, version, license_info, _requires_from_metadata(requires_dist), source
+
+def _shared_metadata_lookup(dist):
+    """共有キャッシュを METADATA の内容で引き、(キー, METADATA の本文, エントリー) を返します"""
+    shared = get_shared_license_cache()
+    if shared is None:
+        return None, None, None
+    text = _read_metadata_text(dist)
+    if not text:
+        return None, text, None
+    key = shared.key("metadata", text)
+    return key, text, shared.get(key)
+
+def _shared_metadata_store(key, name, version, license_info, requires_dist, source):
+    """METADATA だけで決まった解決結果を共有キャッシュに保存します
+
+    依存は環境マーカーを評価する前の Requires-Dist のまま保存し、読み出す側の環境で評価します。
+    """
+    if key is not None and name and source in _METADATA_LICENSE_SOURCES:
+        get_shared_license_cache().put(key, name=name, version=version, license=license_info,
+                                       requires_dist=list(requires_dist), source=source)
+
+def _parse_distribution(dist, package_name=None, text=None):
+    """Distributionのメタデータを解析して (name, version, license, requires_dist, source) を返します（キャッシュは使わない）
+
+    requires_dist は環境マーカーを評価する前の Requires-Dist の値のリストです（_requires_from_metadata で評価する）。
+    読み込み済みの METADATA の本文があれば text に渡します。読み込みに失敗した場合の source は None です。
+    """
+    try:
+        meta = _MetadataHeaders(text) if text else _read_metadata_headers(dist)
+        name = meta.get('Name') or package_name or ''
+        version = (meta.get('Version') or "Unknown").strip()
+        license_info, source = _license_from_metadata(meta)
+        requires_dist = list(meta.get_all('Requires-Dist') or [])
+
+        # それでも取得できない場合は同梱の LICENSE / COPYING の本文から推定する
+        if not license_info:
+            dist_path = getattr(dist, '_path', None)
+            license_info = _license_from_files(str(dist_path) if dist_path is not None else None,
+                                               str(dist.locate_file('')), meta, dist.read_text('RECORD'))
+            source = "License-File" if license_info else None
+
+        # 最終的にもライセンス情報がない場合は「Unknown」とする
+        if not license_info:
+            license_info, source = "Unknown", "Unknown"
+    except Exception as e:
+        print(f"エラー: {e}")
+        return package_name or '', "Unknown", "Unknown", [], None
+    return name, version, license_info, requires_dist, source
+
+class _MetadataHeaders:
+    """METADATA / PKG-INFO のヘッダー部分だけを読み込んだ軽量なメタデータです
+
+    email パッケージによる解析は本文まで処理するため、大量のパッケージを
+    扱う場合はヘッダーだけを直接読む方が高速です。get / get_all は
+    email.message.Message と同じ使い方ができます。
+    """
+
+    def __init__(self, text):
+        self._headers = {}
+        last = None
+        for line in (text or "").split('\n'):
+            line = line.rstrip('\r')
+            if not line:
+                # 空行以降は本文（Description）
+                break
+            if line[0] in ' \t':
+                # 継続行は直前のヘッダーに連結する
+                if last is not None:
+                    last[-1] += '\n' + line.strip()
+                continue
+            name, sep, value = line.partition(':')
+            if not sep:
+                continue
+            last = self._headers.setdefault(name.strip().lower(), [])
+            last.append(value.strip())
+
+    def get(self, name, default=None):
+        values = self._headers.get(name.lower())
+        return values[0] if values else default
+
+    def get_all(self, name, default=None):
+        return self._headers.get(name.lower(), default)
+
+    def __contains__(self, name):
+        return name.lower() in self._headers
+
+def _read_metadata_text(dist):
+    """DistributionのMETADATA（なければPKG-INFO）の本文を返します"""
+    text = dist.read_text('METADATA') or dist.read_text('PKG-INFO')
+    if text:
+        return text
+    # distutils の install_egg_info はディレクトリではなく `name-version-pyX.Y.egg-info` という
+    # PKG-INFO 形式の1ファイルを作り、importlib.metadata はそのファイル自体を Distribution のパスにする
+    path = getattr(dist, '_path', None)
+    if path is not None and os.path.isfile(path):
+        with open(path, encoding='utf-8', errors='replace') as f:
+            return f.read()
+    return None
+
+def _read_metadata_headers(dist):
+    """DistributionのMETADATA（なければPKG-INFO）のヘッダーを読み込みます"""
+    return _MetadataHeaders(_read_metadata_text(dist))
+
+def _license_from_metadata(meta):
+    """メタデータのLicense-Expression、Licenseフィールド、Classifierの順にライセンス名と取得元を取り出します"""
+    # PEP 639 の License-Expression（SPDX ライセンス式）があれば最優先で使用する
+    expression = (meta.get('License-Expression') or "").strip()
+    if expression:
+        return expression, "License-Expression"
     
-    # 依存パッケージの情報も追加
-    if requires and is_direct:
-        for req in requires:
-            req_version, req_license, req_deps = get_package_info(req)
-            update_requirements_license(req, req_version, req_license, None, False)
+    # pip show と同様に License フィールドの1行目を使用する
+    license_text = (meta.get('License') or "").strip()
+    if license_text:
+        return license_text.splitlines()[0].strip(), "License"
 
-def get_package_info(package_name):
-    """パッケージの情報（バージョンとライセンス）を取得します"""
+    # クラシファイアからライセンス情報を抽出
+    for classifier in meta.get_all('Classifier') or []:
+        if classifier.startswith('License ::'):
+            return classifier.split('::')[-1].strip(), "Classifier"
+    return "", None
+
+# ライセンス本文の指紋の作り方（変更した場合は LICENSE_TEXT_INDEX_VERSION を上げて索引を作り直す）
+LICENSE_TEXT_INDEX_VERSION = 1
+_LICENSE_SHINGLE_SIZE = 5
+# 連続する _LICENSE_WINNOW_SIZE 個のシングルごとに最小のハッシュだけを残す（winnowing）。
+# 一定の割合で間引くのと違い、共通する語の並びが十分に長ければ必ず指紋に現れる
+_LICENSE_WINNOW_SIZE = 4
+# 参照本文のシングルのうちこの割合以上がファイルに含まれていれば一致とみなす
+_LICENSE_MATCH_THRESHOLD = 0.8
+_LICENSE_FILE_MAX_BYTES = 256 * 1024
+_LICENSE_FILE_MAX_COUNT = 16
+_LICENSE_WORD_ALIASES = {"licence": "license", "licences": "licenses", "licenced": "licensed"}
+# ライセンスファイル名、著作権表示の行（年や著作者名が入るので照合の前に取り除く）、単語
+_LICENSE_FILE_NAME_RE = _LazyPattern(r"^(?:licen[cs]e|copying|copyright|unlicense)(?:[._-].*)?$", re.I)
+_COPYRIGHT_LINE_RE = _LazyPattern(r"^\s*(?:copyright\b|\(c\)|©).*$", re.M)
+_LICENSE_WORD_RE = _LazyPattern(r"[a-z0-9]+")
+
+def license_text_fingerprint(text):
+    """ライセンス本文を正規化し、単語 n-gram（シングル）のハッシュを winnowing で間引いた集合を返します
+
+    大文字小文字・記号・改行位置の違いと著作権表示の行は無視します。
+    索引の生成（tools/build_license_index.py）と照合の両方でこの関数を使います。
+    """
+    import zlib
+    text = _COPYRIGHT_LINE_RE.sub(" ", text.lower())
+    words = [_LICENSE_WORD_ALIASES.get(word, word) for word in _LICENSE_WORD_RE.findall(text)]
+    size = min(_LICENSE_SHINGLE_SIZE, len(words))
+    shingles = [zlib.crc32(" ".join(words[i:i + size]).encode()) for i in range(len(words) - size + 1)] if words else []
+    window = min(_LICENSE_WINNOW_SIZE, len(shingles))
+    return {min(shingles[i:i + window]) for i in range(len(shingles) - window + 1)} if shingles else set()
+
+class LicenseTextIndex:
+    """同梱の SPDX ライセンス本文の指紋の索引です
+
+    シングルのハッシュから参照本文への転置索引を持つため、照合にかかる時間は
+    ファイルのシングル数に比例し、参照本文が数百あってもほとんど変わりません。
+    同じ SPDX ID に複数の本文（表記の異なる版）を登録できます。
+    """
+
+    def __init__(self, entries):
+        self.ids = []
+        self.sizes = []
+        self._postings = {}
+        for position, (spdx_id, hashes) in enumerate(entries):
+            self.ids.append(spdx_id)
+            self.sizes.append(len(hashes))
+            for value in hashes:
+                self._postings.setdefault(value, []).append(position)
+
+    @classmethod
+    def load(cls, path):
+        """tools/build_license_index.py が書き出した索引ファイルを読み込みます"""
+        import array
+        import base64
+        import gzip
+        import json
+        with profile_span("license_text_index.load", "metadata"):
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                data = json.load(f)
+            if (data.get("version") != LICENSE_TEXT_INDEX_VERSION
+                    or data.get("shingle_size") != _LICENSE_SHINGLE_SIZE
+                    or data.get("winnow_size") != _LICENSE_WINNOW_SIZE):
+                raise ValueError("索引の形式が異なります（tools/build_license_index.py で作り直してください）")
+            entries = []
+            for entry in data["licenses"]:
+                hashes = array.array("I")
+                hashes.frombytes(base64.b64decode(entry["hashes"]))
+                if sys.byteorder != "little":
+                    hashes.byteswap()
+                entries.append((entry["id"], hashes))
+        return cls(entries)
+
+    def identify(self, hashes):
+        """指紋に含まれるライセンスの SPDX ID を、よく一致する順に返します（なければ空のリスト）
+
+        1つのファイルに複数のライセンスが並んでいる場合にも対応するため、最も一致する
+        本文が見つかるたびにそのシングルを取り除き、残りで他の本文を照合します。
+        MIT-0 のように別の本文にほぼ含まれる本文が重ねて見つかることはありません。
+        """
+        matched = {}
+        for value in hashes:
+            for position in self._postings.get(value, ()):
+                matched.setdefault(position, set()).add(value)
+        remaining = set(hashes)
+        found = []
+        while matched and remaining:
+            candidates = {position: values & remaining for position, values in matched.items()}
+            candidates = {position: values for position, values in candidates.items()
+                          if len(values) >= _LICENSE_MATCH_THRESHOLD * self.sizes[position]}
+            if not candidates:
+                break
+            # 一致したシングルが多く、参照本文の側に足りないシングルが少ない本文を選ぶ
+            # （MIT の本文には MIT-0 の本文がほぼ丸ごと含まれるが、一致する数で MIT が勝つ）
+            best = max(candidates, key=lambda position: 2 * len(candidates[position]) - self.sizes[position])
+            if self.ids[best] not in found:
+                found.append(self.ids[best])
+            remaining -= candidates[best]
+            matched = candidates
+            del matched[best]
+        return found
+
+_LICENSE_TEXT_INDEX = None
+
+def get_license_text_index():
+    """同梱のライセンス本文の索引を初回の照合時に読み込んで返します（読み込めない場合はNone）"""
+    global _LICENSE_TEXT_INDEX
+    if _LICENSE_TEXT_INDEX is None:
+        try:
+            _LICENSE_TEXT_INDEX = LicenseTextIndex.load(LICENSE_TEXT_INDEX_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"⚠️ ライセンス本文の索引を読み込めません: {LICENSE_TEXT_INDEX_PATH}: {e}")
+            _LICENSE_TEXT_INDEX = False
+    return _LICENSE_TEXT_INDEX or None
+
+def identify_license_text(text):
+    """ライセンス本文から SPDX ID の一覧を推定します"""
+    index = get_license_text_index()
+    if index is None:
+        return []
+    return index.identify(license_text_fingerprint(text))
+
+def _license_file_candidates(dist_info, location, meta, record):
+    """dist-info の licenses/ ディレクトリ、License-File ヘッダー、RECORD からライセンスファイルを探します"""
+    candidates = []
+    for value in meta.get_all('License-File') or []:
+        value = value.strip()
+        if value:
+            # PEP 639 では licenses/ の下、それより前の setuptools は dist-info の直下に置く
+            candidates.append(os.path.join(dist_info, "licenses", value))
+            candidates.append(os.path.join(dist_info, value))
+    for root, _, files in os.walk(os.path.join(dist_info, "licenses")):
+        candidates.extend(os.path.join(root, name) for name in sorted(files))
+    try:
+        candidates.extend(os.path.join(dist_info, name) for name in sorted(os.listdir(dist_info))
+                          if _LICENSE_FILE_NAME_RE.match(name))
+    except OSError:
+        pass
+    for line in (record or "").splitlines():
+        path = line.rsplit(",", 2)[0].strip('"')
+        if path and _LICENSE_FILE_NAME_RE.match(os.path.basename(path)):
+            candidates.append(os.path.normpath(os.path.join(location, path)))
+    unique = []
+    for path in dict.fromkeys(os.path.normpath(path) for path in candidates):
+        if os.path.isfile(path):
+            unique.append(path)
+            if len(unique) >= _LICENSE_FILE_MAX_COUNT:
+                break
+    return unique
+
+def _license_from_files(dist_info, location, meta, record=None):
+    """同梱のライセンスファイルの本文を索引と照合し、SPDX ライセンス式を返します（わからなければ空文字列）"""
+    if not dist_info or not os.path.isdir(dist_info):
+        return ""
+    found = []
+    with profile_span("metadata.license_files", "metadata") as span:
+        for path in _license_file_candidates(dist_info, location, meta, record):
+            try:
+                with open(path, "rb") as f:
+                    text = f.read(_LICENSE_FILE_MAX_BYTES).decode("utf-8", "replace")
+            except OSError:
+                continue
+            for spdx_id in identify_license_text(text):
+                if spdx_id not in found:
+                    found.append(spdx_id)
+        if _PROFILER is not None:
+            span.args["licenses"] = found
+    # 複数のライセンスの本文が同梱されている場合はすべてに従う必要があるとみなす
+    return " AND ".join(found)
+
+def _find_dist_info(location, package_name):
+    """site-packages の中からパッケージの dist-info / egg-info ディレクトリを探します"""
+    if not location or not package_name:
+        return None
+    wanted = _canonical_name(package_name)
+    try:
+        names = os.listdir(location)
+    except OSError:
+        return None
+    for name in names:
+        match = _DIST_INFO_DIR_RE.match(name)
+        if match and _canonical_name(match.group('name')) == wanted:
+            return os.path.join(location, name)
+    return None
+
+def _read_text_file(path):
+    """テキストファイルを読み込みます（読めない場合は空文字列）"""
+    try:
+        with open(path, encoding="utf-8", errors="replace") as f:
+            return f.read()
+    except OSError:
+        return ""
+
+# Requires-Dist の先頭にあるパッケージ名
+_REQUIREMENT_NAME_RE = _LazyPattern(r"\s*([A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?)")
+
+def _requirement_name(requirement):
+    """"requests>=2.0" のような要求仕様からパッケージ名だけを取り出します"""
+    match = _REQUIREMENT_NAME_RE.match(requirement)
+    return match.group(1) if match else requirement.strip()
+
+def _requires_from_metadata(requires_dist, environment=None):
+    """Requires-Distから pip show の Requires: と同じ依存パッケージ名のリストを作ります
+
+    environment は環境マーカーの値の (名前, 値) のタプルで、None なら現在の環境で評価します
+    （marker_environment_for を参照）。
+    """
+    requires = []
+    seen = set()
+    for line in requires_dist:
+        requirement, _, marker = line.partition(';')
+        match = _REQUIREMENT_NAME_RE.match(requirement)
+        if not match:
+            continue
+        # extra 指定のみの依存や、現在の環境に該当しない依存は除外する
+        if marker.strip() and not _marker_applies(marker.strip(), environment):
+            continue
+        name = match.group(1)
+        key = name.lower()
+        if key not in seen:
+            seen.add(key)
+            requires.append(name)
+    return sorted(requires, key=str.lower)
+
+# packaging を読み込めない場合に extra を条件にするマーカーを見分ける
+_MARKER_EXTRA_RE = _LazyPattern(r"\bextra\b")
+
+@functools.lru_cache(maxsize=None)
+def _marker_applies(marker_text, environment=None):
+    """環境マーカーが現在の環境（extraなし）に該当するかを判定します（同じマーカーは一度だけ評価）
+
+    environment を指定した場合は、その値で現在の環境の値を上書きして評価します。
+    pip（に同梱の packaging）を読み込めない場合は extra を条件にするものだけを該当しないとし、
+    それ以外は依存関係を見落とさないよう該当するとみなします。
+    """
+    try:
+        from pip._vendor.packaging.markers import InvalidMarker, Marker
+    except ImportError:
+        return _MARKER_EXTRA_RE.search(marker_text) is None
+    try:
+        return Marker(marker_text).evaluate(dict(environment or (), extra=""))
+    except InvalidMarker:
+        return False
+
+def _get_package_info_subprocess(package_name):
+    """pip show を別プロセスで実行してパッケージの情報を取得します（明示的に選択した場合のみ使用）"""
+    import subprocess
     try:
         # パッケージ情報を取得
         cmd = [sys.executable, "-m", "pip", "show", package_name]
-        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        stdout, stderr = process.communicate()
+        with profile_span("metadata.pip_show", "metadata", package=package_name):
+            process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+            stdout, stderr = process.communicate()
         
         # 出力からライセンス情報とバージョンを抽出
         output = stdout.decode('utf-8')
@@ -271,8 +1424,11 @@ def get_package_info(package_name):
         version = "Unknown"
         requires = []
         
+        license_expression = ""
         for line in output.split('\n'):
-            if line.startswith('License:'):
+            if line.startswith('License-Expression:'):
+                license_expression = line.replace('License-Expression:', '').strip()
+            elif line.startswith('License:'):
                 license_info = line.replace('License:', '').strip()
             elif line.startswith('Version:'):
                 version = line.replace('Version:', '').strip()
@@ -281,6 +1437,10 @@ def get_package_info(package_name):
                 if requires_text:
                     requires = [r.strip() for r in requires_text.split(',')]
         
+        # PEP 639 の License-Expression があれば License より優先する
+        if license_expression:
+            license_info = license_expression
+        
         # ライセンス情報が取得できなかった場合は、メタデータからの取得を試みる
         if not license_info:
             try:
@@ -288,7 +1448,9 @@ def get_package_info(package_name):
                 import importlib.metadata as metadata
                 try:
                     dist = metadata.distribution(package_name)
-                    if hasattr(dist, 'metadata') and 'License' in dist.metadata:
+                    if hasattr(dist, 'metadata') and dist.metadata.get('License-Expression'):
+                        license_info = dist.metadata['License-Expression']
+                    elif hasattr(dist, 'metadata') and 'License' in dist.metadata:
                         license_info = dist.metadata['License']
                     elif hasattr(dist, 'metadata') and 'Classifier' in dist.metadata:
                         # クラシファイアからライセンス情報を抽出
@@ -318,27 +1480,19 @@ def get_package_info(package_name):
                 except:
                     pass
             
-            # それでも取得できない場合はセットアップファイルを解析する試み
+            # それでも取得できない場合は同梱の LICENSE / COPYING の本文から推定する
             if not license_info:
-                try:
-                    # 代替方法: パッケージの場所を見つけてsetup.pyを探す
-                    package_location = None
-                    for line in output.split('\n'):
-                        if line.startswith('Location:'):
-                            package_location = line.replace('Location:', '').strip()
-                            break
-                    
-                    if package_location:
-                        setup_path = os.path.join(package_location, package_name, 'setup.py')
-                        if os.path.exists(setup_path):
-                            with open(setup_path, 'r') as f:
-                                setup_content = f.read()
-                                import re
-                                license_match = re.search(r"license=['\"]([^'\"]+)['\"]", setup_content)
-                                if license_match:
-                                    license_info = license_match.group(1)
-                except:
-                    pass
+                package_location = None
+                for line in output.split('\n'):
+                    if line.startswith('Location:'):
+                        package_location = line.replace('Location:', '').strip()
+                        break
+                dist_info = _find_dist_info(package_location, package_name)
+                if dist_info:
+                    meta = _MetadataHeaders(_read_text_file(os.path.join(dist_info, 'METADATA'))
+                                            or _read_text_file(os.path.join(dist_info, 'PKG-INFO')))
+                    license_info = _license_from_files(dist_info, package_location, meta,
+                                                       _read_text_file(os.path.join(dist_info, 'RECORD')))
         
         # 最終的にもライセンス情報がない場合は「Unknown」とする
         if not license_info:
@@ -349,51 +1503,1088 @@ def get_package_info(package_name):
         print(f"エラー: {e}")
         return "Unknown", "Unknown", []
 
-def check_license(package_name):
-    """パッケージのライセンスをチェックします"""
-    # パッケージのインストール前にメタデータのみを取得して確認
-    version, license_info, requires = get_package_info(package_name)
-    allowed_licenses = load_allowed_licenses()
-    
-    # 正規化したライセンス名で比較
-    normalized_license = normalize_license_name(license_info)
-    is_allowed = False
-    
-    for allowed in allowed_licenses:
-        if normalize_license_name(allowed) == normalized_license:
-            is_allowed = True
-            break
-    
-    # 依存パッケージの情報収集前にパッケージの情報を先に表示
-    if is_allowed:
-        print(f"✅ {package_name} ({version}): {license_info} - ライセンス許可")
-    else:
-        print(f"⚠️ 警告: {package_name} ({version}) のライセンス ({license_info}) は許可リストにありません")
-    
-    # 依存パッケージがある場合、情報を収集
-    deps_info = []
-    not_allowed_deps = []
-    if requires:
-        print(f"\n📦 {package_name}の依存パッケージの情報を収集しています...")
-        for req in requires:
-            # 依存パッケージの情報を取得
-            dep_version, dep_license, _ = get_package_info(req)
-            
-            # ライセンスをチェック
-            normalized_dep_license = normalize_license_name(dep_license)
-            is_dep_allowed = False
-            
-            for allowed in allowed_licenses:
-                if normalize_license_name(allowed) == normalized_dep_license:
-                    is_dep_allowed = True
+class WheelIndex:
+    """ローカルの wheelhouse（--find-links ディレクトリ）の索引です
+
+    ディレクトリは一度だけ走査してパッケージ名ごとの wheel 一覧を作ります。
+    METADATA は zip の中央ディレクトリから該当メンバーだけを読み出し、
+    アーカイブは展開しません。読み込んだ結果は wheel ごとに保持します。
+    """
+
+    def __init__(self, directories):
+        from pip._vendor.packaging.utils import InvalidWheelFilename, parse_wheel_filename
+
+        self.directories = list(directories)
+        self._wheels = {}
+        self._metadata = {}
+        supported = _supported_tags()
+        for directory in self.directories:
+            try:
+                entries = list(os.scandir(directory))
+            except OSError as e:
+                print(f"⚠️ wheelhouse を読み込めません: {directory} ({e})")
+                continue
+            for entry in entries:
+                if not entry.name.endswith('.whl') or not entry.is_file():
+                    continue
+                try:
+                    name, version, build, tags = parse_wheel_filename(entry.name)
+                except InvalidWheelFilename:
+                    continue
+                # 現在の環境にインストールできない wheel は候補にしない
+                if tags.isdisjoint(supported):
+                    continue
+                self._wheels.setdefault(name, []).append((version, build, entry.path))
+        for candidates in self._wheels.values():
+            candidates.sort(reverse=True)
+
+    def __len__(self):
+        return sum(len(candidates) for candidates in self._wheels.values())
+
+    def find(self, requirement):
+        """要求仕様を満たす最新の wheel のパスを返します（見つからなければNone）"""
+        from pip._vendor.packaging.requirements import InvalidRequirement, Requirement
+
+        try:
+            req = Requirement(requirement)
+            name, specifier = req.name, req.specifier
+        except InvalidRequirement:
+            name, specifier = _requirement_name(requirement), None
+        for version, _, path in self._wheels.get(_canonical_name(name), []):
+            if specifier is None or specifier.contains(version, prereleases=True):
+                return path
+        return None
+
+    def read_info(self, path):
+        """wheel の METADATA から (version, license, requires) を読み込みます"""
+        info = self._metadata.get(path)
+        if info is None:
+            info = self._metadata[path] = _package_info_from_wheel(path)
+        return info
+
+@functools.lru_cache(maxsize=None)
+def _supported_tags():
+    """現在のインタープリターがサポートする wheel タグの集合を返します"""
+    from pip._vendor.packaging.tags import sys_tags
+    return frozenset(sys_tags())
+
+def _wheel_metadata_text(path):
+    """zip の中央ディレクトリから *.dist-info/METADATA だけを読みます（ない場合は None）"""
+    import zipfile
+    with zipfile.ZipFile(path) as archive:
+        for name in archive.namelist():
+            parts = name.split('/')
+            if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                return archive.read(name).decode('utf-8', 'replace')
+    return None
+
+def _package_info_from_wheel(path):
+    """wheel の METADATA だけを読み、(version, license, requires) を返します"""
+    import zipfile
+    try:
+        text = _wheel_metadata_text(path)
+    except (OSError, zipfile.BadZipFile) as e:
+        print(f"エラー: {path}: {e}")
+        return "Unknown", "Unknown", []
+    if text is None:
+        return "Unknown", "Unknown", []
+    meta = _MetadataHeaders(text)
+    
+    version = (meta.get('Version') or "Unknown").strip()
+    license_info, _ = _license_from_metadata(meta)
+    requires = _requires_from_metadata(meta.get_all('Requires-Dist') or [])
+    return version, license_info or "Unknown", requires
+
+_WHEEL_INDEXES = {}
+
+@profiled("wheel_index", "metadata")
+def get_wheel_index(directories):
+    """wheelhouse の索引を返します（ディレクトリが変わらない限り同じ索引を再利用）"""
+    key = []
+    for directory in directories:
+        try:
+            key.append((os.path.abspath(directory), os.stat(directory).st_mtime_ns))
+        except OSError:
+            key.append((os.path.abspath(directory), None))
+    key = tuple(key)
+    index = _WHEEL_INDEXES.get(key)
+    if index is None:
+        index = _WHEEL_INDEXES[key] = WheelIndex(directories)
+    return index
+
+class WheelhouseSource:
+    """wheelhouse の METADATA を優先し、見つからないものはインストール済みの情報を使うメタデータ取得元です
+
+    get_package_info と同じく要求仕様を受け取り (version, license, requires) を返すため、
+    check_license や build_dependency_graph の lookup としてそのまま使えます。
+    """
+
+    def __init__(self, index, fallback=None):
+        self.index = index
+        self.fallback = fallback or get_package_info
+
+    def __call__(self, requirement):
+        path = self.index.find(requirement)
+        if path is not None:
+            return self.index.read_info(path)
+        return self.fallback(requirement)
+
+    def close(self):
+        """取得元（fallback）が持つ接続などを閉じます"""
+        close = getattr(self.fallback, 'close', None)
+        if close is not None:
+            close()
+
+    def prefetch(self, requirements):
+        """wheelhouse にないものは取得元（fallback）に先読みを依頼します"""
+        prefetch = getattr(self.fallback, 'prefetch', None)
+        if prefetch is not None:
+            prefetch([req for req in requirements if self.index.find(req) is None])
+
+class _HTTPResponse:
+    """HTTP レスポンス（ステータス・ヘッダー・本文）です"""
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+# pip のコマンドライン・設定ファイル・環境変数（PIP_*）から引き継ぐ接続の設定
+_PIP_NETWORK_OPTIONS = ("proxy", "cert", "client-cert")
+
+def http_client_options(pip_options=()):
+    """メタデータの取得に使うプロキシ・CA 証明書・クライアント証明書を pip と同じ設定から求めます
+
+    pip_options（--proxy / --cert / --client-cert）、pip の設定ファイルと環境変数
+    （PIP_PROXY / PIP_CERT / PIP_CLIENT_CERT）、REQUESTS_CA_BUNDLE / CURL_CA_BUNDLE の順に
+    優先します。AsyncHTTPClient のキーワード引数として渡せる辞書を返します。
+    """
+    options = {}
+    for variable in ("CURL_CA_BUNDLE", "REQUESTS_CA_BUNDLE"):
+        if os.environ.get(variable):
+            options["cert"] = os.environ[variable]
+    try:
+        from pip._internal.configuration import Configuration, ConfigurationError
+        configuration = Configuration(isolated=False)
+        configuration.load()
+        # 設定ファイル、環境変数の順に読まれるため、後のものを優先する
+        for key, value in configuration.items():
+            section, _, name = key.partition('.')
+            if section in ("global", "install", ":env:") and name in _PIP_NETWORK_OPTIONS:
+                options[name] = value
+    except (ImportError, ConfigurationError):
+        pass
+    pip_options = list(pip_options)
+    for position, option in enumerate(pip_options):
+        name, _, value = option.partition('=')
+        if name[2:] in _PIP_NETWORK_OPTIONS and name.startswith('--'):
+            if not value and position + 1 < len(pip_options):
+                value = pip_options[position + 1]
+            options[name[2:]] = value
+    return {name.replace('-', '_'): value for name, value in options.items() if value}
+
+class AsyncHTTPClient:
+    """asyncio のストリームだけで実装した HTTP/1.1 クライアントです
+
+    接続はホストごとにプールして keep-alive で再利用し、同時に処理する
+    リクエスト数はセマフォで制限します。接続エラーや 5xx は指数バックオフで
+    再試行します。proxy を指定しない場合は HTTP(S)_PROXY / NO_PROXY に従い、
+    HTTPS はプロキシに CONNECT してトンネルを張ります。cert は CA 証明書のファイル
+    （またはディレクトリ）、client_cert は鍵を含む PEM で、credentials はホストごとの
+    (ユーザー名, パスワード) です。URL にも credentials にもないホストは ~/.netrc を使います。
+    """
+
+    def __init__(self, concurrency=16, retries=3, timeout=30.0, proxy=None, cert=None, client_cert=None,
+                 credentials=None):
+        import asyncio
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.proxy = proxy
+        self.cert = cert
+        self.client_cert = client_cert
+        self.credentials = dict(credentials or {})
+        self.request_count = 0
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._idle = {}
+        self._ssl_context = None
+        self._netrc = None
+
+    async def get(self, url, headers=None):
+        """GET リクエストを送信します（リダイレクトは最大5回まで追跡）"""
+        from urllib.parse import urljoin
+        for _ in range(5):
+            response = await self._request_with_retries("GET", url, headers or {})
+            if response.status in (301, 302, 303, 307, 308) and 'location' in response.headers:
+                url = urljoin(url, response.headers['location'])
+                continue
+            return response
+        return response
+
+    async def close(self):
+        """プールしている接続をすべて閉じます"""
+        for connections in self._idle.values():
+            for _, writer in connections:
+                writer.close()
+        self._idle.clear()
+
+    async def _request_with_retries(self, method, url, headers):
+        import asyncio
+        delay = 0.2
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    response = await asyncio.wait_for(self._request(method, url, headers), self.timeout)
+                if response.status < 500 or attempt == self.retries:
+                    return response
+            except (OSError, EOFError, ValueError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                if attempt == self.retries:
+                    raise
+            await asyncio.sleep(delay)
+            delay *= 2
+
+    def _ssl(self):
+        """TLS の設定（CA 証明書とクライアント証明書）を一度だけ作ります"""
+        if self._ssl_context is None:
+            import ssl
+            if self.cert and os.path.isdir(self.cert):
+                context = ssl.create_default_context(capath=self.cert)
+            else:
+                context = ssl.create_default_context(cafile=self.cert or None)
+            if self.client_cert:
+                context.load_cert_chain(self.client_cert)
+            self._ssl_context = context
+        return self._ssl_context
+
+    def _proxy_for(self, parts):
+        """URL に使うプロキシ（urlsplit の結果）を返します（直接接続する場合は None）"""
+        from urllib.parse import urlsplit
+        from urllib.request import getproxies, proxy_bypass
+        proxy = self.proxy or getproxies().get(parts.scheme)
+        if not proxy or proxy_bypass(parts.hostname):
+            return None
+        return urlsplit(proxy if '://' in proxy else 'http://' + proxy)
+
+    def _basic_auth(self, parts):
+        """URL のユーザー情報・credentials・~/.netrc の順に Basic 認証のヘッダーの値を返します（なければ None）"""
+        import base64
+        from urllib.parse import unquote
+        if parts.username:
+            username, password = unquote(parts.username), unquote(parts.password or '')
+        elif parts.hostname in self.credentials:
+            username, password = self.credentials[parts.hostname]
+        else:
+            if self._netrc is None:
+                import netrc
+                try:
+                    self._netrc = netrc.netrc()
+                except (OSError, netrc.NetrcParseError):
+                    self._netrc = False
+            entry = self._netrc.authenticators(parts.hostname) if self._netrc else None
+            if entry is None:
+                return None
+            username, password = entry[0], entry[2]
+        return "Basic " + base64.b64encode(f"{username}:{password or ''}".encode()).decode()
+
+    def _tunnel(self, proxy, host, port):
+        """プロキシに CONNECT して host:port へのトンネルを張ったソケットを返します（スレッドで実行）"""
+        import socket
+        sock = socket.create_connection((proxy.hostname, proxy.port or 80), timeout=self.timeout)
+        try:
+            authority = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+            request = f"CONNECT {authority} HTTP/1.1\r\nHost: {authority}\r\n"
+            proxy_auth = self._basic_auth(proxy) if proxy.username else None
+            if proxy_auth:
+                request += f"Proxy-Authorization: {proxy_auth}\r\n"
+            sock.sendall((request + "\r\n").encode('latin-1'))
+            response = b''
+            while b'\r\n\r\n' not in response:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    raise EOFError("プロキシが接続を閉じました")
+                response += chunk
+            status = int(response.split(b' ', 2)[1])
+            if status != 200:
+                raise OSError(f"プロキシへの CONNECT に失敗しました: HTTP {status}")
+            return sock
+        except BaseException:
+            sock.close()
+            raise
+
+    async def _request(self, method, url, headers):
+        import asyncio
+        from urllib.parse import urlsplit
+
+        parts = urlsplit(url)
+        secure = parts.scheme == 'https'
+        host = parts.hostname
+        port = parts.port or (443 if secure else 80)
+        key = (parts.scheme, host, port)
+        target = (parts.path or '/') + (f"?{parts.query}" if parts.query else "")
+        proxy = self._proxy_for(parts)
+
+        request_headers = {
+            "Host": parts.netloc.rsplit('@', 1)[-1],
+            "User-Agent": "pip-license-checker",
+            "Accept-Encoding": "identity",
+            "Connection": "keep-alive",
+        }
+        authorization = self._basic_auth(parts)
+        if authorization:
+            request_headers["Authorization"] = authorization
+        if proxy is not None and not secure:
+            # HTTP はプロキシに絶対 URL でリクエストする
+            target = f"http://{request_headers['Host']}{target}"
+            if proxy.username:
+                request_headers["Proxy-Authorization"] = self._basic_auth(proxy)
+        request_headers.update(headers)
+        payload = f"{method} {target} HTTP/1.1\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in request_headers.items()) + "\r\n"
+
+        idle = self._idle.setdefault(key, [])
+        if idle:
+            reader, writer = idle.pop()
+        elif proxy is None:
+            reader, writer = await asyncio.open_connection(host, port, ssl=self._ssl() if secure else None)
+        elif not secure:
+            reader, writer = await asyncio.open_connection(proxy.hostname, proxy.port or 80)
+        else:
+            sock = await asyncio.get_running_loop().run_in_executor(None, self._tunnel, proxy, host, port)
+            reader, writer = await asyncio.open_connection(sock=sock, ssl=self._ssl(), server_hostname=host)
+        try:
+            writer.write(payload.encode('latin-1'))
+            await writer.drain()
+            self.request_count += 1
+            response, keep_alive = await self._read_response(reader, method, url)
+        except BaseException:
+            writer.close()
+            raise
+        if keep_alive:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _read_response(self, reader, method, url):
+        status_line = await reader.readline()
+        if not status_line:
+            raise EOFError("接続が閉じられました")
+        http_version, status, _ = (status_line.decode('latin-1').rstrip('\r\n') + ' ').split(' ', 2)
+        status = int(status)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        framed = True
+        if method == 'HEAD' or status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif 'chunked' in headers.get('transfer-encoding', '').lower():
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';', 1)[0].strip() or b'0', 16)
+                if size == 0:
+                    # トレーラーを読み飛ばす
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
                     break
+                chunks.append(await reader.readexactly(size))
+                await reader.readline()
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            # HTTP/1.0 など本文の長さが示されない場合は接続が閉じるまで読む
+            body = await reader.read()
+            framed = False
+
+        if headers.get('content-encoding', '').lower() == 'gzip':
+            import gzip
+            body = gzip.decompress(body)
+        keep_alive = (framed and http_version == 'HTTP/1.1'
+                      and headers.get('connection', '').lower() != 'close')
+        return _HTTPResponse(url, status, headers, body), keep_alive
+
+class RemoteIndexSource:
+    """パッケージインデックス（Simple Repository API）から非同期にメタデータを取得する取得元です
+
+    PEP 658 / 714 の .metadata ファイルがあればそれを取得し、なければ wheel の
+    zip 末尾の中央ディレクトリと METADATA の部分だけを HTTP の Range リクエストで
+    取得します。prefetch() に渡した名前はまとめて並行に取得され、結果は
+    要求仕様ごとに保持されます。インデックスに見つからないパッケージは
+    fallback（デフォルトはインストール済みの情報）で解決します。
+    絶対 URL の wheel を wheel_metadata() で読むだけの場合は index_url を省略できます。
+    プロキシと証明書は pip_options（--proxy / --cert / --client-cert）と pip の設定に従い
+    （http_client_options を参照）、index_url のユーザー情報は同じホストの wheel の取得にも使います。
+    """
+
+    def __init__(self, index_url=None, concurrency=16, retries=3, fallback=None, pip_options=()):
+        import asyncio
+        from urllib.parse import unquote, urlsplit
+        self.index_url = index_url.rstrip('/') + '/' if index_url else None
+        self.fallback = fallback or get_package_info
+        self._results = {}
+        options = http_client_options(pip_options)
+        parts = urlsplit(self.index_url or '')
+        if parts.username:
+            options["credentials"] = {parts.hostname: (unquote(parts.username), unquote(parts.password or ''))}
+        self._loop = asyncio.new_event_loop()
+        self._client = self._loop.run_until_complete(self._make_client(concurrency, retries, options))
+
+    @staticmethod
+    async def _make_client(concurrency, retries, options):
+        # セマフォをこのイベントループ上で作成する
+        return AsyncHTTPClient(concurrency=concurrency, retries=retries, **options)
+
+    @property
+    def request_count(self):
+        return self._client.request_count
+
+    def __call__(self, requirement):
+        if requirement not in self._results:
+            self.prefetch([requirement])
+        info = self._results[requirement]
+        return info if info is not None else self.fallback(requirement)
+
+    @profiled("metadata.remote_prefetch", "metadata")
+    def prefetch(self, requirements):
+        """まだ取得していない要求仕様のメタデータを並行して取得します"""
+        import asyncio
+        pending = [req for req in dict.fromkeys(requirements) if req not in self._results]
+        if not pending:
+            return
+
+        async def fetch_all():
+            return await asyncio.gather(*(self._fetch(req) for req in pending), return_exceptions=True)
+
+        for requirement, result in zip(pending, self._loop.run_until_complete(fetch_all())):
+            if isinstance(result, Exception):
+                print(f"⚠️ {requirement} のメタデータをインデックスから取得できませんでした: {result}")
+                result = None
+            self._results[requirement] = result
+
+    @profiled("metadata.remote_wheels", "metadata")
+    def wheel_metadata(self, wheel_urls):
+        """wheel の URL ごとの METADATA のテキストを並行して取得します（取得できなかったものは None）"""
+        import asyncio
+
+        async def fetch(wheel_url):
+            # インデックスの href に付いている #sha256= などのフラグメントは送らない
+            wheel_url = wheel_url.split('#', 1)[0]
+            # PEP 658 の .metadata があればそれを使い、なければ Range リクエストで読む
+            response = await self._client.get(wheel_url + '.metadata')
+            if response.status == 200:
+                return response.body.decode('utf-8', 'replace')
+            return await self._fetch_wheel_metadata(wheel_url)
+
+        async def fetch_all():
+            return await asyncio.gather(*(fetch(url) for url in wheel_urls), return_exceptions=True)
+
+        texts = {}
+        for wheel_url, result in zip(wheel_urls, self._loop.run_until_complete(fetch_all())):
+            if isinstance(result, Exception):
+                print(f"⚠️ {wheel_url} のメタデータを取得できませんでした: {result}")
+                result = None
+            texts[wheel_url] = result
+        return texts
+
+    def close(self):
+        """接続を閉じてイベントループを終了します"""
+        if not self._loop.is_closed():
+            self._loop.run_until_complete(self._client.close())
+            self._loop.close()
+
+    async def _fetch(self, requirement):
+        from urllib.parse import urljoin
+        from pip._vendor.packaging.requirements import InvalidRequirement, Requirement
+        from pip._vendor.packaging.utils import InvalidWheelFilename, parse_wheel_filename
+
+        try:
+            req = Requirement(requirement)
+            name, specifier = req.name, req.specifier
+        except InvalidRequirement:
+            name, specifier = _requirement_name(requirement), None
+
+        if self.index_url is None:
+            return None
+        page_url = urljoin(self.index_url, _canonical_name(name) + '/')
+        response = await self._client.get(page_url, {
+            "Accept": "application/vnd.pypi.simple.v1+json, text/html;q=0.1",
+        })
+        if response.status == 404:
+            return None
+        if response.status != 200:
+            raise OSError(f"{page_url}: HTTP {response.status}")
+
+        # 条件を満たす最新の wheel を選ぶ
+        supported = _supported_tags()
+        best = None
+        for filename, url, has_metadata, yanked in _parse_simple_page(response):
+            if yanked or not filename.endswith('.whl'):
+                continue
+            try:
+                _, version, build, tags = parse_wheel_filename(filename)
+            except InvalidWheelFilename:
+                continue
+            if tags.isdisjoint(supported):
+                continue
+            if specifier is not None and not specifier.contains(version, prereleases=True):
+                continue
+            candidate = (version, build, url, has_metadata)
+            if best is None or candidate[:2] > best[:2]:
+                best = candidate
+        if best is None:
+            return None
+
+        _, _, wheel_url, has_metadata = best
+        # wheel の sha256 がわかる場合は、別のジョブが取得済みの結果を共有キャッシュから使う
+        shared = get_shared_license_cache()
+        shared_key = None
+        if shared is not None and '#sha256=' in wheel_url:
+            shared_key = shared.key("wheel", wheel_url.rsplit('#sha256=', 1)[1].lower())
+            entry = shared.get(shared_key)
+            if entry is not None:
+                return entry["version"], entry["license"], _requires_from_metadata(entry["requires_dist"])
+        metadata_text = None
+        if has_metadata:
+            metadata_response = await self._client.get(wheel_url.split('#', 1)[0] + '.metadata')
+            if metadata_response.status == 200:
+                metadata_text = metadata_response.body.decode('utf-8', 'replace')
+        if metadata_text is None:
+            metadata_text = await self._fetch_wheel_metadata(wheel_url.split('#', 1)[0])
+
+        meta = _MetadataHeaders(metadata_text)
+        version = (meta.get('Version') or "Unknown").strip()
+        license_info, _ = _license_from_metadata(meta)
+        requires_dist = list(meta.get_all('Requires-Dist') or [])
+        if shared_key is not None:
+            shared.put(shared_key, version=version, license=license_info or "Unknown", requires_dist=requires_dist)
+        return version, license_info or "Unknown", _requires_from_metadata(requires_dist)
+
+    async def _fetch_wheel_metadata(self, wheel_url):
+        """Range リクエストで wheel の中央ディレクトリと METADATA だけを取得します"""
+        import struct
+        import zipfile
+        import zlib
+
+        tail = await self._client.get(wheel_url, {"Range": "bytes=-65536"})
+        if tail.status == 200:
+            # Range 非対応のサーバーは全体が返るため、そのまま読む
+            return _metadata_from_zip_bytes(tail.body)
+        if tail.status != 206:
+            raise OSError(f"{wheel_url}: HTTP {tail.status}")
+
+        total = int(tail.headers.get('content-range', '').rsplit('/', 1)[-1])
+        tail_start = total - len(tail.body)
+        eocd = tail.body.rfind(b'PK\x05\x06')
+        if eocd == -1:
+            raise zipfile.BadZipFile("中央ディレクトリの終端が見つかりません")
+        cd_size, cd_offset = struct.unpack('<II', tail.body[eocd + 12:eocd + 20])
+        if cd_offset == 0xFFFFFFFF or cd_size == 0xFFFFFFFF:
+            # ZIP64 は全体を取得して読む
+            full = await self._client.get(wheel_url)
+            return _metadata_from_zip_bytes(full.body)
+        if cd_offset >= tail_start:
+            directory = tail.body[cd_offset - tail_start:cd_offset - tail_start + cd_size]
+        else:
+            response = await self._client.get(
+                wheel_url, {"Range": f"bytes={cd_offset}-{cd_offset + cd_size - 1}"})
+            directory = response.body
+
+        # 中央ディレクトリから METADATA のエントリーを探す
+        position = 0
+        entry = None
+        while position + 46 <= len(directory) and directory[position:position + 4] == b'PK\x01\x02':
+            (method, compressed_size, name_length, extra_length, comment_length,
+             header_offset) = (struct.unpack('<H', directory[position + 10:position + 12])[0],
+                               *struct.unpack('<I', directory[position + 20:position + 24]),
+                               *struct.unpack('<HHH', directory[position + 28:position + 34]),
+                               *struct.unpack('<I', directory[position + 42:position + 46]))
+            filename = directory[position + 46:position + 46 + name_length].decode('utf-8', 'replace')
+            parts = filename.split('/')
+            if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                entry = (method, compressed_size, header_offset)
+                break
+            position += 46 + name_length + extra_length + comment_length
+        if entry is None:
+            raise zipfile.BadZipFile("METADATA が見つかりません")
+
+        method, compressed_size, header_offset = entry
+        # ローカルヘッダーの拡張フィールド長は中央ディレクトリと異なる場合があるため余裕を持って取得する
+        end = min(total, header_offset + 30 + 1024 + compressed_size) - 1
+        if header_offset >= tail_start and end < total:
+            chunk = tail.body[header_offset - tail_start:]
+        else:
+            chunk = (await self._client.get(wheel_url, {"Range": f"bytes={header_offset}-{end}"})).body
+        name_length, extra_length = struct.unpack('<HH', chunk[26:30])
+        data_start = 30 + name_length + extra_length
+        if len(chunk) < data_start + compressed_size:
+            response = await self._client.get(
+                wheel_url, {"Range": f"bytes={header_offset}-{header_offset + data_start + compressed_size - 1}"})
+            chunk = response.body
+        data = chunk[data_start:data_start + compressed_size]
+        if method == zipfile.ZIP_DEFLATED:
+            data = zlib.decompressobj(-15).decompress(data)
+        elif method != zipfile.ZIP_STORED:
+            full = await self._client.get(wheel_url)
+            return _metadata_from_zip_bytes(full.body)
+        return data.decode('utf-8', 'replace')
+
+def _metadata_from_zip_bytes(data):
+    """メモリ上の wheel から METADATA のテキストを読み出します"""
+    import io
+    import zipfile
+    with zipfile.ZipFile(io.BytesIO(data)) as archive:
+        for name in archive.namelist():
+            parts = name.split('/')
+            if len(parts) == 2 and parts[0].endswith('.dist-info') and parts[1] == 'METADATA':
+                return archive.read(name).decode('utf-8', 'replace')
+    raise zipfile.BadZipFile("METADATA が見つかりません")
+
+# Simple Repository API（HTML）のリンク
+_SIMPLE_LINK_RE = _LazyPattern(r"<a\s+([^>]*)>([^<]*)</a>", re.IGNORECASE)
+_HTML_ATTRIBUTE_RE = _LazyPattern(r"""([\w-]+)\s*=\s*(?:"([^"]*)"|'([^']*)')""")
+
+def _parse_simple_page(response):
+    """Simple Repository API のページから (filename, url, has_metadata, yanked) を列挙します"""
+    import json
+    import html
+    from urllib.parse import urljoin
+
+    content_type = response.headers.get('content-type', '')
+    if 'json' in content_type:
+        for file in json.loads(response.body.decode('utf-8')).get('files', []):
+            # PEP 714 で data-dist-info-metadata は core-metadata に改名された
+            metadata = file.get('core-metadata', file.get('dist-info-metadata', False))
+            url = urljoin(response.url, file['url'])
+            # HTML 形式と同じく、ハッシュは URL のフラグメントとして渡す
+            sha256 = (file.get('hashes') or {}).get('sha256')
+            if sha256 and '#' not in url:
+                url += f"#sha256={sha256}"
+            yield file['filename'], url, bool(metadata), bool(file.get('yanked', False))
+        return
+
+    for attributes, text in _SIMPLE_LINK_RE.findall(response.body.decode('utf-8', 'replace')):
+        attrs = {name.lower(): html.unescape(double or single)
+                 for name, double, single in _HTML_ATTRIBUTE_RE.findall(attributes)}
+        if 'href' not in attrs:
+            continue
+        url = urljoin(response.url, attrs['href'])
+        filename = html.unescape(text.strip()) or url.split('#', 1)[0].rsplit('/', 1)[-1]
+        metadata = attrs.get('data-core-metadata', attrs.get('data-dist-info-metadata'))
+        yield filename, url, metadata not in (None, 'false'), 'data-yanked' in attrs
+
+class DependencyGraph:
+    """ルートパッケージから辿った依存関係の推移的閉包です
+
+    nodes は正規化したパッケージ名から (name, version, license, requires) への
+    対応で、parents には各パッケージを最初に見つけた親を記録するため、
+    path_to() でルートからそのパッケージまでの経路を復元できます。
+    """
+
+    def __init__(self, roots):
+        self.roots = list(roots)
+        self.nodes = {}
+        self.parents = {}
+        # インストールレポートから作った場合に、チェックしたものと同じものだけを
+        # インストールする pip install の引数（レポートを使わない場合は None）
+        self.install_args = None
+
+    def __contains__(self, name):
+        return _canonical_name(name) in self.nodes
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def get(self, name):
+        """パッケージの (name, version, license, requires) を返します"""
+        return self.nodes.get(_canonical_name(_requirement_name(name)))
+
+    def path_to(self, name):
+        """ルートからパッケージまでの経路（パッケージ名のリスト）を返します"""
+        path = []
+        key = _canonical_name(name)
+        while key is not None:
+            path.append(self.nodes[key][0])
+            key = self.parents.get(key)
+        return path[::-1]
+
+    def dependencies(self):
+        """ルート以外のすべてのパッケージを見つけた順に返します"""
+        root_keys = {_canonical_name(_requirement_name(root)) for root in self.roots}
+        return [node for key, node in self.nodes.items() if key not in root_keys]
+
+@profiled("dependency_graph", "dependency")
+def build_dependency_graph(roots, lookup=None, max_workers=None):
+    """ルートパッケージから推移的な依存関係をすべて解決します
+
+    各パッケージは一度だけ解決し（循環依存も一度訪れた時点で打ち切る）、
+    同じ深さにある互いに独立したパッケージはスレッドプールで並行して解決します。
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    lookup = lookup or get_package_info
+    # リモートの取得元などは同じ深さのパッケージをまとめて先読みできる
+    prefetch = getattr(lookup, 'prefetch', None)
+    graph = DependencyGraph(roots)
+    frontier = []
+    queued = set()
+    for root in roots:
+        key = _canonical_name(_requirement_name(root))
+        if key not in queued:
+            queued.add(key)
+            frontier.append((root, None))
+
+    executor = None
+    try:
+        depth = 0
+        while frontier:
+            names = [name for name, _ in frontier]
+            with profile_span("dependency_graph.level", "dependency", depth=depth, packages=len(names)):
+                if prefetch is not None:
+                    prefetch(names)
+                    infos = [lookup(name) for name in names]
+                elif len(names) > 1:
+                    if executor is None:
+                        executor = ThreadPoolExecutor(max_workers=max_workers)
+                    infos = list(executor.map(lookup, names))
+                else:
+                    infos = [lookup(names[0])]
+            depth += 1
+            
+            next_frontier = []
+            for (name, parent), (version, license_info, requires) in zip(frontier, infos):
+                name = _requirement_name(name)
+                key = _canonical_name(name)
+                graph.nodes[key] = (name, version, license_info, list(requires or []))
+                if parent is not None:
+                    graph.parents[key] = parent
+                for req in requires or []:
+                    req_key = _canonical_name(req)
+                    if req_key not in queued:
+                        queued.add(req_key)
+                        next_frontier.append((req, key))
+            frontier = next_frontier
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return graph
+
+# pip install --dry-run --report が使える pip のバージョン（22.2 以降）
+_INSTALL_REPORT_MIN_PIP = (22, 2)
+
+def install_report_supported():
+    """現在の pip がインストールレポート（--dry-run --report）に対応しているかを返します"""
+    from pip import __version__
+    version = tuple(int(part) for part in re.findall(r"\d+", __version__)[:2])
+    return version >= _INSTALL_REPORT_MIN_PIP
+
+class _ReportMetadata:
+    """インストールレポートの metadata（PEP 566 の JSON 形式）を _MetadataHeaders と同じ使い方で読むためのラッパーです"""
+
+    def __init__(self, metadata):
+        self._metadata = metadata
+
+    def get(self, name, default=None):
+        value = self._metadata.get(name.lower().replace('-', '_'))
+        if isinstance(value, list):
+            value = value[0] if value else None
+        return value if value is not None else default
+
+    def get_all(self, name, default=None):
+        value = self._metadata.get(name.lower().replace('-', '_'))
+        if value is None:
+            return default
+        return value if isinstance(value, list) else [value]
+
+    def __contains__(self, name):
+        return name.lower().replace('-', '_') in self._metadata
+
+@profiled("pip.resolve", "pip")
+def resolve_install_report(packages, pip_options=()):
+    """pip の依存関係の解決を一度だけ（--dry-run --report）行い、インストールされるパッケージのグラフを返します
+
+    パッケージは何もインストールせず、レポートに含まれる各候補のメタデータから
+    ライセンスと依存関係を読み取ります。要件を満たすバージョンがすでに
+    インストールされているパッケージはレポートに含まれないため、グラフにも入りません。
+    レポートからライセンスを判断できない wheel は、レポートにある wheel の URL（pip が
+    設定・環境変数・--extra-index-url を含めて選んだ絶対 URL）から METADATA を読み直します。
+    解決に失敗した場合は None を返します。
+    """
+    import json
+    import tempfile
+    from pip._internal.commands import create_command
+
+    fd, report_path = tempfile.mkstemp(prefix="pip-license-report-", suffix=".json")
+    os.close(fd)
+    try:
+        pip_install = create_command('install')
+        result = pip_install.main(['--dry-run', '--quiet', '--report', report_path]
+                                  + list(pip_options) + list(packages))
+        if result:
+            return None
+        with open(report_path, encoding='utf-8') as f:
+            report = json.load(f)
+    finally:
+        try:
+            os.unlink(report_path)
+        except OSError:
+            pass
+    return dependency_graph_from_report(report, packages,
+                                        lambda wheel_urls: _wheel_metadata_texts(wheel_urls, pip_options))
+
+def _report_license_incomplete(metadata, license_info):
+    """レポートの metadata だけではライセンスを正しく判断できないかを返します
+
+    pip は METADATA を JSON にするときに知らない項目を捨てるため、バージョンによっては
+    Metadata 2.4（PEP 639）の License-Expression がレポートに含まれません。
+    """
+    if not license_info:
+        return True
+    version = tuple(int(part) for part in re.findall(r"\d+", str(metadata.get("metadata_version") or ""))[:2])
+    return version >= (2, 4) and "license_expression" not in metadata
+
+def _wheel_metadata_texts(wheel_urls, pip_options=()):
+    """wheel の URL（file:// または HTTP）ごとの METADATA のテキストを返します（読めなかったものは None）"""
+    import zipfile
+    from urllib.parse import urlsplit
+    from urllib.request import url2pathname
+    texts = {}
+    remote = []
+    for wheel_url in wheel_urls:
+        parts = urlsplit(wheel_url)
+        if parts.scheme == 'file':
+            try:
+                texts[wheel_url] = _wheel_metadata_text(url2pathname(parts.path))
+            except (OSError, zipfile.BadZipFile) as e:
+                print(f"⚠️ {wheel_url} のメタデータを読めませんでした: {e}")
+                texts[wheel_url] = None
+        else:
+            remote.append(wheel_url)
+    if remote:
+        source = RemoteIndexSource(pip_options=pip_options)
+        try:
+            texts.update(source.wheel_metadata(remote))
+        finally:
+            source.close()
+    return texts
+
+def _install_args_from_report_item(name, version, item):
+    """インストールレポートの1項目を、同じファイル・コミットだけをインストールする pip install の引数にします"""
+    info = item.get("download_info") or {}
+    url = (info.get("url") or "").split('#', 1)[0]
+    if not url:
+        return [f"{name}=={version}"]
+    if "vcs_info" in info:
+        vcs_info = info["vcs_info"]
+        return [f"{name} @ {vcs_info.get('vcs', 'git')}+{url}@{vcs_info.get('commit_id')}"]
+    if "dir_info" in info:
+        if info["dir_info"].get("editable"):
+            return ["--editable", url]
+        return [f"{name} @ {url}"]
+    # 取得したファイルのハッシュを付けて、同じファイルであることを pip に確認させる
+    archive_info = info.get("archive_info") or {}
+    hashes = archive_info.get("hashes") or {}
+    if "sha256" in hashes:
+        url += f"#sha256={hashes['sha256']}"
+    elif archive_info.get("hash"):
+        url += "#" + archive_info["hash"]
+    return [f"{name} @ {url}"]
+
+def dependency_graph_from_report(report, packages, wheel_metadata=None):
+    """インストールレポートの内容から DependencyGraph を作ります
+
+    レポートからライセンスを判断できない wheel は、wheel_metadata（wheel の URL のリストを受け取り、
+    URL → METADATA のテキストを返す関数）で読んだ METADATA のライセンスを使います。
+    経路は要求されたパッケージから Requires-Dist を辿って、レポートに含まれる
+    パッケージの間だけで復元します（インストール済みのパッケージを経由する依存は経路が短くなる）。
+    """
+    graph = DependencyGraph(packages)
+    graph.install_args = []
+    requires_dist = {}
+    requested = []
+    incomplete = {}
+    for item in report.get("install", []):
+        metadata = item.get("metadata") or {}
+        meta = _ReportMetadata(metadata)
+        name = meta.get('Name') or ''
+        license_info, _ = _license_from_metadata(meta)
+        key = _canonical_name(name)
+        requires_dist[key] = meta.get_all('Requires-Dist') or []
+        graph.nodes[key] = (name, (meta.get('Version') or "Unknown").strip(), license_info or "Unknown",
+                            _requires_from_metadata(requires_dist[key]))
+        graph.install_args += _install_args_from_report_item(name, meta.get('Version') or '', item)
+        if item.get("requested"):
+            requested.append(key)
+        wheel_url = ((item.get("download_info") or {}).get("url") or "").split('#', 1)[0]
+        if wheel_metadata is not None and wheel_url.endswith('.whl') and \
+                _report_license_incomplete(metadata, license_info):
+            incomplete[wheel_url] = key
+
+    if incomplete:
+        for wheel_url, text in wheel_metadata(list(incomplete)).items():
+            license_info, _ = _license_from_metadata(_MetadataHeaders(text)) if text else ("", None)
+            if license_info:
+                key = incomplete[wheel_url]
+                name, version, _, requires = graph.nodes[key]
+                graph.nodes[key] = (name, version, license_info, requires)
+
+    # extra を指定した依存もレポートに含まれていれば辿れるよう、マーカーは評価しない
+    frontier = requested
+    seen = set(requested)
+    while frontier:
+        next_frontier = []
+        for key in frontier:
+            for line in requires_dist[key]:
+                match = _REQUIREMENT_NAME_RE.match(line)
+                req_key = _canonical_name(match.group(1)) if match else None
+                if req_key in graph.nodes and req_key not in seen:
+                    seen.add(req_key)
+                    graph.parents[req_key] = key
+                    next_frontier.append(req_key)
+        frontier = next_frontier
+    return graph
+
+# 許可リストにないライセンスへの対応方針
+# "prompt": 対話的に確認する（端末から実行した場合のデフォルト）
+# "deny": 確認せずに拒否する（端末に接続されていない場合のデフォルト）
+# "warn": 確認せずに続行し、違反は最後にまとめて警告する
+# "allow": 確認せずに続行する（--yes と同じ）。許可リストへの追加は --add-allowed を指定した場合のみ
+LICENSE_POLICIES = ("prompt", "deny", "warn", "allow")
+LICENSE_POLICY = os.environ.get("PIP_LICENSE_POLICY") or None
+LICENSE_ADD_ALLOWED = os.environ.get("PIP_LICENSE_ADD_ALLOWED", "") != ""
+
+# license コマンドの終了コード
+EXIT_OK = 0
+EXIT_LICENSE_DENIED = 1
+EXIT_USAGE = 2
+EXIT_INSTALL_FAILED = 3
+
+class LicensePolicy:
+    """許可リストにないライセンスが見つかったときの判断と、その結果の記録です
+
+    対話モード以外では確認を行わず、方針に従って判断した違反をまとめて記録し、
+    コマンドの最後に summary() で一度だけ報告します。allow でも add_allowed を
+    指定しない限り allowed_licenses.json は変更しません。
+    """
+
+    def __init__(self, mode=None, add_allowed=False):
+        if mode is None:
+            mode = "prompt" if sys.stdin is not None and sys.stdin.isatty() else "deny"
+        if mode not in LICENSE_POLICIES:
+            raise ValueError(f"不明なポリシーです: {mode}（{', '.join(LICENSE_POLICIES)} のいずれか）")
+        self.mode = mode
+        self.add_allowed = add_allowed
+        self.violations = {}
+        self.denied = False
+
+    @property
+    def interactive(self):
+        return self.mode == "prompt"
+
+    def record(self, name, version, license_info, path=None):
+        """許可されていないライセンスのパッケージを記録します"""
+        self.violations.setdefault(_canonical_name(name), (name, version, license_info, path))
+
+    def confirm(self, question):
+        """違反があっても続行するかどうかを判断します"""
+        if self.interactive:
+            while True:
+                answer = input(question).lower()
+                if answer == 'y':
+                    return True
+                elif answer == 'n':
+                    self.denied = True
+                    return False
+                print("'y' または 'n' を入力してください")
+        if self.mode == "deny":
+            self.denied = True
+            return False
+        return True
+
+    @property
+    def auto_add(self):
+        """確認せずに許可リストに追加するか（allow で --add-allowed を指定した場合のみ）"""
+        return self.mode == "allow" and self.add_allowed
+
+    def confirm_add(self, question):
+        """許可されていないライセンスを許可リストに追加するかどうかを判断します"""
+        if self.interactive:
+            return input(question).lower() == 'y'
+        return self.auto_add
+
+    def exit_code(self):
+        return EXIT_LICENSE_DENIED if self.denied else EXIT_OK
+
+    def summary(self):
+        """記録した違反と判断の一覧を返します（対話モードや違反がない場合は None）"""
+        if self.interactive or not self.violations:
+            return None
+        if self.mode == "allow":
+            decision = "✅ 続行して許可リストに追加" if self.auto_add else "✅ 続行（許可リストは変更しない）"
+        else:
+            decision = {"deny": "❌ 拒否", "warn": "⚠️ 警告のみ"}[self.mode]
+        lines = [f"\n📋 ライセンスポリシー（{self.mode}）: 許可リストにないパッケージ {len(self.violations)}個 - {decision}"]
+        for name, version, license_info, path in sorted(self.violations.values(), key=lambda v: v[0].lower()):
+            lines.append(f"  - {name} ({version}): {license_info}")
+            if path and len(path) > 1:
+                lines.append(f"    経路: {' → '.join(path)}")
+        if self.mode == "allow" and not self.auto_add:
+            lines.append("  許可リストに追加する場合は --add-allowed（または PIP_LICENSE_ADD_ALLOWED=1）を指定してください")
+        return "\n".join(lines)
+
+_LICENSE_POLICY = None
+
+def get_license_policy():
+    """現在のコマンドで使うライセンスポリシーを返します"""
+    global _LICENSE_POLICY
+    if _LICENSE_POLICY is None:
+        _LICENSE_POLICY = LicensePolicy(LICENSE_POLICY, LICENSE_ADD_ALLOWED)
+    return _LICENSE_POLICY
+
+@profiled("check_license", "phase")
+def check_license(package_name, lookup=None):
+    """パッケージのライセンスをチェックします"""
+    # パッケージのインストール前にメタデータのみを取得して確認（依存関係は推移的にすべて辿る）
+    # lookup に wheelhouse などの取得元を渡すと、未インストールのパッケージも確認できる
+    graph = build_dependency_graph([package_name], lookup)
+    _, version, license_info, requires = graph.get(package_name)
+    allowed_licenses = load_allowed_licenses()
+    matcher = get_license_matcher(allowed_licenses)
+    
+    policy = get_license_policy()
+    
+    # 正規化したライセンス名で比較
+    is_allowed = matcher.is_allowed(license_info, package_name, version)
+    
+    # 依存パッケージの情報収集前にパッケージの情報を先に表示
+    if is_allowed:
+        print(f"✅ {package_name} ({version}): {license_info} - ライセンス許可")
+    else:
+        print(f"⚠️ 警告: {package_name} ({version}) のライセンス ({license_info}) は許可リストにありません")
+        policy.record(package_name, version, license_info)
+    
+    # 依存パッケージがある場合、情報を収集
+    deps_info = []
+    not_allowed_deps = []
+    dependencies = graph.dependencies()
+    if dependencies:
+        print(f"\n📦 {package_name}の依存パッケージの情報を収集しました（{len(dependencies)}個、間接依存を含む）")
+        for dep_name, dep_version, dep_license, _ in dependencies:
+            # ライセンスをチェック
+            is_dep_allowed = matcher.is_allowed(dep_license, dep_name, dep_version)
             
             status = "✅ 許可" if is_dep_allowed else "❌ 不許可"
-            deps_info.append((req, dep_version, dep_license, status, is_dep_allowed))
+            deps_info.append((dep_name, dep_version, dep_license, status, is_dep_allowed))
             
             # 不許可のライセンスがある場合はリストに追加
             if not is_dep_allowed:
-                not_allowed_deps.append((req, dep_version, dep_license))
+                not_allowed_deps.append((dep_name, dep_version, dep_license))
+                policy.record(dep_name, dep_version, dep_license, graph.path_to(dep_name))
         
         # 依存パッケージの情報を表示
         if deps_info:
@@ -401,105 +2592,383 @@ def check_license(package_name):
             for dep_name, dep_version, dep_license, status, _ in deps_info:
                 print(f"  - {dep_name} ({dep_version}): {dep_license} - {status}")
             
-            # ライセンス不許可の依存パッケージがあるかチェック
-            if not_allowed_deps:
+            # ライセンス不許可の依存パッケージがあるかチェック（依存ツリー上の位置も表示）
+            # （対話モード以外ではコマンドの最後にまとめて報告する）
+            if not_allowed_deps and policy.interactive:
                 print("\n⚠️ 以下の依存パッケージのライセンスが許可されていません:")
                 for dep_name, dep_version, dep_license in not_allowed_deps:
                     print(f"  - {dep_name} ({dep_version}): {dep_license}")
+                    print(f"    経路: {' → '.join(graph.path_to(dep_name))}")
     
     # メインパッケージのライセンスが許可されていない場合は確認
     if not is_allowed:
-        while True:
-            user_input = input("\nインストールを続行しますか？ (y/n): ").lower()
-            if user_input == 'y':
-                add_to_list = input("このライセンスを許可リストに追加しますか？ (y/n): ").lower()
-                if add_to_list == 'y':
-                    allowed_licenses.append(license_info)
-                    save_allowed_licenses(allowed_licenses)
-                    print(f"ライセンス '{license_info}' を許可リストに追加しました")
-                break
-            elif user_input == 'n':
-                print("インストールをキャンセルしました")
-                return False, None, None, None
-            else:
-                print("'y' または 'n' を入力してください")
+        if not policy.confirm("\nインストールを続行しますか？ (y/n): "):
+            print("インストールをキャンセルしました")
+            return False, None, None, None
+        # 不明なライセンスやルールで拒否されているライセンスは許可リストに追加しない
+        if license_info and license_info != "Unknown" and \
+                not matcher.is_denied(license_info, package_name, version) and \
+                policy.confirm_add("このライセンスを許可リストに追加しますか？ (y/n): "):
+            allowed_licenses = allowed_licenses + [license_info]
+            save_allowed_licenses(allowed_licenses)
+            print(f"ライセンス '{license_info}' を許可リストに追加しました")
     
     # 依存パッケージのライセンスが不許可の場合、メインパッケージが許可されていても確認
     if not_allowed_deps:
-        while True:
-            continue_install = input(f"\n{package_name}と全ての依存パッケージをインストールしますか？ (y/n): ").lower()
-            if continue_install == 'y':
-                # 依存パッケージのライセンスも許可リストに追加するか確認
-                add_deps = input("依存パッケージのライセンスも許可リストに追加しますか？ (y/n): ").lower()
-                if add_deps == 'y':
-                    added_count = 0
-                    added_licenses = []
-                    
-                    # デバッグ情報：現在の許可リスト
-                    print(f"現在の許可リスト: {allowed_licenses}")
-                    print(f"追加対象の依存パッケージ: {len(not_allowed_deps)}個")
-                    
-                    # 最新の許可リストを取得
-                    try:
-                        # 許可リストを読み込み直す
-                        current_allowed = load_allowed_licenses()
-                        print(f"ファイルから読み込まれた現在の許可リスト: {current_allowed}")
-                    except Exception as e:
-                        print(f"現在の許可リスト読み込みエラー: {e}")
-                        current_allowed = allowed_licenses.copy()
-                    
-                    # 依存パッケージのライセンスを直接リストに追加
-                    for dep_name, dep_version, dep_license in not_allowed_deps:
-                        print(f"処理中: {dep_name} - {dep_license}")
-                        # まだ許可されていないライセンスのみ追加
-                        if dep_license and dep_license != "Unknown":
-                            if dep_license not in current_allowed and dep_license not in added_licenses:
-                                added_licenses.append(dep_license)
-                                added_count += 1
-                                print(f"- {dep_license} を追加します（{dep_name}から）")
-                    
-                    # デバッグ情報：追加するライセンス
-                    print(f"追加予定のライセンス: {added_licenses}")
-                    
-                    if added_count > 0:
-                        # 新しいライセンスリストを作成
-                        updated_licenses = current_allowed.copy()
-                        # 未知のライセンスは追加しない
-                        updated_licenses.extend([lic for lic in added_licenses if lic != "Unknown"])
-                        
-                        # 重複を除去
-                        updated_licenses = list(set(updated_licenses))
-                        
-                        print(f"最終的な許可リスト: {updated_licenses}")
-                        
-                        # 直接save_allowed_licensesを呼び出す
-                        try:
-                            save_allowed_licenses(updated_licenses)
-                            print(f"✅ {added_count}個の依存パッケージのライセンスを許可リストに追加しました")
-                            
-                            # メモリ上の変数も更新
-                            allowed_licenses = updated_licenses
-                        except Exception as e:
-                            print(f"❌ 許可リスト更新エラー: {e}")
+        if not policy.confirm(f"\n{package_name}と全ての依存パッケージをインストールしますか？ (y/n): "):
+            print("インストールをキャンセルしました")
+            return False, None, None, None
+        new_licenses = []
+        for dep_name, dep_version, dep_license in not_allowed_deps:
+            if dep_license and dep_license != "Unknown" and dep_license not in allowed_licenses and \
+                    dep_license not in new_licenses and not matcher.is_denied(dep_license, dep_name, dep_version):
+                new_licenses.append(dep_license)
+        # 依存パッケージのライセンスも許可リストに追加するか確認
+        if new_licenses and policy.confirm_add("依存パッケージのライセンスも許可リストに追加しますか？ (y/n): "):
+            save_allowed_licenses(allowed_licenses + new_licenses)
+            print(f"✅ {len(new_licenses)}個の依存パッケージのライセンスを許可リストに追加しました")
+
+    return True, version, license_info, requires
+
+@profiled("check_licenses", "phase")
+def check_licenses(packages, lookup=None, graph=None):
+    """複数のパッケージと依存関係全体をまとめてチェックし、違反についての確認を一度だけ行います
+
+    (proceed, graph) を返します。graph は要求されたすべてのパッケージをルートとする
+    依存関係グラフで、共通の依存パッケージは一度だけ解決されます。
+    resolve_install_report で作ったグラフを graph に渡すと、そのパッケージだけをチェックします。
+    """
+    if graph is None:
+        graph = build_dependency_graph(packages, lookup)
+    allowed_licenses = load_allowed_licenses()
+    matcher = get_license_matcher(allowed_licenses)
+    
+    # 要求されたパッケージのライセンスを表示
+    for package in packages:
+        node = graph.get(package)
+        if node is None:
+            print(f"✅ {package}: 要件を満たすバージョンがインストール済みです")
+            continue
+        name, version, license_info, _ = node
+        if matcher.is_allowed(license_info, name, version):
+            print(f"✅ {name} ({version}): {license_info} - ライセンス許可")
+        else:
+            print(f"⚠️ 警告: {name} ({version}) のライセンス ({license_info}) は許可リストにありません")
+    
+    # 依存パッケージ（要求されたパッケージ全体で共通のものは一度だけ）を表示
+    dependencies = graph.dependencies()
+    if dependencies:
+        print(f"\n📦 依存パッケージとそのライセンス（{len(dependencies)}個、間接依存を含む）:")
+        for dep_name, dep_version, dep_license, _ in dependencies:
+            status = "✅ 許可" if matcher.is_allowed(dep_license, dep_name, dep_version) else "❌ 不許可"
+            print(f"  - {dep_name} ({dep_version}): {dep_license} - {status}")
+    
+    violations = [(name, version, license_info) for name, version, license_info, _ in graph.nodes.values()
+                  if not matcher.is_allowed(license_info, name, version)]
+    if not violations:
+        return True, graph
+    
+    # 違反はまとめて表示して一度だけ確認する（対話モード以外ではコマンドの最後にまとめて報告する）
+    policy = get_license_policy()
+    for name, version, license_info in violations:
+        policy.record(name, version, license_info, graph.path_to(name))
+    if policy.interactive:
+        print("\n⚠️ 以下のパッケージのライセンスが許可されていません:")
+        for name, version, license_info in violations:
+            print(f"  - {name} ({version}): {license_info}")
+            print(f"    経路: {' → '.join(graph.path_to(name))}")
+    
+    if not policy.confirm(f"\n{len(packages)}個のパッケージと全ての依存パッケージをインストールしますか？ (y/n): "):
+        print("インストールをキャンセルしました")
+        return False, graph
+    
+    new_licenses = []
+    for name, version, license_info in violations:
+        # ルールで拒否されているライセンスは許可リストに追加しても許可にならない
+        if license_info and license_info != "Unknown" and license_info not in new_licenses and \
+                not matcher.is_denied(license_info, name, version):
+            new_licenses.append(license_info)
+    if new_licenses:
+        if policy.confirm_add(f"これらのライセンス（{len(new_licenses)}個）を許可リストに追加しますか？ (y/n): "):
+            save_allowed_licenses(allowed_licenses + new_licenses)
+            for license_info in new_licenses:
+                print(f"ライセンス '{license_info}' を許可リストに追加しました")
+    return True, graph
+
+# requirements ファイルの解析
+_REQUIREMENTS_COMMENT_RE = _LazyPattern(r"(^|\s+)#.*$")
+_REQUIREMENTS_ENV_VAR_RE = _LazyPattern(r"\$\{([A-Z0-9_]+)\}")
+_REQUIREMENTS_OPTION_RE = _LazyPattern(r"(?:^|\s)(--?[A-Za-z][\w-]*)")
+_REQUIREMENT_PREFIX_RE = _LazyPattern(r"\s*[A-Za-z0-9](?:[A-Za-z0-9._-]*[A-Za-z0-9])?(?:\s*\[[^\]]*\])?")
+DEFAULT_CHECK_WINDOW = 64
+
+def _requirements_lines(path):
+    """requirements ファイルを1行ずつ読み、継続行の連結・コメントの除去・環境変数の展開をした (行番号, 行) を返します"""
+    with open(path, encoding='utf-8') as f:
+        parts = []
+        start = None
+        for number, line in enumerate(f, 1):
+            line = line.rstrip('\r\n')
+            if start is None:
+                start = number
+            if line.endswith('\\') and not _REQUIREMENTS_COMMENT_RE.search(line):
+                parts.append(line[:-1])
+                continue
+            parts.append(line)
+            logical = _REQUIREMENTS_COMMENT_RE.sub('', ' '.join(parts)).strip()
+            parts, first = [], start
+            start = None
+            if logical:
+                yield first, _REQUIREMENTS_ENV_VAR_RE.sub(
+                    lambda m: os.environ.get(m.group(1), m.group(0)), logical)
+        if parts:
+            logical = _REQUIREMENTS_COMMENT_RE.sub('', ' '.join(parts)).strip()
+            if logical:
+                yield start, logical
+
+def _split_requirement_line(line):
+    """1行を要求仕様の部分とオプション（--hash など）の並びに分けます"""
+    match = _REQUIREMENTS_OPTION_RE.search(line)
+    if match is None:
+        return line.strip(), []
+    requirement, options = line[:match.start()].strip(), line[match.start():].split()
+    # -rFILE / --requirement=FILE の形も「オプション, 値」に分ける
+    tokens = []
+    for token in options:
+        if token.startswith('--') and '=' in token:
+            tokens.extend(token.split('=', 1))
+        elif len(token) > 2 and token[0] == '-' and token[1] in 'rcefi' and token[1] != '-':
+            tokens.extend([token[:2], token[2:]])
+        else:
+            tokens.append(token)
+    return requirement, tokens
+
+def _requirement_from_line(requirement):
+    """要求仕様の部分からマーカーと URL を除いた仕様を返します（この環境に該当しない・名前がない場合は None）"""
+    requirement, _, marker = requirement.partition(';')
+    if marker.strip() and not _marker_applies(marker.strip()):
+        return None
+    requirement = requirement.strip()
+    if ' @ ' in requirement or requirement.startswith(('http://', 'https://', 'file:', '.', '/')):
+        # name @ URL は名前だけ、名前のない URL やパスは wheel のファイル名からのみ名前を取り出す
+        head = requirement.split(' @ ', 1)[0].strip() if ' @ ' in requirement else None
+        if head is None:
+            filename = requirement.rstrip('/').rsplit('/', 1)[-1]
+            head = filename.split('-', 1)[0] if filename.endswith('.whl') else None
+        return head or None
+    return requirement or None
+
+def _requirement_options(path, included):
+    """requirements ファイルと -r で読み込まれるファイルに書かれた (オプション, 値, ファイルのディレクトリ) を返します"""
+    path = os.path.abspath(path)
+    if path in included:
+        return
+    included.add(path)
+    directory = os.path.dirname(path)
+    for _, line in _requirements_lines(path):
+        _, tokens = _split_requirement_line(line)
+        for option, value in zip(tokens, tokens[1:]):
+            if option in ('-r', '--requirement'):
+                yield from _requirement_options(value if os.path.isabs(value) else os.path.join(directory, value),
+                                                included)
+            elif option in ('-c', '--constraint'):
+                yield option, value, directory
+
+def _iter_requirement_entries(path, constraints, included):
+    """1つの requirements ファイルの要求仕様を (仕様, 出所) としてストリームで返します（-r は再帰的に展開）"""
+    path = os.path.abspath(path)
+    if path in included:
+        return
+    included.add(path)
+    directory = os.path.dirname(path)
+    for number, line in _requirements_lines(path):
+        requirement, tokens = _split_requirement_line(line)
+        origin = f"{os.path.relpath(path)}:{number}"
+        position = 0
+        while position < len(tokens):
+            option = tokens[position]
+            value = tokens[position + 1] if position + 1 < len(tokens) else None
+            position += 1
+            if option in ('-r', '--requirement', '-c', '--constraint', '-e', '--editable') and value is not None:
+                position += 1
+                if option in ('-e', '--editable'):
+                    # 編集可能インストールは #egg=名前 が書かれている場合のみ確認する
+                    egg = value.partition('#egg=')[2]
+                    if egg:
+                        yield egg.split('&', 1)[0], origin
                     else:
-                        print("追加するライセンスがありませんでした")
-                break
-            elif continue_install == 'n':
-                print("インストールをキャンセルしました")
-                return False, None, None, None
-            else:
-                print("'y' または 'n' を入力してください")
+                        print(f"⚠️ 名前を特定できない編集可能インストールをスキップします: {value}（{origin}）")
+                    continue
+                # -c の constraints ファイルは iter_requirements が先に読み込んでいる
+                if option in ('-r', '--requirement'):
+                    included_path = value if os.path.isabs(value) else os.path.join(directory, value)
+                    yield from _iter_requirement_entries(included_path, constraints, included)
+            # --hash / --index-url などの他のオプションはライセンスの確認には影響しない
+        if requirement:
+            spec = _requirement_from_line(requirement)
+            if spec is None:
+                if ';' not in requirement:
+                    print(f"⚠️ 名前を特定できない要求をスキップします: {requirement}（{origin}）")
+                continue
+            yield spec, origin
+
+def load_constraints(path, constraints):
+    """constraints ファイルを読み、正規化名→バージョン指定を constraints に追加します"""
+    for spec, _ in _iter_requirement_entries(path, constraints, set()):
+        prefix = _REQUIREMENT_PREFIX_RE.match(spec)
+        specifier = spec[prefix.end():].strip() if prefix else ''
+        if specifier:
+            constraints.setdefault(_canonical_name(_requirement_name(spec)), specifier)
+    return constraints
+
+def iter_requirements(paths, constraint_paths=()):
+    """requirements ファイル群の要求仕様を重複なく (仕様, 出所) としてストリームで返します
+
+    -r による読み込みは再帰的に展開し、-c で指定された constraints ファイルの
+    バージョン指定は、バージョンの指定がない要求仕様に適用します（ファイル内のどこに
+    -c が書かれていても適用できるよう、constraints ファイルだけは先に読み込みます）。
+    constraints ファイルにだけ書かれたパッケージは返しません。
+    """
+    constraints = {}
+    constraint_paths = list(constraint_paths)
+    included = set()
+    for path in paths:
+        for _, value, directory in _requirement_options(path, included):
+            constraint_paths.append(value if os.path.isabs(value) else os.path.join(directory, value))
+    for path in constraint_paths:
+        load_constraints(path, constraints)
+    seen = set()
+    included = set()
+    for path in paths:
+        for spec, origin in _iter_requirement_entries(path, constraints, included):
+            key = _canonical_name(_requirement_name(spec))
+            if key in seen:
+                continue
+            seen.add(key)
+            prefix = _REQUIREMENT_PREFIX_RE.match(spec)
+            if prefix and not spec[prefix.end():].strip() and key in constraints:
+                spec = f"{spec.strip()}{constraints[key]}"
+            yield spec, origin
+
+def _version_mismatch(spec, version):
+    """要求仕様のバージョン指定を満たさない場合はその指定を返します"""
+    prefix = _REQUIREMENT_PREFIX_RE.match(spec)
+    specifier = spec[prefix.end():].strip() if prefix else ''
+    if not specifier or version == "Unknown":
+        return None
+    from pip._vendor.packaging.specifiers import InvalidSpecifier, SpecifierSet
+    try:
+        if SpecifierSet(specifier).contains(version, prereleases=True):
+            return None
+    except InvalidSpecifier:
+        return None
+    return specifier
+
+@profiled("check_requirements", "phase")
+def check_requirement_files(paths, lookup=None, constraint_paths=(), window=DEFAULT_CHECK_WINDOW):
+    """requirements / constraints ファイルのパッケージをまとめてチェックします
+
+    ファイルはストリームで読み、最大 window 件を並行して解決しながら、結果は完了した順に
+    表示します。依存関係は辿らないため、ロックファイルのようにすべての依存が書かれた
+    ファイルを想定しています。(許可, 不許可, 見つからない) の件数を返します。
+    """
+    from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+    lookup = lookup or get_package_info
+    prefetch = getattr(lookup, 'prefetch', None)
+    matcher = get_license_matcher()
+    policy = get_license_policy()
+    counts = [0, 0, 0]
+
+    def report(spec, origin, info):
+        version, license_info, _ = info
+        name = _requirement_name(spec)
+        if version == "Unknown":
+            counts[2] += 1
+            print(f"❔ {name}: メタデータが見つかりません（{origin}）")
+            return
+        mismatch = _version_mismatch(spec, version)
+        note = f"（要求: {mismatch}）" if mismatch else ""
+        if matcher.is_allowed(license_info, name, version):
+            counts[0] += 1
+            print(f"✅ {name} ({version}){note}: {license_info} - ライセンス許可")
+        else:
+            counts[1] += 1
+            policy.record(name, version, license_info)
+            print(f"❌ {name} ({version}){note}: {license_info} - 許可リストにありません（{origin}）")
+
+    requirements = iter_requirements(paths, constraint_paths)
+    if prefetch is not None:
+        # リモートの取得元などは window 件ずつまとめて先読みしてから結果を表示する
+        batch = []
+        for entry in requirements:
+            batch.append(entry)
+            if len(batch) >= window:
+                prefetch([spec for spec, _ in batch])
+                for spec, origin in batch:
+                    report(spec, origin, lookup(spec))
+                batch = []
+        if batch:
+            prefetch([spec for spec, _ in batch])
+            for spec, origin in batch:
+                report(spec, origin, lookup(spec))
+    else:
+        with ThreadPoolExecutor(max_workers=min(window, 32)) as executor:
+            pending = {}
+            for spec, origin in requirements:
+                if len(pending) >= window:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        report(*pending.pop(future), future.result())
+                pending[executor.submit(lookup, spec)] = (spec, origin)
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    report(*pending.pop(future), future.result())
     
-    return True, version, license_info, requires
+    print(f"\n📋 {sum(counts)}個のパッケージをチェックしました: 許可 {counts[0]} / "
+          f"許可リストにない {counts[1]} / 見つからない {counts[2]}")
+    if counts[1] and policy.mode == "deny":
+        policy.denied = True
+    return tuple(counts)
 
 def license_command():
     """ライセンスコマンドの実装"""
+    import argparse
+    global METADATA_BACKEND, METADATA_CACHE_ENABLED, SERVE_ENABLED, _PROFILER, _LICENSE_POLICY
+
     parser = argparse.ArgumentParser(description='pip ライセンスチェッカー')
+    parser.add_argument('--metadata-backend', choices=METADATA_BACKENDS, default=None,
+                        help='パッケージ情報の取得方法（デフォルト: importlib、subprocess は pip show を使用）')
+    parser.add_argument('--no-cache', action='store_true',
+                        help='メタデータの永続キャッシュを使用しない')
+    parser.add_argument('--no-daemon', action='store_true',
+                        help='常駐プロセス（pip license serve）が起動していても使用しない')
+    policy_group = parser.add_mutually_exclusive_group()
+    policy_group.add_argument('--policy', choices=LICENSE_POLICIES, default=None,
+                              help='許可リストにないライセンスへの対応（デフォルト: 端末からは prompt、'
+                                   'それ以外は deny。環境変数 PIP_LICENSE_POLICY でも指定可能）')
+    policy_group.add_argument('-y', '--yes', action='store_true',
+                              help='確認せずに続行する（--policy allow と同じ）')
+    parser.add_argument('--add-allowed', action='store_true',
+                        help='--policy allow / --yes で続行したライセンスを許可リストに追加する'
+                             '（環境変数 PIP_LICENSE_ADD_ALLOWED でも指定可能）')
+    parser.add_argument('--timings', action='store_true',
+                        help='フェーズごとの所要時間・サブプロセス数・書き込みバイト数を表示する')
+    parser.add_argument('--trace', default=None, metavar='FILE',
+                        help='フェーズごとのスパンを Chrome のトレースイベント形式（JSON）で書き出す')
     subparsers = parser.add_subparsers(dest='command', help='コマンド')
     
     # install サブコマンド
     install_parser = subparsers.add_parser('install', help='パッケージのインストールとライセンスチェック')
     install_parser.add_argument('packages', nargs='+', help='インストールするパッケージ')
+    install_parser.add_argument('-f', '--find-links', action='append', default=[], metavar='DIR',
+                                help='wheel を探すローカルディレクトリ（インストール前に wheel の METADATA でライセンスを確認）')
+    install_parser.add_argument('-i', '--index-url', default=None, metavar='URL',
+                                help='インストール前にメタデータを取得するパッケージインデックス（Simple API）')
+    install_parser.add_argument('--no-resolve', action='store_true',
+                                help='pip の依存関係の解決（--dry-run --report）を使わず、インストール済みのメタデータ'
+                                     '（-f / -i 指定時はその取得元）から依存関係を辿ってチェックする')
     
     # list サブコマンド
     list_parser = subparsers.add_parser('list', help='許可されたライセンスの一覧を表示')
@@ -514,41 +2983,187 @@ def license_command():
     
     # check サブコマンド
     check_parser = subparsers.add_parser('check', help='指定したパッケージのライセンスをチェック')
-    check_parser.add_argument('packages', nargs='+', help='チェックするパッケージ')
+    check_parser.add_argument('packages', nargs='*', help='チェックするパッケージ')
+    check_parser.add_argument('-r', '--requirement', action='append', default=[], metavar='FILE',
+                              help='requirements ファイルに書かれたパッケージをまとめてチェック（複数指定可）')
+    check_parser.add_argument('-c', '--constraint', action='append', default=[], metavar='FILE',
+                              help='バージョンの指定に使う constraints ファイル（複数指定可）')
+    check_parser.add_argument('--window', type=int, default=DEFAULT_CHECK_WINDOW, metavar='N',
+                              help=f'-r で同時に解決するパッケージの数（デフォルト: {DEFAULT_CHECK_WINDOW}）')
+    check_parser.add_argument('-f', '--find-links', action='append', default=[], metavar='DIR',
+                              help='wheel を探すローカルディレクトリ（未インストールのパッケージも確認）')
+    check_parser.add_argument('-i', '--index-url', default=None, metavar='URL',
+                              help='未インストールのパッケージのメタデータを取得するパッケージインデックス（Simple API）')
+    # インデックスへの接続の設定（pip と同じ。省略時は pip の設定ファイルと環境変数に従う）
+    for network_parser in (install_parser, check_parser):
+        network_parser.add_argument('--proxy', default=None, metavar='URL',
+                                    help='プロキシ（scheme://[user:passwd@]proxy.server:port）')
+        network_parser.add_argument('--cert', default=None, metavar='PATH', help='CA 証明書のファイル')
+        network_parser.add_argument('--client-cert', default=None, metavar='PATH',
+                                    help='クライアント証明書（秘密鍵と証明書を含む PEM ファイル）')
 
     # init サブコマンド
     init_parser = subparsers.add_parser('init', help='プロジェクトの初期化')
     
     # scan サブコマンド
     scan_parser = subparsers.add_parser('scan', help='既存のインストール済みパッケージをスキャンして記録')
+    scan_parser.add_argument('--env', action='append', default=[], metavar='PATH',
+                             help='スキャンする仮想環境・インストール先・インタープリター・コンテナのルート（複数指定可）')
+    scan_parser.add_argument('--site-packages', action='append', default=[], metavar='DIR',
+                             help='スキャンする site-packages ディレクトリ（複数指定可）')
+    scan_parser.add_argument('-j', '--jobs', type=int, default=None,
+                             help='メタデータを解析するプロセス数（デフォルト: CPU数）')
+    scan_parser.add_argument('--report', default=None, metavar='FILE',
+                             help='環境ごとの結果と全環境のライセンス一覧を JSON で書き出す（--env / --site-packages 使用時）')
+    scan_parser.add_argument('--input', default=None, metavar='FILE',
+                             help='インストール済みのパッケージの代わりに、export で書き出した JSONL / CSV を読み込む')
     
     # update サブコマンド
     update_parser = subparsers.add_parser('update', help='requirements_license.txtのステータスを更新')
     
-    args = parser.parse_args(sys.argv[2:])
+    # export サブコマンド
+    export_parser = subparsers.add_parser('export', help='パッケージとライセンスの一覧を JSONL / CSV / CycloneDX で書き出す')
+    export_parser.add_argument('--format', choices=EXPORT_FORMATS, default='jsonl', help='出力形式（デフォルト: jsonl）')
+    export_parser.add_argument('-o', '--output', default=None, metavar='FILE', help='出力先（デフォルト: 標準出力）')
+    export_parser.add_argument('--input', default=None, metavar='FILE',
+                               help='インストール済みのパッケージの代わりに、以前に export した JSONL / CSV を読み込む')
+    export_parser.add_argument('--site-packages', action='append', default=[], metavar='DIR',
+                               help='書き出す site-packages ディレクトリ（複数指定可、デフォルト: 現在の環境）')
+    
+    # serve サブコマンド
+    serve_parser = subparsers.add_parser('serve', help='インストール済みパッケージの索引を保持する常駐プロセスを起動')
+    serve_parser.add_argument('--socket', default=None, metavar='PATH',
+                              help='Unix ドメインソケットのパス（デフォルト: キャッシュディレクトリに環境ごとに作成）')
+    serve_parser.add_argument('--interval', type=float, default=DEFAULT_SERVE_INTERVAL, metavar='SECONDS',
+                              help=f'site-packages の変更を確認する間隔（デフォルト: {DEFAULT_SERVE_INTERVAL}秒）')
+    serve_action = serve_parser.add_mutually_exclusive_group()
+    serve_action.add_argument('--status', action='store_true', help='起動中の常駐プロセスの状態を表示')
+    serve_action.add_argument('--stop', action='store_true', help='起動中の常駐プロセスを終了')
     
+    # cache サブコマンド
+    cache_parser = subparsers.add_parser('cache', help='メタデータキャッシュの管理')
+    cache_parser.add_argument('action', choices=['stats', 'clear'], help='stats: 統計を表示, clear: 削除')
+    
+    args = parser.parse_args(sys.argv[2:])
+    timings = args.timings or PROFILE_TIMINGS
+    trace_path = args.trace or PROFILE_TRACE_PATH
+    if (timings or trace_path) and _PROFILER is None:
+        _PROFILER = Profiler()
+        _PROFILER.hook_subprocesses()
+    if args.metadata_backend:
+        METADATA_BACKEND = args.metadata_backend
+    if args.no_cache:
+        METADATA_CACHE_ENABLED = False
+    if args.no_daemon:
+        SERVE_ENABLED = False
+
     if not args.command:
         parser.print_help()
-        return
+        return EXIT_USAGE
+    
+    try:
+        policy = LicensePolicy("allow" if args.yes else args.policy or LICENSE_POLICY,
+                               args.add_allowed or LICENSE_ADD_ALLOWED)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return EXIT_USAGE
+    _LICENSE_POLICY = policy
+    
+    try:
+        with profile_span(f"license {args.command}", "command"):
+            try:
+                exit_code = _run_license_command(args)
+            finally:
+                # 許可リストの変更と解決したメタデータはコマンドの最後にまとめて保存する
+                commit_allowed_licenses()
+                flush_metadata_cache()
+    finally:
+        if _PROFILER is not None:
+            _finish_profiling(timings, trace_path)
     
+    # 対話モード以外では、違反と判断の結果をここで一度だけ報告する
+    summary = policy.summary()
+    if summary:
+        print(summary)
+    return exit_code or policy.exit_code()
+
+def _finish_profiling(timings, trace_path):
+    """計測を終了し、集計表の表示とトレースファイルの書き出しを行います"""
+    global _PROFILER
+    profiler, _PROFILER = _PROFILER, None
+    profiler.close()
+    if timings:
+        print("\n⏱️ フェーズごとの所要時間:", file=sys.stderr)
+        print(profiler.summary(), file=sys.stderr)
+    if trace_path:
+        try:
+            profiler.write_trace(trace_path)
+        except OSError as e:
+            print(f"⚠️ トレースファイルの書き込みに失敗しました: {e}", file=sys.stderr)
+        else:
+            print(f"📝 トレースを書き出しました: {trace_path}（chrome://tracing や Perfetto で表示できます）",
+                  file=sys.stderr)
+
+def _run_license_command(args):
+    """解析済みの引数に従ってライセンスコマンドを実行します（ポリシー以外の理由で失敗した場合は終了コードを返す）"""
+    exit_code = None
     if args.command == 'install':
-        for package in args.packages:
-            print(f"📝 {package}のライセンス確認を開始します（依存パッケージも含む）")
-            proceed, version, license_info, requires = check_license(package)
-            if proceed:
-                # 実際のインストールを実行
-                print(f"🔄 {package}とその依存パッケージをインストールしています...")
-                pip_install = create_command('install')
-                pip_install.main([package])
-                # requirements_license.txtを更新
-                update_requirements_license(package, version, license_info, requires)
-                print(f"📝 {package} をrequirements_license.txtに追加しました")
+        # requirements_license.txt への変更はまとめてコマンドの最後に一度だけ書き込む
+        inventory = RequirementsLicenseFile.load()
+        pip_options = []
+        for directory in args.find_links:
+            pip_options += ['--find-links', directory]
+        if args.index_url:
+            pip_options += ['--index-url', args.index_url]
+        pip_options += _network_pip_options(args)
+        # 要求されたパッケージと依存関係全体をまとめてチェックする
+        print(f"📝 {', '.join(args.packages)} のライセンス確認を開始します（依存パッケージも含む）")
+        lookup = graph = None
+        if not args.no_resolve and install_report_supported():
+            # pip の依存関係の解決を一度だけ実行し、実際にインストールされるパッケージだけをチェックする
+            print("🔍 pip で依存関係を解決しています（まだインストールはしません）...")
+            graph = resolve_install_report(args.packages, pip_options)
+            if graph is None:
+                print("❌ 依存関係の解決に失敗しました")
+                exit_code = EXIT_INSTALL_FAILED
+        else:
+            lookup = _lookup_for_args(args)
+        proceed = exit_code is None and check_licenses(args.packages, lookup, graph)[0]
+        if proceed:
+            result = 0
+            if graph is not None and not graph.install_args:
+                print("✅ インストールが必要なパッケージはありません（すべてインストール済みです）")
             else:
-                print(f"⚠️ {package} のインストールをキャンセルしました")
+                if graph is not None:
+                    # 解決し直すと索引の更新やマーカーで結果が変わりうるため、チェックしたレポートの
+                    # ファイル・コミットだけを依存関係の解決なしでインストールする
+                    install_args = ['--no-deps'] + graph.install_args
+                else:
+                    install_args = list(args.packages)
+                print(f"🔄 {len(args.packages)}個のパッケージとその依存パッケージをインストールしています...")
+                # pip のログや設定はプロセス全体の状態のため、同じプロセスで install コマンドを
+                # 二度実行せず、別プロセスの pip（このモジュールを経由しない python -m pip）で実行する
+                with profile_span("pip.install", "pip", packages=list(args.packages)):
+                    import subprocess
+                    result = subprocess.call([sys.executable, "-m", "pip", "install"] + pip_options + install_args)
+            if result:
+                print(f"❌ インストールに失敗しました（終了コード: {result}）")
+                exit_code = EXIT_INSTALL_FAILED
+            else:
+                # インストール後のメタデータでrequirements_license.txtをまとめて更新
+                record_dependency_graph(build_dependency_graph(args.packages), inventory)
+                for package in args.packages:
+                    print(f"📝 {package} をrequirements_license.txtに追加しました")
+        elif exit_code is None:
+            print(f"⚠️ {', '.join(args.packages)} のインストールをキャンセルしました")
+        if lookup is not None:
+            lookup.close()
     
         # インストール後に全パッケージのライセンスステータスを更新
         print("\n🔄 全パッケージのライセンスステータスを確認しています...")
-        update_license_status()
+        update_license_status(inventory)
+        inventory.flush()
+        rebuild_license_index()
         print("✅ ライセンスステータスを更新しました")
     elif args.command == 'list':
         allowed_licenses = load_allowed_licenses()
@@ -558,6 +3173,17 @@ def license_command():
                 print(f"- {license}")
         else:
             print("許可されたライセンスはありません")
+        rules = load_license_rules()
+        if rules:
+            print("ルール（パッケージ・バージョンを指定したものが優先、同じ条件では拒否が優先）:")
+            for rule in rules:
+                action = "拒否" if "deny" in rule else "許可"
+                pattern = rule.get("deny", rule.get("allow"))
+                kind = "正規表現" if rule.get("regex") else "パターン"
+                scope = ""
+                if rule.get("package"):
+                    scope = f"（{rule['package']}{' ' + str(rule['version']) if rule.get('version') else ''} のみ）"
+                print(f"- {action}: {kind} {pattern}{scope}")
     
     elif args.command == 'add':
         allowed_licenses = load_allowed_licenses()
@@ -565,8 +3191,8 @@ def license_command():
             allowed_licenses.append(args.license)
             save_allowed_licenses(allowed_licenses)
             print(f"ライセンス '{args.license}' を許可リストに追加しました")
-            # ライセンスを追加した後、requirements_license.txtを更新
-            update_license_status()
+            # ライセンスを追加した後、影響するエントリーだけrequirements_license.txtを更新
+            refresh_license_status()
         else:
             print(f"ライセンス '{args.license}' は既に許可リストに存在します")
     
@@ -576,192 +3202,1795 @@ def license_command():
             allowed_licenses.remove(args.license)
             save_allowed_licenses(allowed_licenses)
             print(f"ライセンス '{args.license}' を許可リストから削除しました")
-            # ライセンスを削除した後、requirements_license.txtを更新
-            update_license_status()
+            # ライセンスを削除した後、影響するエントリーだけrequirements_license.txtを更新
+            refresh_license_status()
         else:
             print(f"ライセンス '{args.license}' は許可リストに存在しません")
     
     elif args.command == 'check':
+        if not args.packages and not args.requirement:
+            print("❌ チェックするパッケージか -r FILE を指定してください")
+            return EXIT_USAGE
+        lookup = _lookup_for_args(args)
         for package in args.packages:
-            check_license(package)
+            check_license(package, lookup)
+        if args.requirement:
+            try:
+                check_requirement_files(args.requirement, lookup, args.constraint, max(1, args.window))
+            except OSError as e:
+                print(f"❌ requirements ファイルを読み込めません: {e}")
+                exit_code = EXIT_USAGE
+        if lookup is not None:
+            lookup.close()
     
     elif args.command == 'init':
         ensure_config_exists()
-        ensure_requirements_license_exists()
+        # requirements_license.txt は読み込まず、1行ずつ読みながら書き換える
         scan_installed_packages()
         
-        # 最後にすべてのパッケージのライセンスステータスを確認して更新
+        # 最後にすべてのパッケージのライセンスステータスを確認して更新（変更がなければ書き込まない）
         print("\n🔄 全パッケージのライセンスステータスを最終確認しています...")
         update_license_status()
+        rebuild_license_index()
         print("✅ プロジェクトを初期化しました")
     
+    elif args.command == 'scan' and (args.env or args.site_packages):
+        # 指定された環境をまとめてスキャンする（requirements_license.txt は変更しない）
+        environments = []
+        for env_path in args.env:
+            directories = find_site_packages(env_path)
+            if directories:
+                environments.append((env_path, directories))
+            else:
+                print(f"⚠️ {env_path} に site-packages が見つかりませんでした")
+        environments += [(directory, [directory]) for directory in args.site_packages]
+        if not environments:
+            return EXIT_USAGE
+        scan_environments(environments, args.jobs, args.report)
+    
     elif args.command == 'scan':
-        scan_installed_packages()
+        # requirements_license.txt は読み込まず、1行ずつ読みながら書き換える
+        scan_installed_packages(input_path=args.input)
         
-        # スキャン後にすべてのパッケージのライセンスステータスを確認して更新
+        # スキャン後にすべてのパッケージのライセンスステータスを確認して更新（変更がなければ書き込まない）
         print("\n🔄 全パッケージのライセンスステータスを確認しています...")
         update_license_status()
+        rebuild_license_index()
         print("✅ インストール済みのパッケージをスキャンしました")
     
     elif args.command == 'update':
-        update_license_status()
+        refresh_license_status()
         print("✅ ライセンスステータスを更新しました")
+    
+    elif args.command == 'export':
+        exit_code = _run_export_command(args)
+    
+    elif args.command == 'serve':
+        exit_code = _run_serve_command(args)
+    
+    elif args.command == 'cache':
+        cache = MetadataCache(os.path.join(CACHE_DIR, "metadata-cache.json"), DEFAULT_CACHE_MAX_ENTRIES)
+        shared = SharedLicenseCache(os.path.join(CACHE_DIR, "licenses"), DEFAULT_SHARED_CACHE_MAX_ENTRIES)
+        if args.action == 'clear':
+            cache.clear()
+            shared.clear()
+            print(f"✅ メタデータキャッシュを削除しました: {cache.path}")
+            print(f"✅ 共有キャッシュを削除しました: {shared.root}")
+        else:
+            stats = cache.stats()
+            print(f"キャッシュファイル: {stats['path']}")
+            print(f"エントリー数: {stats['entries']} / {stats['max_entries']}")
+            print(f"ファイルサイズ: {stats['size_bytes']} バイト")
+            for source, count in sorted(stats['sources'].items()):
+                print(f"- {source}: {count}")
+            shared_stats = shared.stats()
+            print(f"共有キャッシュ: {shared_stats['path']}")
+            print(f"エントリー数: {shared_stats['entries']} / {shared_stats['max_entries']}"
+                  f"（{shared_stats['size_bytes']} バイト）")
+    return exit_code
+
+def _run_export_command(args):
+    """export サブコマンドを実行します（標準出力に書き出す場合はほかのメッセージを標準エラー出力に回す）"""
+    import contextlib
+    paths = args.site_packages or None
+    try:
+        if args.output:
+            with _AtomicWriter(args.output) as out:
+                count = export_licenses(args.format, out, paths, args.input)
+            print(f"📝 {count}個のパッケージを書き出しました: {args.output}")
+        else:
+            out = sys.stdout
+            with contextlib.redirect_stdout(sys.stderr):
+                count = export_licenses(args.format, out, paths, args.input)
+                out.flush()
+                print(f"📝 {count}個のパッケージを書き出しました")
+                # 設定ファイルを新しく作った場合の保存のメッセージも出力に混ざらないようにする
+                commit_allowed_licenses()
+    except BrokenPipeError:
+        # head などが途中で読むのをやめた場合は、残りの出力を捨てて正常に終了する
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return None
+    except (OSError, ValueError) as e:
+        print(f"❌ 書き出しに失敗しました: {e}", file=sys.stderr)
+        return EXIT_USAGE
+    return None
 
-def scan_installed_packages():
-    """インストール済みのパッケージをスキャンしてrequirements_license.txtに追加します"""
-    print("インストール済みのパッケージをスキャンしています...")
+def _run_serve_command(args):
+    """serve サブコマンドを実行します"""
+    socket_path = args.socket or default_socket_path()
+    if args.status or args.stop:
+        client = DaemonClient.connect(socket_path)
+        if client is None:
+            print(f"常駐プロセスは起動していません: {socket_path}")
+            return EXIT_USAGE if args.stop else None
+        if args.stop:
+            client.request({"command": "stop"})
+            print(f"✅ 常駐プロセス（pid {client.info['pid']}）を終了しました")
+        else:
+            print(f"🔌 {socket_path}（pid {client.info['pid']}）")
+            print(f"パッケージ数: {client.info['packages']}（索引の更新: {client.info['generation']}回）")
+            for path in client.info['paths']:
+                print(f"- {path}")
+        client.close()
+        return None
     
-    # 既存のrequirements_license.txtファイルがあれば読み込み、許可リストを更新
-    if os.path.exists(REQUIREMENTS_LICENSE_PATH):
-        with open(REQUIREMENTS_LICENSE_PATH, 'r') as f:
-            lines = f.readlines()
-            
+    server = LicenseServer(socket_path, max(0.1, args.interval))
+    try:
+        server.serve_forever()
+    except (OSError, RuntimeError) as e:
+        print(f"❌ 常駐プロセスを起動できません: {e}")
+        return EXIT_USAGE
+    return None
+
+def _network_pip_options(args):
+    """--proxy / --cert / --client-cert を pip に渡す引数のリストにします"""
+    pip_options = []
+    for name in _PIP_NETWORK_OPTIONS:
+        value = getattr(args, name.replace('-', '_'), None)
+        if value:
+            pip_options += [f'--{name}', value]
+    return pip_options
+
+def _lookup_for_args(args):
+    """コマンドライン引数に応じたメタデータ取得元を返します（指定がなければインストール済みの情報）"""
+    # 常駐プロセスが起動していればインストール済みの情報はその索引から取得する
+    lookup = get_daemon_client()
+    if getattr(args, 'index_url', None):
+        lookup = RemoteIndexSource(args.index_url, fallback=lookup, pip_options=_network_pip_options(args))
+    if getattr(args, 'find_links', None):
+        index = get_wheel_index(args.find_links)
+        print(f"📦 wheelhouse から {len(index)} 個の wheel を読み込みました")
+        lookup = WheelhouseSource(index, fallback=lookup)
+    return lookup
+
+@profiled("scan", "phase")
+def scan_installed_packages(inventory=None, input_path=None):
+    """インストール済みのパッケージをスキャンしてrequirements_license.txtに追加します
+
+    inventory を渡さない場合はファイルを読み込まず、1行ずつ読みながら書き換えます。
+    input_path を指定した場合は環境を列挙する代わりに、export で書き出した JSONL / CSV を読み込みます。
+    """
+    if input_path:
+        print(f"{input_path} のパッケージをスキャンしています...")
+    else:
+        print("インストール済みのパッケージをスキャンしています...")
+    
+    # 既存のrequirements_license.txtファイルがあれば読み込み、許可リストを更新
+    # （対話モード以外では、allow で --add-allowed を指定した場合のみ）
+    policy = get_license_policy()
+    exists = inventory.exists if inventory is not None else os.path.exists(REQUIREMENTS_LICENSE_PATH)
+    if exists and (policy.interactive or policy.auto_add):
         allowed_licenses = load_allowed_licenses()
+        matcher = LicenseMatcher(allowed_licenses, load_license_rules())
         modified = False
         
-        for line in lines:
-            if not line.startswith('#') and '[' in line and ']' in line:
-                try:
-                    # ライセンス情報を抽出
-                    license_start = line.find('[') + 1
-                    license_end = line.find(']', license_start)
-                    license_info = line[license_start:license_end].strip()
-                    
-                    # 許可リストに存在しない場合は追加（正規化して比較）
-                    normalized_license = normalize_license_name(license_info)
-                    exists = False
-                    
-                    for allowed in allowed_licenses:
-                        if normalize_license_name(allowed) == normalized_license:
-                            exists = True
-                            break
-                    
-                    if license_info and license_info != "Unknown" and not exists:
-                        allowed_licenses.append(license_info)
-                        modified = True
-                except:
-                    pass
+        for record in (inventory if inventory is not None else iter_license_records()):
+            license_info = record.license.strip()
+            # 許可リストに存在しない場合は追加（正規化して比較、ルールで拒否されているものは追加しない）
+            if license_info and license_info != "Unknown" and \
+                    not matcher.is_allowed(license_info, record.name, record.version) and \
+                    not matcher.is_denied(license_info, record.name, record.version):
+                matcher.add(license_info)
+                modified = True
         
         # 許可リストが更新された場合は保存
         if modified:
-            save_allowed_licenses(allowed_licenses)
+            save_allowed_licenses(matcher.allowed_licenses)
             print("✅ 既存のrequirements_license.txtからライセンス情報を更新しました")
     
-    # pipでインストール済みのパッケージ一覧を取得
-    cmd = [sys.executable, "-m", "pip", "list", "--format=json"]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    stdout, stderr = process.communicate()
-    
     try:
-        installed_packages = json.loads(stdout.decode('utf-8'))
+        # 環境を一度だけ列挙して、名前・バージョン・ライセンス・依存関係の表を作る
+        packages = packages_from_export(input_path) if input_path else collect_installed_packages()
         
-        # 自動的に許可リストに追加するかどうかを確認
-        auto_add = input("許可リストにないライセンスを自動的に追加しますか？ (y/n): ").lower() == 'y'
+        # 自動的に許可リストに追加するかどうかを確認（対話モード以外ではポリシーに従う）
+        auto_add = policy.confirm_add("許可リストにないライセンスを自動的に追加しますか？ (y/n): ")
         
-        # 各パッケージの情報を取得して記録
-        for package_info in installed_packages:
-            package_name = package_info["name"]
-            if package_name != "pip-license-checker":  # 自分自身は除外
-                version, license_info, requires = get_package_info(package_name)
-                
-                # ライセンスをチェック
-                allowed_licenses = load_allowed_licenses()
-                if license_info not in allowed_licenses:
+        # 許可リストに対して全パッケージを一括で分類する
+        matcher = LicenseMatcher(load_allowed_licenses(), load_license_rules())
+        new_licenses = []
+        for package_name, (version, license_info, requires) in packages.items():
+            if not matcher.is_allowed(license_info, package_name, version):
+                policy.record(package_name, version, license_info)
+                if policy.interactive:
                     print(f"⚠️ 警告: {package_name} のライセンス ({license_info}) は許可リストにありません")
-                    if auto_add:
-                        allowed_licenses.append(license_info)
-                        save_allowed_licenses(allowed_licenses)
+                # Unknown とルールで拒否されているものは許可リストに追加しない
+                if auto_add and license_info and license_info != "Unknown" and \
+                        not matcher.is_denied(license_info, package_name, version):
+                    matcher.add(license_info)
+                    new_licenses.append(license_info)
+                    if policy.interactive:
                         print(f"ライセンス '{license_info}' を許可リストに追加しました")
-                
-                # requirements_license.txtに追加
-                update_requirements_license(package_name, version, license_info, requires, True)
-                print(f"📝 {package_name} をrequirements_license.txtに追加しました")
         
-        print(f"✅ 合計 {len(installed_packages)-1} 個のパッケージをスキャンしました")
+        # 拒否する方針では許可リストにないライセンスがあればコマンドを失敗させる
+        if policy.mode == "deny" and policy.violations:
+            policy.denied = True
+        
+        # 追加されたライセンスはまとめて一度だけ保存する
+        if new_licenses:
+            save_allowed_licenses(matcher.allowed_licenses)
+        
+        # requirements_license.txtを一度だけ書き込む
+        write_scanned_packages(packages, matcher, inventory)
+        
+        print(f"✅ 合計 {len(packages)} 個のパッケージをスキャンしました")
     
     except Exception as e:
         print(f"エラー: {e}")
 
-def update_license_status():
-    """requirements_license.txtのすべてのパッケージのライセンスステータスを再チェックして更新します"""
-    if not os.path.exists(REQUIREMENTS_LICENSE_PATH):
-        print("❌ requirements_license.txtが見つかりません")
+@profiled("scan.collect", "metadata")
+def collect_installed_packages(paths=None):
+    """インストール済みのパッケージを一度だけ列挙し、名前→(version, license, requires)の表を作ります"""
+    import json
+    import subprocess
+    packages = {}
+    
+    if METADATA_BACKEND == "subprocess" and paths is None:
+        # pip list と pip show を使う従来の取得方法
+        cmd = [sys.executable, "-m", "pip", "list", "--format=json"]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, stderr = process.communicate()
+        for package_info in json.loads(stdout.decode('utf-8')):
+            package_name = package_info["name"]
+            if package_name != "pip-license-checker":  # 自分自身は除外
+                packages[package_name] = get_package_info(package_name)
+        return packages
+    
+    import importlib.metadata as metadata
+    seen = set()
+    for dist in metadata.distributions(**({"path": list(paths)} if paths is not None else {})):
+        name, info = _load_distribution(dist)
+        if not name:
+            continue
+        key = _canonical_name(name)
+        # sys.path の先にあるものが優先されるため、同名の2つ目以降は無視する
+        if key in seen or key == "pip-license-checker":  # 自分自身は除外
+            continue
+        seen.add(key)
+        packages[name] = info
+    return packages
+
+@profiled("scan.classify", "phase")
+def write_scanned_packages(packages, matcher, inventory=None):
+    """スキャン結果をrequirements_license.txtに一括で反映します
+
+    inventory がない場合はファイルを1回の走査で書き換え、記録のないパッケージは末尾に追加します。
+    """
+    # 他のパッケージから依存されているものは依存パッケージとして扱う
+    required = set()
+    for _, _, requires in packages.values():
+        required.update(_canonical_name(req) for req in requires)
+    
+    entries = {}
+    for package_name, (version, license_info, requires) in packages.items():
+        is_direct = _canonical_name(package_name) not in required
+        status = "✅" if matcher.is_allowed(license_info, package_name, version) else "❓"
+        entries[_canonical_name(package_name)] = (package_name, version, license_info, status, is_direct)
+    
+    if inventory is not None:
+        for entry in entries.values():
+            inventory.upsert(*entry)
         return
     
-    with open(REQUIREMENTS_LICENSE_PATH, 'r') as f:
-        lines = f.readlines()
+    def update(record):
+        entry = entries.pop(_canonical_name(record.name), None)
+        if entry is None:
+            return False
+        name, version, license_info, status, is_direct = entry
+        # 直接インストールとして記録済みのものは直接インストールのまま残る
+        install_type = INSTALL_TYPE_DIRECT if is_direct or record.is_direct else INSTALL_TYPE_DEPENDENCY
+        return record.assign(status, name, version, license_info, install_type)
     
-    modified = False
-    allowed_licenses = load_allowed_licenses()
-    updated_lines = []
-    wrong_status_count = 0
+    def append():
+        for name, version, license_info, status, is_direct in entries.values():
+            yield LicenseRecord(status, name, version, license_info,
+                                INSTALL_TYPE_DIRECT if is_direct else INSTALL_TYPE_DEPENDENCY)
     
-    for line in lines:
-        if line.startswith('#') or not ('[' in line and ']' in line):
-            updated_lines.append(line)
+    rewrite_requirements_license(REQUIREMENTS_LICENSE_PATH, update, append)
+
+# 仮想環境やコンテナイメージのルートから site-packages を探すパターン
+_SITE_PACKAGES_PATTERNS = (
+    "lib/python3*/site-packages",
+    "lib64/python3*/site-packages",
+    "Lib/site-packages",
+    "lib/python3/dist-packages",
+    "usr/lib/python3*/site-packages",
+    "usr/lib/python3/dist-packages",
+    "usr/local/lib/python3*/site-packages",
+    "usr/local/lib/python3*/dist-packages",
+)
+
+def find_site_packages(env_path):
+    """仮想環境・インストールプレフィックス・インタープリター・コンテナのルートから site-packages を探します"""
+    import glob
+    prefix = env_path
+    if os.path.isfile(env_path):
+        # bin/python のようなインタープリターが指定された場合はそのプレフィックスを使う
+        prefix = os.path.dirname(os.path.dirname(os.path.abspath(env_path)))
+    found = []
+    for pattern in _SITE_PACKAGES_PATTERNS:
+        for directory in sorted(glob.glob(os.path.join(prefix, pattern))):
+            if os.path.isdir(directory) and directory not in found:
+                found.append(directory)
+    return found
+
+# site-packages のパスから Python のバージョンを取り出す（lib/python3.11/site-packages など）
+_SITE_PACKAGES_VERSION_RE = _LazyPattern(r"[/\\]lib(?:64)?[/\\]python(\d+)\.(\d+)t?[/\\](?:site|dist)-packages$")
+# pyvenv.cfg の version / version_info（venv・virtualenv・uv）
+_PYVENV_VERSION_RE = _LazyPattern(r"^\s*version(?:_info)?\s*=\s*(\d+)\.(\d+)(?:\.(\d+))?", re.MULTILINE)
+
+# 指定されたインタープリターで packaging.markers.default_environment() と同じ値を求めるスクリプト
+# （対象の環境に packaging があるとは限らないため標準ライブラリだけを使う）
+_MARKER_ENVIRONMENT_SCRIPT = """\
+import json, os, platform, sys
+info = sys.implementation.version
+version = "%d.%d.%d" % (info.major, info.minor, info.micro)
+if info.releaselevel != "final":
+    version += info.releaselevel[0] + str(info.serial)
+print(json.dumps({
+    "implementation_name": sys.implementation.name, "implementation_version": version,
+    "os_name": os.name, "platform_machine": platform.machine(), "platform_release": platform.release(),
+    "platform_system": platform.system(), "platform_version": platform.version(),
+    "python_full_version": platform.python_version(),
+    "platform_python_implementation": platform.python_implementation(),
+    "python_version": ".".join(platform.python_version_tuple()[:2]), "sys_platform": sys.platform}))
+"""
+
+def _interpreter_marker_environment(interpreter):
+    """インタープリターを一度だけ実行して環境マーカーの値を取得します（失敗した場合は None）"""
+    import json
+    import subprocess
+    with profile_span("scan.marker_environment", "metadata", interpreter=interpreter):
+        try:
+            process = subprocess.run([interpreter, "-I", "-c", _MARKER_ENVIRONMENT_SCRIPT],
+                                     stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=30)
+            if process.returncode == 0:
+                return json.loads(process.stdout)
+        except (OSError, ValueError, subprocess.SubprocessError):
+            pass
+    print(f"⚠️ {interpreter} から環境マーカーの値を取得できませんでした（site-packages のパスから推定します）")
+    return None
+
+def _inferred_marker_environment(directories):
+    """pyvenv.cfg と site-packages のパスから Python のバージョンとプラットフォームを推定します"""
+    import sysconfig
+    values = {}
+    for directory in directories:
+        directory = os.path.abspath(directory)
+        match = _SITE_PACKAGES_VERSION_RE.search(directory)
+        if match:
+            prefix = directory[:match.start()]
+            values["python_version"] = f"{match.group(1)}.{match.group(2)}"
+        elif os.path.basename(os.path.dirname(directory)) == "Lib":
+            # Windows の venv・インストール先（Lib/site-packages）
+            prefix = os.path.dirname(os.path.dirname(directory))
+            values.update(os_name="nt", sys_platform="win32", platform_system="Windows")
+        else:
+            continue
+        try:
+            with open(os.path.join(prefix, "pyvenv.cfg"), encoding="utf-8") as f:
+                match = _PYVENV_VERSION_RE.search(f.read())
+        except (OSError, UnicodeDecodeError):
+            match = None
+        if match:
+            values["python_version"] = f"{match.group(1)}.{match.group(2)}"
+            if match.group(3) is not None:
+                values["python_full_version"] = f"{match.group(1)}.{match.group(2)}.{match.group(3)}"
+        break
+    
+    if "python_version" in values and "python_full_version" not in values:
+        if values["python_version"] == sysconfig.get_python_version():
+            return values
+        # マイナーバージョンまでしか分からない場合は .0 とみなす
+        values["python_full_version"] = values["python_version"] + ".0"
+    if "python_full_version" in values and sys.implementation.name == "cpython":
+        values["implementation_version"] = values["python_full_version"]
+    return values
+
+def marker_environment_for(env_path, directories):
+    """スキャンする環境の依存関係を評価するための環境マーカーの値を求めます
+
+    インタープリターが指定された場合はそれを一度だけ実行して取得します。それ以外（仮想環境・
+    インストール先・コンテナのルート・site-packages）は実行せずに、pyvenv.cfg と site-packages の
+    パスから Python のバージョンとプラットフォームを推定し、推定できない値は現在の環境の値を使います。
+    _requires_from_metadata にそのまま渡せる (名前, 値) のタプルを返します。
+    """
+    values = None
+    if os.path.isfile(env_path) and os.access(env_path, os.X_OK):
+        values = _interpreter_marker_environment(env_path)
+    if values is None:
+        values = _inferred_marker_environment(directories)
+    return tuple(sorted(values.items()))
+
+def _list_distributions(directories):
+    """site-packages にある dist-info / egg-info を (正規化名, バージョン, パス) で列挙します"""
+    entries = []
+    for directory in directories:
+        try:
+            names = sorted(os.listdir(directory))
+        except OSError as e:
+            print(f"⚠️ {directory} を読み込めません: {e}")
+            continue
+        for name in names:
+            match = _DIST_INFO_DIR_RE.match(name)
+            path = os.path.join(directory, name)
+            if match and os.path.isdir(path):
+                entries.append((_canonical_name(match.group('name')), match.group('version') or '', path))
+    return entries
+
+def _parse_distribution_paths(paths):
+    """プロセスプールのワーカー: dist-info のパスごとに (path, name, version, license, requires, source) を返します"""
+    import importlib.metadata as metadata
+    import pathlib
+    results = []
+    for path in paths:
+        dist = metadata.PathDistribution(pathlib.Path(path))
+        results.append((path,) + _parse_distribution(dist))
+    return results
+
+def resolve_distribution_paths(paths, max_workers=None):
+    """dist-info のパスをまとめて解決し、パス→(name, version, license, requires_dist) を返します
+
+    永続キャッシュにあるものはそのまま使い、残りはプロセスプールで並行して解析します。
+    件数が少ない場合はプロセスを起動せずにこのプロセスで解析します。
+    requires_dist は環境マーカーを評価する前の Requires-Dist の値のリストで、
+    環境ごとに _requires_from_metadata で評価します。
+    """
+    import importlib.metadata as metadata
+    import pathlib
+    cache = get_metadata_cache()
+    resolved = {}
+    pending = []
+    identities = {}
+    shared_keys = {}
+    for path in paths:
+        dist = metadata.PathDistribution(pathlib.Path(path))
+        identity = cache.identify(dist) if cache is not None else None
+        entry = cache.get(identity) if identity is not None else None
+        if entry is None:
+            shared_keys[path], _, entry = _shared_metadata_lookup(dist)
+            if entry is not None and identity is not None:
+                cache.put(identity, entry["name"], entry["version"], entry["license"], entry["requires_dist"],
+                          entry["source"])
+        if entry is not None:
+            resolved[path] = (entry["name"], entry["version"], entry["license"], list(entry["requires_dist"]))
+        else:
+            identities[path] = identity
+            pending.append(path)
+    
+    if max_workers is None:
+        # コンテナなどで使える CPU が制限されている場合はその数に合わせる
+        max_workers = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    workers = max(1, max_workers or 1)
+    if len(pending) < 200 or workers == 1:
+        results = _parse_distribution_paths(pending)
+    else:
+        from concurrent.futures import ProcessPoolExecutor
+        # ワーカーごとの起動コストを抑えつつ偏りが出ないよう、ワーカー数の4倍程度に分ける
+        chunk_size = max(50, -(-len(pending) // (workers * 4)))
+        chunks = [pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size)]
+        with profile_span("scan.process_pool", "metadata", workers=workers, chunks=len(chunks)):
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                results = [result for chunk in executor.map(_parse_distribution_paths, chunks) for result in chunk]
+    
+    for path, name, version, license_info, requires_dist, source in results:
+        resolved[path] = (name, version, license_info, requires_dist)
+        identity = identities.get(path)
+        if identity is not None and name and source is not None:
+            cache.put(identity, name, version, license_info, requires_dist, source)
+        _shared_metadata_store(shared_keys.get(path), name, version, license_info, requires_dist, source)
+    return resolved
+
+@profiled("scan.environments", "phase")
+def scan_environments(environments, max_workers=None, report_path=None):
+    """複数の環境をまとめてスキャンし、環境ごとの結果と全環境のライセンス一覧を報告します
+
+    environments は (表示名, site-packages のリスト) のリストです。
+    同じ (名前, バージョン) のパッケージは最初に見つかった dist-info だけを一度解決し、
+    環境マーカーを評価する前の Requires-Dist をすべての環境で共有します。依存関係は
+    現在のインタープリターではなく、環境ごとに marker_environment_for で求めた値で評価し、
+    許可リストにないパッケージが直接のものか依存パッケージかの判断に使います。
+    requirements_license.txt は変更しません。
+    """
+    import json
+    listings = []
+    unique = {}
+    total = 0
+    for label, directories in environments:
+        environment = marker_environment_for(label, directories)
+        entries = _list_distributions(directories)
+        total += len(entries)
+        listings.append((label, directories, environment, entries))
+        for name, version, path in entries:
+            unique.setdefault((name, version), path)
+    
+    print(f"🔍 {len(environments)}個の環境で {total} 個の dist-info を見つけました"
+          f"（重複を除いて {len(unique)} 個を解決します）")
+    resolved = resolve_distribution_paths(list(unique.values()), max_workers)
+    
+    policy = get_license_policy()
+    matcher = get_license_matcher()
+    inventory = {}
+    report = {"environments": [], "inventory": []}
+    for label, directories, environment, entries in listings:
+        packages = {}
+        for name, version, _ in entries:
+            # sys.path と同じく先に見つかったものを優先する
+            if name not in packages:
+                packages[name] = resolved[unique[(name, version)]]
+        # この環境で他のパッケージから依存されているもの（マーカーはこの環境の値で評価する）
+        required = {_canonical_name(requirement) for _, _, _, requires_dist in packages.values()
+                    for requirement in _requires_from_metadata(requires_dist, environment)}
+        not_allowed = []
+        for key, (name, version, license_info, _) in sorted(packages.items()):
+            allowed = matcher.is_allowed(license_info, name, version)
+            item = inventory.setdefault((key, version), {
+                "name": name, "version": version, "license": license_info, "allowed": allowed, "environments": []})
+            item["environments"].append(label)
+            if not allowed:
+                install_type = INSTALL_TYPE_DEPENDENCY if key in required else INSTALL_TYPE_DIRECT
+                not_allowed.append({"name": name, "version": version, "license": license_info,
+                                    "install_type": _EXPORT_INSTALL_TYPES[install_type]})
+                policy.record(name, version, license_info)
+        report["environments"].append({"environment": label, "site_packages": directories,
+                                       "marker_environment": dict(environment),
+                                       "packages": len(packages), "not_allowed": not_allowed})
+        status = "✅" if not not_allowed else "⚠️"
+        print(f"{status} {label}: {len(packages)}個のパッケージ（許可リストにないライセンス: {len(not_allowed)}個）")
+        if policy.interactive:
+            for item in not_allowed:
+                print(f"  - {item['name']} ({item['version']}): {item['license']}")
+    
+    report["inventory"] = [inventory[key] for key in sorted(inventory)]
+    licenses = {}
+    for item in report["inventory"]:
+        licenses.setdefault(item["license"], 0)
+        licenses[item["license"]] += 1
+    print(f"\n📋 全環境のライセンス一覧（{len(report['inventory'])}個の名前・バージョン）:")
+    for license_info, count in sorted(licenses.items(), key=lambda item: (-item[1], item[0])):
+        status = "✅" if matcher.is_allowed(license_info) else "❓"
+        print(f"  {status} {license_info}: {count}")
+    
+    if policy.mode == "deny" and policy.violations:
+        policy.denied = True
+    if report_path:
+        _write_text_atomic(report_path, json.dumps(report, indent=2, ensure_ascii=False) + "\n")
+        print(f"📝 環境ごとの結果とライセンス一覧を書き出しました: {report_path}")
+    return report
+
+# pip license export の出力形式と、JSONL / CSV の1レコードの項目
+EXPORT_FORMATS = ("jsonl", "csv", "cyclonedx")
+EXPORT_FIELDS = ("name", "version", "license", "license_source", "status", "install_type", "requires")
+# export でインストールタイプを引くときに一度に扱うパッケージ数（requirements_license.txt はバッチごとに1回読む）
+EXPORT_BATCH_SIZE = 5000
+_EXPORT_INSTALL_TYPES = {INSTALL_TYPE_DIRECT: "direct", INSTALL_TYPE_DEPENDENCY: "dependency"}
+# CycloneDX の components[].properties に書き出す項目の名前空間
+_CYCLONEDX_PROPERTY_PREFIX = "pip-license-checker:"
+
+def iter_installed_distributions(paths=None):
+    """インストール済みのパッケージを1つずつ解決して (name, version, license, requires, source) を返すジェネレーターです
+
+    collect_installed_packages と違って結果を表にまとめないため、パッケージが何万あっても
+    メモリ使用量はほとんど増えません（重複の判定に使う名前の集合だけを保持します）。
+    """
+    if METADATA_BACKEND == "subprocess" and paths is None:
+        import json
+        import subprocess
+        # pip list と pip show を使う従来の取得方法（取得元は記録されない）
+        cmd = [sys.executable, "-m", "pip", "list", "--format=json"]
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        stdout, _ = process.communicate()
+        for package_info in json.loads(stdout.decode('utf-8')):
+            package_name = package_info["name"]
+            if package_name != "pip-license-checker":  # 自分自身は除外
+                yield (package_name,) + tuple(get_package_info(package_name)) + (None,)
+        return
+    
+    client = get_daemon_client() if paths is None else None
+    if client is not None:
+        # 常駐プロセスの索引には重複を除いた結果が sys.path の順に入っている
+        yield from client.iter_distributions()
+        return
+    
+    import importlib.metadata as metadata
+    seen = set()
+    for dist in metadata.distributions(**({"path": list(paths)} if paths is not None else {})):
+        name, version, license_info, requires, source = _resolve_distribution(dist)
+        key = _canonical_name(name) if name else None
+        # sys.path の先にあるものが優先されるため、同名の2つ目以降は無視する
+        if not key or key in seen or key == "pip-license-checker":  # 自分自身は除外
             continue
+        seen.add(key)
+        yield name, version, license_info, requires, source
+
+def license_export_records(distributions, matcher, install_types=None):
+    """(name, version, license, requires, source) の列を export のレコード（dict）の列に変換するジェネレーターです
+
+    install_types は正規化したパッケージ名 → requirements_license.txt のインストールタイプの対応で、
+    インストールタイプは記録されているパッケージについてだけ埋めます。
+    """
+    for name, version, license_info, requires, source in distributions:
+        install_type = install_types.get(_canonical_name(name)) if install_types else None
+        yield {
+            "name": name,
+            "version": version,
+            "license": license_info,
+            "license_source": source,
+            "status": "allowed" if matcher.is_allowed(license_info, name, version) else "unverified",
+            "install_type": _EXPORT_INSTALL_TYPES.get(install_type) if install_type is not None else None,
+            "requires": list(requires),
+        }
+
+def read_license_export(path):
+    """export で書き出した JSONL / CSV を1レコードずつ読み込むジェネレーターです
+
+    requirements_license.txt の行を解析する代わりに、ツールやほかのコマンドの入力として使えます。
+    """
+    import json
+    with open(path, newline='') as f:
+        first = f.readline()
+        if first.startswith('{'):
+            try:
+                yield json.loads(first)
+            except ValueError:
+                raise ValueError(f"{path}: JSONL ではありません（CycloneDX は読み込めません）") from None
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+            return
         
+        import csv
+        header = next(csv.reader([first]), None)
+        if not header or "name" not in header:
+            raise ValueError(f"{path}: export で書き出した JSONL / CSV ではありません")
+        for row in csv.reader(f):
+            record = {field: value or None for field, value in zip(header, row)}
+            record["requires"] = (record.get("requires") or "").split()
+            yield record
+
+def packages_from_export(path):
+    """export で書き出した JSONL / CSV から、collect_installed_packages と同じ名前→(version, license, requires)の表を作ります"""
+    packages = {}
+    for record in read_license_export(path):
+        name = record.get("name")
+        if name and name not in packages:
+            packages[name] = (record.get("version") or "Unknown", record.get("license") or "Unknown",
+                              list(record.get("requires") or ()))
+    return packages
+
+def _write_export_jsonl(records, out):
+    import json
+    count = 0
+    for record in records:
+        out.write(json.dumps(record, ensure_ascii=False) + "\n")
+        count += 1
+    return count
+
+def _write_export_csv(records, out):
+    import csv
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(EXPORT_FIELDS)
+    count = 0
+    for record in records:
+        row = dict(record, requires=" ".join(record.get("requires") or ()))
+        writer.writerow(["" if row.get(field) is None else row[field] for field in EXPORT_FIELDS])
+        count += 1
+    return count
+
+def _cyclonedx_component(record):
+    """レコードを CycloneDX 1.5 の component に変換します"""
+    name = record["name"]
+    version = record.get("version") or ""
+    purl = f"pkg:pypi/{_canonical_name(name)}" + (f"@{version}" if version and version != "Unknown" else "")
+    component = {"type": "library", "bom-ref": purl, "name": name, "version": version, "purl": purl}
+    license_info = record.get("license") or "Unknown"
+    if license_info != "Unknown":
+        # SPDX ライセンス式として書かれているもの以外は名前として出力する
+        if record.get("license_source") in ("License-Expression", "License-File"):
+            component["licenses"] = [{"expression": license_info}]
+        else:
+            component["licenses"] = [{"license": {"name": license_info}}]
+    component["properties"] = [{"name": _CYCLONEDX_PROPERTY_PREFIX + field, "value": str(record[field])}
+                               for field in ("status", "install_type", "license_source") if record.get(field)]
+    return component
+
+def _write_export_cyclonedx(records, out):
+    import json
+    import time
+    import uuid
+    header = {
+        "bomFormat": "CycloneDX",
+        "specVersion": "1.5",
+        "serialNumber": f"urn:uuid:{uuid.uuid4()}",
+        "version": 1,
+        "metadata": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+            "tools": {"components": [{"type": "application", "name": "pip-license-checker"}]},
+        },
+    }
+    # BOM 全体をメモリ上に組み立てず、components の配列を1要素ずつ書き出す
+    out.write(json.dumps(header, ensure_ascii=False)[:-1] + ', "components": [\n')
+    count = 0
+    for record in records:
+        out.write((",\n" if count else "") + json.dumps(_cyclonedx_component(record), ensure_ascii=False))
+        count += 1
+    out.write("\n]}\n")
+    return count
+
+def _export_batches(distributions, batch_size):
+    """ディストリビューションの列を batch_size 件ずつのリストに区切るジェネレーターです"""
+    batch = []
+    for distribution in distributions:
+        batch.append(distribution)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _install_types_for(batch):
+    """batch のパッケージについてだけ、requirements_license.txt のインストールタイプを引きます
+
+    requirements_license.txt はモデルに読み込まず1行ずつ読むため、保持するのは
+    batch の件数分の対応だけです（ファイルはバッチごとに1回読みます）。
+    """
+    names = {_canonical_name(distribution[0]) for distribution in batch}
+    install_types = {}
+    for record in iter_license_records():
+        key = _canonical_name(record.name)
+        # 同じパッケージが複数回記録されている場合は RequirementsLicenseFile.get と同じく最初の行を使う
+        if key in names and key not in install_types:
+            install_types[key] = record.install_type
+            if len(install_types) == len(names):
+                break
+    return install_types
+
+_EXPORT_WRITERS = {"jsonl": _write_export_jsonl, "csv": _write_export_csv, "cyclonedx": _write_export_cyclonedx}
+
+@profiled("export", "phase")
+def export_licenses(output_format, out, paths=None, input_path=None):
+    """ライセンス情報を1パッケージずつ out に書き出し、書き出した件数を返します
+
+    input_path を指定した場合はインストール済みのパッケージの代わりに、以前に export した
+    JSONL / CSV を読み込みます（ステータスは現在の許可リストで判定し直します）。
+    """
+    matcher = LicenseMatcher(load_allowed_licenses(), load_license_rules())
+    if input_path:
+        records = (dict(record, status="allowed" if matcher.is_allowed(record.get("license") or "Unknown",
+                                                                       record.get("name"), record.get("version"))
+                        else "unverified")
+                   for record in read_license_export(input_path))
+    else:
+        records = (record for batch in _export_batches(iter_installed_distributions(paths), EXPORT_BATCH_SIZE)
+                   for record in license_export_records(batch, matcher, _install_types_for(batch)))
+    return _EXPORT_WRITERS[output_format](records, out)
+
+class MetadataCache:
+    """ディストリビューションごとのライセンス解決結果を保存する永続キャッシュです
+
+    キーはディストリビューション名・バージョン・dist-info のパスで、
+    dist-info ディレクトリと METADATA の mtime/サイズが変わったエントリーは
+    自動的に無効になります。エントリー数が上限を超えた場合は最後に
+    使われた時刻が古いものから削除します。書き込みはロックを取って行い、
+    読み込んだ後に別のプロセスが保存したエントリーは取り込んでから保存します。
+    """
+
+    # 2: License-Expression を読み込むようになったため、それ以前のエントリーは使わない
+    # 3: ライセンスファイルの本文から推定するようになったため、Unknown だったエントリーも解決し直す
+    # 4: 環境マーカーを評価する前の Requires-Dist を保存し、読み込む側の環境で評価するようにした
+    VERSION = 4
+
+    def __init__(self, path, max_entries=DEFAULT_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._stamp = None
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is None:
+            self._entries, self._stamp = self._read()
+        return self._entries
+
+    def _read(self):
+        """保存されているエントリーとファイルの更新スタンプを返します"""
+        import json
+        entries = {}
+        stamp = _file_stamp(self.path)
         try:
-            # 現在のステータスを取得
-            current_status = "✅" if line.startswith("✅") else "❓"
-            
-            # パッケージ名とライセンス情報を抽出
-            parts = line.strip().split(' ', 1)
-            if len(parts) < 2:
-                updated_lines.append(line)
-                continue
-            
-            rest = parts[1]
-            package_info = rest.split(' [', 1)
-            if len(package_info) < 2:
-                updated_lines.append(line)
-                continue
-            
-            license_part = '[' + package_info[1]
-            license_end = license_part.find(']')
-            if license_end == -1:
-                updated_lines.append(line)
-                continue
-            
-            license_info = license_part[1:license_end]
-            
-            # ライセンスが許可リストに含まれているか正規化して確認
-            normalized_license = normalize_license_name(license_info)
-            is_allowed = False
-            
-            for allowed in allowed_licenses:
-                if normalize_license_name(allowed) == normalized_license:
-                    is_allowed = True
+            with profile_span("metadata_cache.load", "io", path=self.path), open(self.path, 'r') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                entries = data.get("entries", {})
+        except (OSError, ValueError, AttributeError):
+            pass
+        return entries, stamp
+
+    def identify(self, dist):
+        """Distributionのキャッシュキーと更新スタンプを返します（判定できない場合はNone）"""
+        dist_path = getattr(dist, '_path', None)
+        if dist_path is None:
+            return None
+        dist_path = os.path.abspath(str(dist_path))
+        try:
+            dir_stat = os.stat(dist_path)
+            for filename in ('METADATA', 'PKG-INFO'):
+                try:
+                    meta_stat = os.stat(os.path.join(dist_path, filename))
                     break
-            
-            correct_status = "✅" if is_allowed else "❓"
-            
-            # ステータスが間違っている場合は修正
-            if current_status != correct_status:
-                new_line = line.replace(current_status, correct_status, 1)
-                updated_lines.append(new_line)
-                wrong_status_count += 1
-                modified = True
-                print(f"🔄 {package_info[0]}のステータスを{current_status}から{correct_status}に更新しました")
-            else:
-                updated_lines.append(line)
+                except OSError:
+                    meta_stat = None
+        except OSError:
+            return None
+        if meta_stat is None:
+            return None
         
-        except Exception as e:
-            # 解析エラーが発生した場合は元の行をそのまま保持
-            updated_lines.append(line)
+        # dist-info / egg-info のディレクトリ名から名前とバージョンを取り出す
+        match = _DIST_INFO_DIR_RE.match(os.path.basename(dist_path))
+        if match:
+            name_version = f"{_canonical_name(match.group('name'))}=={match.group('version') or ''}"
+        else:
+            name_version = os.path.basename(dist_path)
+        key = f"{name_version}@{dist_path}"
+        stamp = f"{dir_stat.st_mtime_ns}:{meta_stat.st_mtime_ns}:{meta_stat.st_size}"
+        return key, stamp
+
+    def get(self, identity):
+        """有効なキャッシュエントリーを返します（ないか古い場合はNone）"""
+        import time
+        key, stamp = identity
+        entry = self._load().get(key)
+        if entry is None or entry.get("stamp") != stamp:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry["used"] = time.time()
+        self._dirty = True
+        return entry
+
+    def put(self, identity, name, version, license_info, requires_dist, source):
+        """解決結果をキャッシュに登録します（requires_dist は環境マーカーを評価する前の Requires-Dist）"""
+        import time
+        key, stamp = identity
+        self._load()[key] = {
+            "stamp": stamp,
+            "name": name,
+            "version": version,
+            "license": license_info,
+            "requires_dist": list(requires_dist),
+            "source": source,
+            "used": time.time(),
+        }
+        self._dirty = True
+
+    @profiled("metadata_cache.flush", "io")
+    def flush(self):
+        """変更があればサイズ上限を適用してキャッシュファイルに書き込みます"""
+        import json
+        if not self._dirty or self._entries is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with _FileLock(_lock_path(self.path)):
+                if _file_stamp(self.path) != self._stamp:
+                    self._merge_saved()
+                entries = self._entries
+                if len(entries) > self.max_entries:
+                    # 最後に使われた時刻が古いものから削除する
+                    keep = sorted(entries, key=lambda k: entries[k].get("used", 0), reverse=True)[:self.max_entries]
+                    self._entries = entries = {key: entries[key] for key in keep}
+                _write_text_atomic(self.path, json.dumps({"version": self.VERSION, "entries": entries},
+                                                         separators=(',', ':')))
+                self._stamp = _file_stamp(self.path)
+            self._dirty = False
+        except OSError as e:
+            print(f"⚠️ メタデータキャッシュの保存に失敗しました: {e}")
+
+    def _merge_saved(self):
+        """別のプロセスが保存したエントリーを取り込みます（同じキーは最後に使われた方を残す）"""
+        saved, _ = self._read()
+        for key, entry in saved.items():
+            mine = self._entries.get(key)
+            if mine is None or entry.get("used", 0) > mine.get("used", 0):
+                self._entries[key] = entry
+
+    def clear(self):
+        """キャッシュをすべて削除します"""
+        self._entries = {}
+        self._dirty = False
+        with _FileLock(_lock_path(self.path)):
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self._stamp = None
+
+    def stats(self):
+        """キャッシュの統計情報を返します"""
+        entries = self._load()
+        sources = {}
+        for entry in entries.values():
+            source = entry.get("source") or "Unknown"
+            sources[source] = sources.get(source, 0) + 1
+        return {
+            "path": self.path,
+            "entries": len(entries),
+            "max_entries": self.max_entries,
+            "size_bytes": os.path.getsize(self.path) if os.path.exists(self.path) else 0,
+            "sources": sources,
+        }
+
+_METADATA_CACHE = None
+
+def get_metadata_cache():
+    """プロセス内で共有するメタデータキャッシュを返します（無効化されている場合はNone）"""
+    global _METADATA_CACHE
+    if not METADATA_CACHE_ENABLED:
+        return None
+    if _METADATA_CACHE is None:
+        _METADATA_CACHE = MetadataCache(os.path.join(CACHE_DIR, "metadata-cache.json"),
+                                        DEFAULT_CACHE_MAX_ENTRIES)
+    return _METADATA_CACHE
+
+def flush_metadata_cache():
+    """メタデータキャッシュの変更をディスクに書き込み、共有キャッシュに追加した場合はサイズ上限を適用します"""
+    if _METADATA_CACHE is not None:
+        _METADATA_CACHE.flush()
+    if _SHARED_LICENSE_CACHE is not None and _SHARED_LICENSE_CACHE.written:
+        _SHARED_LICENSE_CACHE.prune()
+
+class SharedLicenseCache:
+    """メタデータの内容をキーにした、プロジェクトや環境をまたいで共有するライセンス解決結果のキャッシュです
+
+    MetadataCache は dist-info のパスをキーにするため、チェックアウトや仮想環境が
+    変わると同じパッケージでも解決し直しになります。こちらは METADATA の内容
+    （インデックスから取得する場合は wheel の sha256）のハッシュをキーにし、
+    1エントリーを1ファイル（<キーの先頭2文字>/<キー>.json）として保存します。
+    書き込みは一時ファイルからのリネームで行うため、読み込みはロックなしで行えます。
+    多数の CI ジョブが同時に書き込んでも、同じキーには同じ内容が入るだけです。
+    Python のバージョンなどが違う環境でも共有できるよう、依存は環境マーカーを評価する前の
+    Requires-Dist（requires_dist）として保存します。
+    エントリーファイルの mtime を最後に使われた時刻とし、エントリー数が上限を超えた場合は
+    prune() で古いものから削除します。
+    """
+
+    # 2: requires（評価済みの依存）の代わりに requires_dist を保存する
+    VERSION = 2
+
+    def __init__(self, root, max_entries=DEFAULT_SHARED_CACHE_MAX_ENTRIES):
+        self.root = root
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.written = 0
+
+    @staticmethod
+    def key(kind, content):
+        """kind（"metadata" / "wheel"）と内容からキーを作ります"""
+        import hashlib
+        digest = hashlib.sha256(f"{kind}:{MetadataCache.VERSION}:{SharedLicenseCache.VERSION}:".encode('utf-8'))
+        digest.update(content.encode('utf-8', 'surrogateescape') if isinstance(content, str) else content)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.root, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """エントリーを返します（ない場合はNone）"""
+        import json
+        path = self._entry_path(key)
+        try:
+            with open(path, 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        try:
+            # 最後に使われた時刻として mtime を更新する（prune で残す順番に使う）
+            os.utime(path)
+        except OSError:
+            pass
+        return entry
+
+    def put(self, key, **entry):
+        """エントリーを保存します（clear と重ならないよう共有ロックを取る）"""
+        import json
+        path = self._entry_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with _FileLock(_lock_path(self.root), shared=True):
+                _write_text_atomic(path, json.dumps(entry, separators=(',', ':')))
+            self.written += 1
+        except OSError as e:
+            print(f"⚠️ 共有キャッシュの保存に失敗しました: {e}")
+
+    def _entry_files(self):
+        try:
+            shards = os.listdir(self.root)
+        except OSError:
+            return
+        for shard in shards:
+            try:
+                names = os.listdir(os.path.join(self.root, shard))
+            except OSError:
+                continue
+            for name in names:
+                if name.endswith('.json'):
+                    yield os.path.join(self.root, shard, name)
+
+    def clear(self):
+        """キャッシュをすべて削除します"""
+        import shutil
+        with _FileLock(_lock_path(self.root)):
+            shutil.rmtree(self.root, ignore_errors=True)
+
+    @profiled("shared_cache.prune", "io")
+    def prune(self):
+        """エントリー数が上限を超えていれば最後に使われた時刻が古いものから削除し、削除した数を返します
+
+        put と重ならないよう排他ロックを取ります。ロックなしで読んでいる途中のエントリーが
+        削除された場合、その読み込みはキャッシュにないものとして扱われます。
+        """
+        try:
+            with _FileLock(_lock_path(self.root)):
+                entries = []
+                for path in self._entry_files():
+                    try:
+                        entries.append((os.stat(path).st_mtime_ns, path))
+                    except OSError:
+                        continue
+                excess = len(entries) - self.max_entries
+                if excess <= 0:
+                    return 0
+                entries.sort()
+                for _, path in entries[:excess]:
+                    try:
+                        os.unlink(path)
+                    except OSError:
+                        pass
+        except OSError as e:
+            print(f"⚠️ 共有キャッシュの整理に失敗しました: {e}")
+            return 0
+        finally:
+            self.written = 0
+        return excess
+
+    def stats(self):
+        """キャッシュの統計情報を返します"""
+        entries = size = 0
+        for path in self._entry_files():
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                continue
+            entries += 1
+        return {"path": self.root, "entries": entries, "max_entries": self.max_entries, "size_bytes": size}
+
+_SHARED_LICENSE_CACHE = None
+
+def get_shared_license_cache():
+    """プロセス内で使う共有キャッシュを返します（キャッシュが無効化されている場合はNone）"""
+    global _SHARED_LICENSE_CACHE
+    if not METADATA_CACHE_ENABLED:
+        return None
+    if _SHARED_LICENSE_CACHE is None:
+        _SHARED_LICENSE_CACHE = SharedLicenseCache(os.path.join(CACHE_DIR, "licenses"),
+                                                   DEFAULT_SHARED_CACHE_MAX_ENTRIES)
+    return _SHARED_LICENSE_CACHE
+
+def _canonical_name(name):
+    """パッケージ名を PEP 503 の正規化形式にします"""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+def _write_text_atomic(path, text, durable=False):
+    """一時ファイルに書き込んでからリネームすることでファイルをアトミックに置き換えます
+
+    durable=True の場合はリネーム前に fsync して内容をディスクに確定させます。
+    """
+    if _PROFILER is not None:
+        size = len(text.encode('utf-8'))
+        span = profile_span("write", "io", path=path, bytes=size)
+        profile_count("files_written")
+        profile_count("bytes_written", size)
+    else:
+        span = _NULL_SPAN
+    with span:
+        with _AtomicWriter(path, durable) as f:
+            f.write(text)
+
+def _lock_path(path):
+    """path を書き換えるときに使うロックファイルのパス（同じディレクトリの .<ファイル名>.lock）です"""
+    directory, filename = os.path.split(os.path.abspath(path))
+    return os.path.join(directory, f".{filename}.lock")
+
+class _FileLock:
+    """fcntl.flock による助言ロックです（fcntl がない環境ではロックせずに進みます）
+
+    ロックファイルは削除しません（削除すると別のファイルをロックするプロセスが出てしまうため）。
+    """
+
+    def __init__(self, path, shared=False):
+        self.path = path
+        self.shared = shared
+        self._fd = None
+
+    def __enter__(self):
+        try:
+            import fcntl
+        except ImportError:
+            return self
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        with profile_span("lock.wait", "io", path=self.path):
+            fcntl.flock(self._fd, fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._fd is not None:
+            import fcntl
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+        return False
+
+def _file_stamp(path):
+    """ファイルの (mtime_ns, サイズ) です（存在しない場合は None）"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+class _AtomicWriter:
+    """書き込み用に開いた一時ファイルを、with ブロックを正常に抜けたときに path へリネームします
+
+    少しずつ書き込む場合（export など）も、途中で失敗したときに不完全なファイルが残りません。
+    """
+
+    def __init__(self, path, durable=False):
+        self.path = path
+        self.durable = durable
+        self._file = None
+        self._temp_path = None
+
+    def __enter__(self):
+        import tempfile
+        fd, self._temp_path = tempfile.mkstemp(prefix=".tmp-", dir=os.path.dirname(os.path.abspath(self.path)))
+        self._file = os.fdopen(fd, 'w')
+        return self._file
+
+    def discard(self):
+        """書き込んだ内容を捨て、path を置き換えないようにします"""
+        self._temp_path, temp_path = None, self._temp_path
+        self._file.close()
+        os.unlink(temp_path)
+
+    def __exit__(self, exc_type, exc, tb):
+        temp_path = self._temp_path
+        if temp_path is None:
+            return False
+        try:
+            if exc_type is None and self.durable:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+            self._file.close()
+            if exc_type is None:
+                # 既存ファイルのパーミッションを引き継ぐ（新規作成時は通常のファイルと同じ権限にする）
+                if os.path.exists(self.path):
+                    os.chmod(temp_path, os.stat(self.path).st_mode & 0o777)
+                else:
+                    os.chmod(temp_path, 0o644)
+                os.replace(temp_path, self.path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        return False
+
+@profiled("update_license_status", "phase")
+def update_license_status(inventory=None):
+    """requirements_license.txtのすべてのパッケージのライセンスステータスを再チェックして更新します
+
+    inventory を渡さない場合はファイルを読み込まず、1行ずつ読みながら書き換えます。
+    """
+    matcher = get_license_matcher()
     
-    # 変更があった場合のみファイルを更新
-    if modified:
-        with open(REQUIREMENTS_LICENSE_PATH, 'w') as f:
-            f.writelines(updated_lines)
+    def fix_status(record):
+        # ライセンスが許可リストに含まれているか正規化して確認し、間違っている場合は修正
+        correct_status = "✅" if matcher.is_allowed(record.license, record.name, record.version) else "❓"
+        if record.status == correct_status:
+            return False
+        print(f"🔄 {record.name}=={record.version}のステータスを{record.status}から{correct_status}に更新しました")
+        if inventory is not None:
+            inventory.set_status(record, correct_status)
+        else:
+            record.status, record.line = correct_status, None
+        return True
+    
+    if inventory is None:
+        if not os.path.exists(REQUIREMENTS_LICENSE_PATH):
+            print("❌ requirements_license.txtが見つかりません")
+            return
+        # 変更があった場合のみファイルを置き換える
+        wrong_status_count = rewrite_requirements_license(REQUIREMENTS_LICENSE_PATH, fix_status)
+    else:
+        wrong_status_count = sum(fix_status(record) for record in inventory)
+    if wrong_status_count:
         print(f"✅ {wrong_status_count}個のパッケージのステータスを更新しました")
     else:
         print("✅ すべてのパッケージのステータスは正確です")
 
+class LicenseStatusIndex:
+    """requirements_license.txt のライセンス→エントリーの転置インデックスです
+
+    ライセンスごとに、そのライセンスを持つエントリーの行頭のバイト位置・現在の
+    ステータス・パッケージ名を保持し、requirements_license.txt と同じディレクトリに
+    保存します。ステータスの ✅ と ❓ は UTF-8 でどちらも3バイトのため、
+    許可リストの変更で判定が変わったライセンスのエントリーだけをファイル内で
+    直接書き換えられます。ファイルのサイズ/mtime と許可リストの指紋を記録し、
+    ファイルが他で変更された場合は使用しません。
+    """
+
+    VERSION = 1
+    STATUS_BYTES = {"✅": "✅".encode('utf-8'), "❓": "❓".encode('utf-8')}
+
+    def __init__(self, requirements_path, file_stamp, allowlist_fingerprint, licenses):
+        self.requirements_path = requirements_path
+        self.file_stamp = file_stamp
+        self.allowlist_fingerprint = allowlist_fingerprint
+        # {license: {"status": 共通のステータス（混在時はNone）, "entries": [[offset, status, name], ...]}}
+        self.licenses = licenses
+
+    @staticmethod
+    def index_path(requirements_path):
+        directory, filename = os.path.split(os.path.abspath(requirements_path))
+        return os.path.join(directory, f".{filename}.index.json")
+
+    @staticmethod
+    def _file_stamp(requirements_path):
+        st = os.stat(requirements_path)
+        return [st.st_size, st.st_mtime_ns]
+
+    @classmethod
+    def build(cls, requirements_path, allowlist_fingerprint):
+        """requirements_license.txt を一度読み込んでインデックスを作ります"""
+        licenses = {}
+        offset = 0
+        with open(requirements_path, 'rb') as f:
+            data = f.read()
+        for raw_line in data.splitlines(True):
+            record = LicenseRecord.parse(raw_line.decode('utf-8', 'replace'))
+            # 行頭が ✅ / ❓ のエントリーだけがその場で書き換え可能
+            if record is not None and raw_line[:3] in cls.STATUS_BYTES.values():
+                group = licenses.setdefault(record.license, {"status": record.status, "entries": []})
+                if group["status"] != record.status:
+                    group["status"] = None
+                group["entries"].append([offset, record.status, f"{record.name}=={record.version}"])
+            offset += len(raw_line)
+        return cls(requirements_path, cls._file_stamp(requirements_path), allowlist_fingerprint, licenses)
+
+    @classmethod
+    def load(cls, requirements_path):
+        """保存済みのインデックスを読み込みます（ないか、ファイルが変更されていればNone）"""
+        import json
+        try:
+            with open(cls.index_path(requirements_path), 'r') as f:
+                data = json.load(f)
+            if data.get("version") != cls.VERSION or data.get("file") != cls._file_stamp(requirements_path):
+                return None
+            return cls(requirements_path, data["file"], data.get("allowlist"), data["licenses"])
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def save(self, out=None):
+        """インデックスを保存します（メッセージは out、省略時は標準出力に書きます）"""
+        import json
+        try:
+            _write_text_atomic(self.index_path(self.requirements_path), json.dumps({
+                "version": self.VERSION,
+                "file": self.file_stamp,
+                "allowlist": self.allowlist_fingerprint,
+                "licenses": self.licenses,
+            }, ensure_ascii=False, separators=(',', ':')))
+        except OSError as e:
+            print(f"⚠️ ライセンスインデックスの保存に失敗しました: {e}", file=out)
+
+    def apply(self, matcher, out=None):
+        """判定が変わったライセンスのエントリーだけステータスを書き換え、変更した件数を返します
+
+        書き換えたエントリーのメッセージは out（省略時は標準出力）に書きます。
+
+        パッケージごとの例外のルールがある場合は、同じライセンスでも判定が分かれうるため
+        エントリーごとに判定します（例外の対象でないパッケージの判定はライセンスごとに共有されます）。
+        """
+        changes = []
+        per_package = matcher.has_package_rules
+        for license_info, group in self.licenses.items():
+            correct_status = "✅" if matcher.is_allowed(license_info) else "❓"
+            if not per_package:
+                if group["status"] == correct_status:
+                    continue
+                for entry in group["entries"]:
+                    if entry[1] != correct_status:
+                        changes.append((entry, correct_status))
+                group["status"] = correct_status
+                continue
+            statuses = set()
+            for entry in group["entries"]:
+                name, _, version = entry[2].partition("==")
+                status = "✅" if matcher.is_allowed(license_info, name, version) else "❓"
+                if entry[1] != status:
+                    changes.append((entry, status))
+                statuses.add(status)
+            group["status"] = statuses.pop() if len(statuses) == 1 else None
+        if not changes:
+            return 0
+        
+        profile_count("files_written")
+        profile_count("bytes_written", 3 * len(changes))
+        with profile_span("write.in_place", "io", path=self.requirements_path, entries=len(changes)), \
+                _FileLock(_lock_path(self.requirements_path)), open(self.requirements_path, 'r+b') as f:
+            # 他のプロセスが書き換えていないこと、記録どおりのステータスが行頭にあることを確認する
+            if self._file_stamp(self.requirements_path) != self.file_stamp:
+                raise ValueError("requirements_license.txt がインデックスの作成後に変更されています")
+            for entry, _ in changes:
+                f.seek(entry[0])
+                if f.read(3) != self.STATUS_BYTES[entry[1]]:
+                    raise ValueError("requirements_license.txt がインデックスと一致しません")
+            for entry, correct_status in changes:
+                f.seek(entry[0])
+                f.write(self.STATUS_BYTES[correct_status])
+                print(f"🔄 {entry[2]}のステータスを{entry[1]}から{correct_status}に更新しました", file=out)
+                entry[1] = correct_status
+        self.file_stamp = self._file_stamp(self.requirements_path)
+        return len(changes)
+
+def _allowlist_fingerprint(allowed_licenses, rules=()):
+    """許可リストとルールの内容の指紋を返します（許可リストの順序や重複の違いは無視）"""
+    import hashlib
+    # 判定の仕組みが変わった場合も指紋が変わるよう、判定方法の版を含める
+    text = f"v{LICENSE_MATCHING_VERSION}\n" + "\n".join(sorted(set(allowed_licenses)))
+    if rules:
+        text += "\nrules:" + _rules_key(rules)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+@profiled("license_index.rebuild", "phase")
+def rebuild_license_index():
+    """現在のrequirements_license.txtと許可リストに対するライセンスインデックスを作り直します"""
+    if not os.path.exists(REQUIREMENTS_LICENSE_PATH):
+        return None
+    index = LicenseStatusIndex.build(REQUIREMENTS_LICENSE_PATH,
+                                     _allowlist_fingerprint(load_allowed_licenses(), load_license_rules()))
+    index.save()
+    return index
+
+@profiled("refresh_license_status", "phase")
+def refresh_license_status():
+    """許可リストの変更をrequirements_license.txtのステータスに反映します
+
+    有効なライセンスインデックスがあれば、判定が変わったライセンスのエントリーだけを
+    書き換えます。許可リストとファイルのどちらも前回から変わっていなければ何もしません。
+    インデックスが使えない場合は全エントリーを確認し、インデックスを作り直します。
+    """
+    if not os.path.exists(REQUIREMENTS_LICENSE_PATH):
+        print("❌ requirements_license.txtが見つかりません")
+        return
+    
+    matcher = get_license_matcher()
+    client = get_daemon_client()
+    if client is not None:
+        # 常駐プロセスが保持しているインデックスで更新する（使えない場合は以下の通常の処理）
+        result = client.update(REQUIREMENTS_LICENSE_PATH, matcher.allowed_licenses, matcher.rules)
+        if result.get("status") == "unchanged":
+            print("✅ 許可リストとrequirements_license.txtに変更がないため、ステータスは最新です")
+            return
+        if result.get("status") == "updated":
+            print(result["output"], end="")
+            if result["changed"]:
+                print(f"✅ {result['changed']}個のパッケージのステータスを更新しました")
+            else:
+                print("✅ すべてのパッケージのステータスは正確です")
+            return
+    
+    fingerprint = _allowlist_fingerprint(matcher.allowed_licenses, matcher.rules)
+    index = LicenseStatusIndex.load(REQUIREMENTS_LICENSE_PATH)
+    if index is not None:
+        if index.allowlist_fingerprint == fingerprint:
+            print("✅ 許可リストとrequirements_license.txtに変更がないため、ステータスは最新です")
+            return
+        try:
+            changed = index.apply(matcher)
+        except (OSError, ValueError) as e:
+            print(f"⚠️ ライセンスインデックスを使用できません: {e}")
+        else:
+            index.allowlist_fingerprint = fingerprint
+            index.save()
+            if changed:
+                print(f"✅ {changed}個のパッケージのステータスを更新しました")
+            else:
+                print("✅ すべてのパッケージのステータスは正確です")
+            return
+    
+    update_license_status()
+    rebuild_license_index()
+
+# pip license serve（常駐プロセス）の設定
+# ソケットはデフォルトでキャッシュディレクトリに環境（インタープリターと PYTHONPATH）ごとに作る
+SERVE_SOCKET_PATH = os.environ.get("PIP_LICENSE_SOCKET") or None
+SERVE_ENABLED = os.environ.get("PIP_LICENSE_NO_DAEMON", "") == ""
+DEFAULT_SERVE_INTERVAL = 2.0
+SERVE_PROTOCOL_VERSION = 2
+
+def default_socket_path():
+    """この環境用の常駐プロセスのソケットのパスを返します"""
+    if SERVE_SOCKET_PATH:
+        return SERVE_SOCKET_PATH
+    import hashlib
+    key = "\n".join([sys.executable, sys.prefix, os.environ.get("PYTHONPATH", "")])
+    return os.path.join(CACHE_DIR, f"serve-{hashlib.sha1(key.encode('utf-8')).hexdigest()[:12]}.sock")
+
+def _dist_info_stamp(path):
+    """dist-info ディレクトリと METADATA の mtime/サイズです（変わっていれば解析し直す）"""
+    stamp = []
+    for target in (path, os.path.join(path, 'METADATA'), os.path.join(path, 'PKG-INFO')):
+        try:
+            st = os.stat(target)
+        except OSError:
+            stamp.append(None)
+        else:
+            stamp.append((st.st_mtime_ns, st.st_size))
+    return tuple(stamp)
+
+class DistributionIndex:
+    """インストール済みのディストリビューションのメモリ上の索引です（pip license serve が保持）
+
+    refresh() は sys.path の各ディレクトリの mtime だけを確認し、パッケージの追加・削除・
+    更新で mtime が変わったディレクトリだけ dist-info を列挙し直します。解析し直すのは
+    METADATA の mtime/サイズが変わった dist-info だけです。
+    """
+
+    def __init__(self, paths=None):
+        paths = sys.path if paths is None else paths
+        self.paths = list(dict.fromkeys(os.path.abspath(path) for path in paths if path and os.path.isdir(path)))
+        self.generation = 0
+        self._directories = {}
+        self._entries = {}
+        self._by_name = {}
+
+    def __len__(self):
+        return len(self._by_name)
+
+    def refresh(self):
+        """変更のあったディレクトリを読み直します（索引が変わった場合は True）"""
+        changed = False
+        for directory in self.paths:
+            try:
+                mtime = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtime = None
+            cached = self._directories.get(directory)
+            if cached is not None and cached[0] == mtime:
+                continue
+            entries = _list_distributions([directory]) if mtime is not None else []
+            self._directories[directory] = (mtime, [path for _, _, path in entries])
+            changed = True
+        if not changed:
+            return False
+        
+        import importlib.metadata as metadata
+        import pathlib
+        with profile_span("serve.refresh", "metadata"):
+            entries = {}
+            by_name = {}
+            for directory in self.paths:
+                for path in self._directories[directory][1]:
+                    stamp = _dist_info_stamp(path)
+                    previous = self._entries.get(path)
+                    if previous is not None and previous[0] == stamp:
+                        info = previous[1]
+                    else:
+                        info = _resolve_distribution(metadata.PathDistribution(pathlib.Path(path)))
+                    entries[path] = (stamp, info)
+                    key = _canonical_name(info[0]) if info[0] else None
+                    # sys.path の先にあるものが優先されるため、同名の2つ目以降は無視する
+                    if key and key not in by_name and key != "pip-license-checker":
+                        by_name[key] = path
+            self._entries = entries
+            self._by_name = by_name
+            self.generation += 1
+        return True
+
+    def lookup(self, requirement):
+        """get_package_info と同じく要求仕様から (version, license, requires) を返します"""
+        path = self._by_name.get(_canonical_name(_requirement_name(requirement)))
+        if path is None:
+            return "Unknown", "Unknown", []
+        _, version, license_info, requires, _ = self._entries[path][1]
+        return version, license_info, list(requires)
+
+    def distributions(self):
+        """(name, version, license, requires, source) を sys.path の順に返します"""
+        for path in self._by_name.values():
+            yield self._entries[path][1]
+
+class LicenseServer:
+    """DistributionIndex を保持し、Unix ドメインソケットで check / update / export の問い合わせに答えます
+
+    要求と応答は1行1つの JSON です。接続ごとにスレッドで処理し、索引の更新と参照は
+    ロックで直列化します。別のスレッドが interval 秒ごとに索引を更新します。
+    """
+
+    def __init__(self, socket_path, interval=DEFAULT_SERVE_INTERVAL, paths=None):
+        import threading
+        self.socket_path = socket_path
+        self.interval = interval
+        self.index = DistributionIndex(paths)
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._status_indexes = {}
+        self._server = None
+
+    def refresh(self):
+        with self._lock:
+            if self.index.refresh():
+                flush_metadata_cache()
+
+    def serve_forever(self):
+        """ソケットを作って問い合わせを待ちます（stop 要求・SIGTERM・Ctrl+C で終了）"""
+        import signal
+        import socketserver
+        import threading
+
+        server_self = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                server_self._handle_connection(self.rfile, self.wfile)
+
+        class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+            daemon_threads = True
+
+        directory = os.path.dirname(os.path.abspath(self.socket_path))
+        os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.socket_path):
+            # 前回異常終了したときのソケットが残っている場合だけ削除する
+            if DaemonClient.connect(self.socket_path) is not None:
+                raise RuntimeError(f"既に起動しています: {self.socket_path}")
+            os.unlink(self.socket_path)
+        
+        self.refresh()
+        # ソケットは同じユーザーだけが接続できるようにする
+        umask = os.umask(0o077)
+        try:
+            self._server = Server(self.socket_path, Handler)
+        finally:
+            os.umask(umask)
+        signal.signal(signal.SIGTERM, lambda *_: self.stop())
+        poller = threading.Thread(target=self._poll, daemon=True)
+        poller.start()
+        print(f"✅ {len(self.index)}個のパッケージの索引を作成しました（{self.interval}秒ごとに変更を確認）")
+        print(f"🔌 {self.socket_path} で待機しています（終了: pip license serve --stop）")
+        try:
+            self._server.serve_forever(poll_interval=0.5)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self._stopped.set()
+            self._server.server_close()
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            flush_metadata_cache()
+
+    def stop(self):
+        """問い合わせの待機を終了します（別のスレッドから呼び出す）"""
+        import threading
+        self._stopped.set()
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+    def _poll(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"⚠️ 索引の更新に失敗しました: {e}")
+
+    def _handle_connection(self, rfile, wfile):
+        import json
+        for line in rfile:
+            try:
+                request = json.loads(line)
+                command = request.get("command")
+                if command == "export":
+                    with self._lock:
+                        self.index.refresh()
+                        records = list(self.index.distributions())
+                    for record in records:
+                        wfile.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b"\n")
+                    response = {"done": True, "count": len(records)}
+                else:
+                    response = self._handle_request(command, request)
+            except Exception as e:
+                response = {"error": str(e)}
+            wfile.write(json.dumps(response, ensure_ascii=False).encode('utf-8') + b"\n")
+            wfile.flush()
+
+    def _handle_request(self, command, request):
+        if command == "ping":
+            with self._lock:
+                return {"version": SERVE_PROTOCOL_VERSION, "pid": os.getpid(), "packages": len(self.index),
+                        "generation": self.index.generation, "paths": self.index.paths}
+        if command == "lookup":
+            with self._lock:
+                # 問い合わせの直前にも変更を確認するため、ポーリングの間隔より古い情報は返さない
+                self.index.refresh()
+                return {"results": [self.index.lookup(requirement) for requirement in request["requirements"]]}
+        if command == "update":
+            with self._lock:
+                return self._update(request["requirements_path"], request["allowed_licenses"],
+                                    request.get("rules") or [])
+        if command == "stop":
+            self.stop()
+            return {"stopped": True}
+        raise ValueError(f"不明な要求です: {command}")
+
+    def _update(self, requirements_path, allowed_licenses, rules=()):
+        """保持しているライセンスインデックスで refresh_license_status と同じ更新を行います
+
+        接続ごとのスレッドで呼ばれるため、sys.stdout は差し替えずにメッセージを応答用のバッファに直接書きます。
+        """
+        import io
+        index = self._status_indexes.get(requirements_path)
+        try:
+            if index is None or index.file_stamp != LicenseStatusIndex._file_stamp(requirements_path):
+                index = LicenseStatusIndex.load(requirements_path)
+        except OSError:
+            index = None
+        if index is None:
+            # インデックスが使えない場合は呼び出し元が全エントリーを確認して作り直す
+            self._status_indexes.pop(requirements_path, None)
+            return {"status": "cold"}
+        
+        matcher = LicenseMatcher(allowed_licenses, rules)
+        fingerprint = _allowlist_fingerprint(matcher.allowed_licenses, matcher.rules)
+        if index.allowlist_fingerprint == fingerprint:
+            self._status_indexes[requirements_path] = index
+            return {"status": "unchanged", "changed": 0, "output": ""}
+        output = io.StringIO()
+        try:
+            changed = index.apply(matcher, output)
+            index.allowlist_fingerprint = fingerprint
+            index.save(output)
+        except (OSError, ValueError) as e:
+            self._status_indexes.pop(requirements_path, None)
+            return {"status": "cold", "error": str(e)}
+        self._status_indexes[requirements_path] = index
+        return {"status": "updated", "changed": changed, "output": output.getvalue()}
+
+class DaemonClient:
+    """pip license serve への接続です
+
+    get_package_info と同じ呼び出し方ができるため、check_license や build_dependency_graph の
+    lookup としてそのまま使えます（prefetch で同じ深さのパッケージをまとめて問い合わせます）。
+    """
+
+    def __init__(self, sock, info):
+        self._sock = sock
+        self._file = sock.makefile('rwb')
+        self.info = info
+        self._results = {}
+
+    @classmethod
+    def connect(cls, socket_path=None, timeout=5.0):
+        """常駐プロセスに接続します（起動していない・応答しない場合は None）"""
+        import socket
+        socket_path = socket_path or default_socket_path()
+        if not hasattr(socket, "AF_UNIX") or not os.path.exists(socket_path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(timeout)
+        try:
+            sock.connect(socket_path)
+            client = cls(sock, None)
+            client.info = client.request({"command": "ping"})
+        except (OSError, ValueError):
+            sock.close()
+            return None
+        if client.info.get("version") != SERVE_PROTOCOL_VERSION:
+            client.close()
+            return None
+        return client
+
+    def _send(self, message):
+        import json
+        with profile_span("daemon.request", "daemon", command=message.get("command")):
+            self._file.write(json.dumps(message, ensure_ascii=False).encode('utf-8') + b"\n")
+            self._file.flush()
+
+    def _receive(self):
+        import json
+        line = self._file.readline()
+        if not line:
+            raise ValueError("常駐プロセスとの接続が切れました")
+        response = json.loads(line)
+        if isinstance(response, dict) and "error" in response:
+            raise ValueError(response["error"])
+        return response
+
+    def request(self, message):
+        """要求を1つ送り、応答を返します"""
+        self._send(message)
+        return self._receive()
+
+    def __call__(self, requirement):
+        if requirement not in self._results:
+            self.prefetch([requirement])
+        version, license_info, requires = self._results[requirement]
+        return version, license_info, list(requires)
+
+    def prefetch(self, requirements):
+        """まだ問い合わせていない要求仕様をまとめて1回で問い合わせます"""
+        pending = [req for req in dict.fromkeys(requirements) if req not in self._results]
+        if pending:
+            results = self.request({"command": "lookup", "requirements": pending})["results"]
+            self._results.update(zip(pending, (tuple(result) for result in results)))
+
+    def iter_distributions(self):
+        """iter_installed_distributions と同じ (name, version, license, requires, source) を順に返します"""
+        self._send({"command": "export"})
+        while True:
+            record = self._receive()
+            if isinstance(record, dict):
+                return
+            yield tuple(record)
+
+    def update(self, requirements_path, allowed_licenses, rules=()):
+        """requirements_license.txt のステータスの更新を依頼します"""
+        return self.request({"command": "update", "requirements_path": os.path.abspath(requirements_path),
+                             "allowed_licenses": list(allowed_licenses), "rules": list(rules)})
+
+    def close(self):
+        try:
+            self._file.close()
+        finally:
+            self._sock.close()
+
+_DAEMON_CLIENT = None
+
+def get_daemon_client():
+    """この環境の常駐プロセスに接続して返します（使わない設定・起動していない場合は None）"""
+    global _DAEMON_CLIENT
+    if not SERVE_ENABLED or METADATA_BACKEND != "importlib":
+        return None
+    if _DAEMON_CLIENT is None:
+        _DAEMON_CLIENT = DaemonClient.connect() or False
+        if _DAEMON_CLIENT:
+            print(f"⚡ 常駐プロセス（pid {_DAEMON_CLIENT.info.get('pid')}）の索引を使用します")
+    return _DAEMON_CLIENT or None
+
 def main():
     if len(sys.argv) > 1:
         if sys.argv[1] == 'license':
-            license_command()
+            return license_command()
         elif sys.argv[1] == 'install' and len(sys.argv) > 2:
             # installコマンドを直接インターセプト
             print(f"📝 パッケージのライセンス確認を開始します（依存パッケージを含む）")
@@ -771,7 +5000,7 @@ def main():
             old_argv = sys.argv.copy()
             sys.argv = [sys.argv[0], 'license', 'install'] + packages
             try:
-                license_command()
+                return license_command()
             finally:
                 # 元のargvを復元
                 sys.argv = old_argv
@@ -785,4 +5014,4 @@ def main():
         return pip_main()
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
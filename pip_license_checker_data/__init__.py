@@ -0,0 +1 @@
+# pip_license_checker が実行時に読み込むデータファイル（license-index.json.gz）を同梱するためのパッケージ
@@ -8,6 +8,9 @@ setup(
     name="pip-license-checker",
     version="0.1.0",
     py_modules=["pip_license_checker"],
+    # ライセンス本文の索引（tools/build_license_index.py で生成）
+    packages=["pip_license_checker_data"],
+    package_data={"pip_license_checker_data": ["license-index.json.gz"]},
     entry_points={
         "console_scripts": [
             "pip=pip_license_checker:main",
@@ -0,0 +1,74 @@
+"""tests/fixtures/simple-index（ローカルで配信するテスト用の Simple Repository API）を生成します
+
+- alpha 1.0: PEP 658 の .metadata ファイルあり（wheel 本体は取得しなくてよい）
+- beta 2.0: .metadata なし。METADATA を先頭に置き、後ろに 80KB の詰め物を入れて、
+  Range リクエストで中央ディレクトリと METADATA を別々に取得する経路を通す
+- beta 1.0: バージョン指定（beta<2）の確認用
+
+同じ内容からは同じバイト列になるよう、zip の日時は固定しています。
+
+    python tests/fixtures/build_simple_index.py
+"""
+import hashlib
+import os
+import zipfile
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+INDEX_DIR = os.path.join(FIXTURES_DIR, "simple-index")
+DATE_TIME = (2020, 1, 1, 0, 0, 0)
+
+PACKAGES = [
+    # (名前, バージョン, METADATA のヘッダー, .metadata を置くか, 詰め物のバイト数)
+    ("alpha", "1.0", [("License-Expression", "MIT"), ("Requires-Dist", "beta>=2"),
+                      ("Requires-Dist", 'gamma; python_version < "3"')], True, 0),
+    ("beta", "1.0", [("License", "GPL-3.0")], False, 0),
+    ("beta", "2.0", [("Classifier", "License :: OSI Approved :: BSD License")], False, 80000),
+]
+
+
+def _metadata(name, version, headers):
+    return f"Metadata-Version: 2.4\nName: {name}\nVersion: {version}\n" + \
+        "".join(f"{key}: {value}\n" for key, value in headers)
+
+
+def _write_wheel(path, name, version, metadata, padding):
+    dist_info = f"{name}-{version}.dist-info"
+    with zipfile.ZipFile(path, "w") as archive:
+        def add(member, data, compress_type=zipfile.ZIP_DEFLATED):
+            info = zipfile.ZipInfo(member, DATE_TIME)
+            info.compress_type = compress_type
+            archive.writestr(info, data)
+        add(f"{dist_info}/METADATA", metadata)
+        add(f"{name}/__init__.py", "")
+        if padding:
+            add(f"{name}/padding.bin", b"\0" * padding, zipfile.ZIP_STORED)
+        add(f"{dist_info}/WHEEL", "Wheel-Version: 1.0\nRoot-Is-Purelib: true\nTag: py3-none-any\n")
+        add(f"{dist_info}/RECORD", "")
+
+
+def main():
+    files_dir = os.path.join(INDEX_DIR, "files")
+    os.makedirs(files_dir, exist_ok=True)
+    links = {}
+    for name, version, headers, has_metadata, padding in PACKAGES:
+        filename = f"{name}-{version}-py3-none-any.whl"
+        metadata = _metadata(name, version, headers)
+        path = os.path.join(files_dir, filename)
+        _write_wheel(path, name, version, metadata, padding)
+        if has_metadata:
+            with open(path + ".metadata", "w", newline="\n") as f:
+                f.write(metadata)
+        with open(path, "rb") as f:
+            sha256 = hashlib.sha256(f.read()).hexdigest()
+        attributes = ' data-core-metadata="true"' if has_metadata else ""
+        links.setdefault(name, []).append(
+            f'<a href="../../files/{filename}#sha256={sha256}"{attributes}>{filename}</a><br>')
+
+    for name, anchors in links.items():
+        os.makedirs(os.path.join(INDEX_DIR, "simple", name), exist_ok=True)
+        with open(os.path.join(INDEX_DIR, "simple", name, "index.html"), "w", newline="\n") as f:
+            f.write("<!DOCTYPE html>\n<html><body>\n" + "\n".join(anchors) + "\n</body></html>\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""pip license export の書き出しと、書き出した JSONL / CSV の読み込みのテスト
+
+    python -m pytest tests
+"""
+import io
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+PACKAGES = [("alpha", "1.0", "MIT", ["beta"]), ("beta", "2.0", "GPL-3.0-only", []),
+            ("gamma", "0.1", "BSD-3-Clause", []), ("delta", "3.0", "MIT", [])]
+
+
+class ExportTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.site_packages = os.path.join(directory.name, "site-packages")
+        for name, version, license_info, requires in PACKAGES:
+            dist_info = os.path.join(self.site_packages, f"{name}-{version}.dist-info")
+            os.makedirs(dist_info)
+            with open(os.path.join(dist_info, "METADATA"), "w") as f:
+                f.write(f"Metadata-Version: 2.4\nName: {name}\nVersion: {version}\nLicense-Expression: {license_info}\n"
+                        + "".join(f"Requires-Dist: {requirement}\n" for requirement in requires))
+        requirements_path = os.path.join(directory.name, "requirements_license.txt")
+        with open(requirements_path, "w") as f:
+            f.write(checker.REQUIREMENTS_LICENSE_HEADER
+                    + f"✅ Alpha==1.0 [MIT] [{checker.INSTALL_TYPE_DIRECT}]\n"
+                    + f"❓ delta==3.0 [MIT] [{checker.INSTALL_TYPE_DEPENDENCY}]\n")
+        self.export_path = os.path.join(directory.name, "licenses")
+        for name, value in (("REQUIREMENTS_LICENSE_PATH", requirements_path), ("METADATA_CACHE_ENABLED", False),
+                            ("_ALLOWLIST_STORE", None),
+                            ("LICENSE_CONFIG_PATH", os.path.join(directory.name, "allowed_licenses.json"))):
+            patcher = mock.patch.object(checker, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def export(self, output_format="jsonl"):
+        out = io.StringIO()
+        with mock.patch("sys.stdout", io.StringIO()):
+            count = checker.export_licenses(output_format, out, [self.site_packages])
+        self.assertEqual(count, len(PACKAGES))
+        with open(f"{self.export_path}.{output_format}", "w") as f:
+            f.write(out.getvalue())
+        return {record["name"]: record for record in checker.read_license_export(f"{self.export_path}.{output_format}")}
+
+    def test_install_types_across_batches(self):
+        with mock.patch.object(checker, "EXPORT_BATCH_SIZE", 1):
+            records = self.export()
+        self.assertEqual({name: record["install_type"] for name, record in records.items()},
+                         {"alpha": "direct", "beta": None, "gamma": None, "delta": "dependency"})
+        self.assertEqual(records["alpha"]["requires"], ["beta"])
+        self.assertEqual(records["beta"]["status"], "unverified")
+
+    def test_csv_round_trip(self):
+        records = self.export("csv")
+        self.assertEqual(records["alpha"]["requires"], ["beta"])
+        self.assertEqual(records["gamma"]["license"], "BSD-3-Clause")
+        self.assertIsNone(records["gamma"]["install_type"])
+
+    def test_packages_from_export(self):
+        self.export()
+        self.assertEqual(checker.packages_from_export(f"{self.export_path}.jsonl"),
+                         {name: (version, license_info, requires) for name, version, license_info, requires in PACKAGES})
+
+
+if __name__ == "__main__":
+    unittest.main()
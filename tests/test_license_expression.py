@@ -0,0 +1,100 @@
+"""SPDX ライセンス式の構文解析と、LicenseMatcher による式の判定のテスト
+
+    python -m pytest tests
+"""
+import os
+import sys
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+
+def _license(identifier, exception=None):
+    return ("license", identifier, exception)
+
+
+class ParseLicenseExpressionTest(unittest.TestCase):
+
+    def test_single_identifier(self):
+        self.assertEqual(checker.parse_license_expression("MIT"), _license("MIT"))
+        self.assertEqual(checker.parse_license_expression(" GPL-3.0+ "), _license("GPL-3.0+"))
+        self.assertEqual(checker.parse_license_expression("LicenseRef-Proprietary"), _license("LicenseRef-Proprietary"))
+
+    def test_and_binds_tighter_than_or(self):
+        self.assertEqual(checker.parse_license_expression("MIT OR Apache-2.0 AND BSD-3-Clause"),
+                         ("or", (_license("MIT"), ("and", (_license("Apache-2.0"), _license("BSD-3-Clause"))))))
+
+    def test_parentheses(self):
+        self.assertEqual(checker.parse_license_expression("(MIT OR Apache-2.0) AND BSD-3-Clause"),
+                         ("and", (("or", (_license("MIT"), _license("Apache-2.0"))), _license("BSD-3-Clause"))))
+
+    def test_with_exception(self):
+        self.assertEqual(checker.parse_license_expression("GPL-2.0-or-later WITH Classpath-exception-2.0"),
+                         _license("GPL-2.0-or-later", "Classpath-exception-2.0"))
+
+    def test_operators_are_case_insensitive(self):
+        self.assertEqual(checker.parse_license_expression("MIT or Apache-2.0"),
+                         ("or", (_license("MIT"), _license("Apache-2.0"))))
+
+    def test_not_an_expression(self):
+        # 式として解釈できないものは None（従来どおり名前として比較する）
+        for text in ("", "MIT License", "(MIT", "MIT AND", "MIT WITH", "MIT OR )", "BSD, MIT"):
+            with self.subTest(text=text):
+                self.assertIsNone(checker.parse_license_expression(text))
+
+
+class LicenseFromMetadataTest(unittest.TestCase):
+
+    def test_license_expression_first(self):
+        meta = checker._MetadataHeaders("License-Expression: MIT\nLicense: BSD\n")
+        self.assertEqual(checker._license_from_metadata(meta), ("MIT", "License-Expression"))
+
+    def test_first_line_of_license(self):
+        meta = checker._MetadataHeaders("License: BSD 3\n  more text\nClassifier: License :: OSI Approved :: MIT License\n")
+        self.assertEqual(checker._license_from_metadata(meta), ("BSD 3", "License"))
+
+    def test_classifier(self):
+        meta = checker._MetadataHeaders("Classifier: License :: OSI Approved :: MIT License\n")
+        self.assertEqual(checker._license_from_metadata(meta), ("MIT License", "Classifier"))
+
+
+class ExpressionMatchingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = checker.LicenseMatcher(["MIT", "Apache-2.0", "LGPL-3.0-only OR GPL-3.0-only"])
+
+    def test_and_requires_every_identifier(self):
+        self.assertTrue(self.matcher.is_allowed("MIT AND Apache-2.0"))
+        self.assertFalse(self.matcher.is_allowed("MIT AND GPL-3.0-only"))
+
+    def test_or_requires_any_identifier(self):
+        self.assertTrue(self.matcher.is_allowed("GPL-3.0-only OR MIT"))
+        self.assertFalse(self.matcher.is_allowed("GPL-3.0-only OR BSD-3-Clause"))
+
+    def test_with_follows_the_license(self):
+        self.assertTrue(self.matcher.is_allowed("Apache-2.0 WITH LLVM-exception"))
+        self.assertFalse(self.matcher.is_allowed("GPL-2.0-only WITH Classpath-exception-2.0"))
+
+    def test_expression_listed_verbatim(self):
+        # 許可リストにそのまま書かれた式は、識別子が個別に許可されていなくても許可
+        self.assertTrue(self.matcher.is_allowed("LGPL-3.0-only OR GPL-3.0-only"))
+        self.assertTrue(self.matcher.is_allowed("lgpl-3.0-only or gpl-3.0-only"))
+        self.assertFalse(self.matcher.is_allowed("GPL-3.0-only"))
+
+    def test_names_are_normalized(self):
+        self.assertTrue(self.matcher.is_allowed("MIT License"))
+        self.assertTrue(self.matcher.is_allowed("Apache Software License"))
+        self.assertFalse(self.matcher.is_allowed("Unknown"))
+
+    def test_add_updates_verdicts(self):
+        self.assertFalse(self.matcher.is_allowed("MIT AND BSD-3-Clause"))
+        self.matcher.add("BSD-3-Clause")
+        self.assertTrue(self.matcher.is_allowed("MIT AND BSD-3-Clause"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,144 @@
+"""非対話モードのライセンスポリシー（deny / warn / allow と --add-allowed）と終了コードのテスト
+
+コマンド全体の終了コードは、export 形式の JSONL を `pip license scan --input` で読み込ませて
+インストール済みの環境によらずに確認します。
+
+    python -m pytest tests
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+PACKAGES = [
+    {"name": "alpha", "version": "1.0", "license": "MIT", "requires": ["beta"]},
+    {"name": "beta", "version": "2.0", "license": "GPL-3.0-only", "requires": []},
+    {"name": "gamma", "version": "0.1", "license": "Unknown", "requires": []},
+]
+
+
+class LicensePolicyTest(unittest.TestCase):
+
+    def test_invalid_mode(self):
+        with self.assertRaises(ValueError):
+            checker.LicensePolicy("ask")
+
+    def test_deny(self):
+        policy = checker.LicensePolicy("deny")
+        policy.record("beta", "2.0", "GPL-3.0-only", ["alpha", "beta"])
+        self.assertFalse(policy.confirm("?"))
+        self.assertFalse(policy.confirm_add("?"))
+        self.assertEqual(policy.exit_code(), checker.EXIT_LICENSE_DENIED)
+        summary = policy.summary()
+        self.assertIn("❌ 拒否", summary)
+        self.assertIn("beta (2.0): GPL-3.0-only", summary)
+        self.assertIn("alpha → beta", summary)
+
+    def test_warn(self):
+        policy = checker.LicensePolicy("warn")
+        policy.record("beta", "2.0", "GPL-3.0-only")
+        self.assertTrue(policy.confirm("?"))
+        self.assertFalse(policy.confirm_add("?"))
+        self.assertEqual(policy.exit_code(), checker.EXIT_OK)
+        self.assertIn("⚠️ 警告のみ", policy.summary())
+
+    def test_allow_keeps_allowlist_unless_add_allowed(self):
+        policy = checker.LicensePolicy("allow")
+        policy.record("beta", "2.0", "GPL-3.0-only")
+        self.assertTrue(policy.confirm("?"))
+        self.assertFalse(policy.auto_add)
+        self.assertFalse(policy.confirm_add("?"))
+        self.assertIn("--add-allowed", policy.summary())
+        self.assertEqual(policy.exit_code(), checker.EXIT_OK)
+        policy = checker.LicensePolicy("allow", add_allowed=True)
+        policy.record("beta", "2.0", "GPL-3.0-only")
+        self.assertTrue(policy.confirm_add("?"))
+        self.assertIn("許可リストに追加", policy.summary())
+
+    def test_add_allowed_needs_allow(self):
+        self.assertFalse(checker.LicensePolicy("warn", add_allowed=True).auto_add)
+
+    def test_violations_are_recorded_once(self):
+        policy = checker.LicensePolicy("warn")
+        policy.record("Beta", "2.0", "GPL-3.0-only")
+        policy.record("beta", "2.0", "GPL-3.0-only")
+        self.assertEqual(len(policy.violations), 1)
+
+    def test_no_summary_without_violations(self):
+        self.assertIsNone(checker.LicensePolicy("deny").summary())
+
+
+class ExitCodeTest(unittest.TestCase):
+    """`pip license scan --input` をサブプロセスで実行して終了コードと許可リストを確認します"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.export_path = os.path.join(self.directory, "licenses.jsonl")
+        with open(self.export_path, "w") as f:
+            for record in PACKAGES:
+                f.write(json.dumps(record) + "\n")
+        self.config_path = os.path.join(self.directory, "allowed_licenses.json")
+        with open(self.config_path, "w") as f:
+            json.dump({"allowed_licenses": ["MIT"]}, f)
+
+    def run_license(self, *args, **environ):
+        env = dict(os.environ, PIP_LICENSE_CACHE_DIR=os.path.join(self.directory, "cache"), **environ)
+        for name in ("PIP_LICENSE_POLICY", "PIP_LICENSE_ADD_ALLOWED"):
+            if name not in environ:
+                env.pop(name, None)
+        return subprocess.run(
+            [sys.executable, os.path.join(REPO_ROOT, "pip_license_checker.py"), "license", "--no-daemon"] + list(args),
+            cwd=self.directory, env=env, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+            text=True, timeout=120)
+
+    def scan(self, *options, **environ):
+        return self.run_license(*options, "scan", "--input", self.export_path, **environ)
+
+    def allowed_licenses(self):
+        with open(self.config_path) as f:
+            return json.load(f)["allowed_licenses"]
+
+    def test_deny(self):
+        process = self.scan("--policy", "deny")
+        self.assertEqual(process.returncode, checker.EXIT_LICENSE_DENIED, process.stdout)
+        self.assertIn("beta (2.0): GPL-3.0-only", process.stdout)
+        self.assertEqual(self.allowed_licenses(), ["MIT"])
+
+    def test_non_interactive_default_is_deny(self):
+        self.assertEqual(self.scan().returncode, checker.EXIT_LICENSE_DENIED)
+
+    def test_warn(self):
+        process = self.scan(PIP_LICENSE_POLICY="warn")
+        self.assertEqual(process.returncode, checker.EXIT_OK, process.stdout)
+        self.assertEqual(self.allowed_licenses(), ["MIT"])
+
+    def test_allow_does_not_write_allowlist(self):
+        process = self.scan("--yes")
+        self.assertEqual(process.returncode, checker.EXIT_OK, process.stdout)
+        self.assertEqual(self.allowed_licenses(), ["MIT"])
+
+    def test_allow_with_add_allowed(self):
+        process = self.scan("--policy", "allow", "--add-allowed")
+        self.assertEqual(process.returncode, checker.EXIT_OK, process.stdout)
+        # Unknown は許可リストに追加しない
+        self.assertEqual(self.allowed_licenses(), ["MIT", "GPL-3.0-only"])
+
+    def test_usage_errors(self):
+        self.assertEqual(self.scan(PIP_LICENSE_POLICY="ask").returncode, checker.EXIT_USAGE)
+        self.assertEqual(self.run_license().returncode, checker.EXIT_USAGE)
+        self.assertEqual(self.run_license("scan", "--env", os.path.join(self.directory, "missing")).returncode,
+                         checker.EXIT_USAGE)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""allowed_licenses.json のルール（パターン・拒否・パッケージごとの例外）のテスト
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+RULES = [
+    {"deny": "GPL-*"},
+    {"allow": "BSD*"},
+    {"deny": "BSD-4-Clause"},
+    {"allow": "GPL-3.0-only", "package": "internal-*"},
+    {"deny": "MIT", "package": "legacy", "version": "1.*"},
+    {"allow": "^LicenseRef-Acme-", "regex": True},
+]
+
+
+class LicenseRulesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.matcher = checker.LicenseMatcher(["MIT"], RULES)
+
+    def test_glob_patterns(self):
+        self.assertTrue(self.matcher.is_allowed("BSD-3-Clause"))
+        self.assertFalse(self.matcher.is_allowed("GPL-2.0-only"))
+        # 許可リストにもルールにもないものは不許可のまま
+        self.assertFalse(self.matcher.is_allowed("Apache-2.0"))
+
+    def test_more_specific_rule_wins(self):
+        # 同じ具体度では拒否が優先される
+        self.assertFalse(self.matcher.is_allowed("BSD-4-Clause"))
+        self.assertTrue(self.matcher.is_allowed("GPL-3.0-only", "internal-tool", "1.0"))
+        self.assertTrue(self.matcher.is_allowed("GPL-3.0-only", "Internal_Tool", "1.0"))
+        self.assertFalse(self.matcher.is_allowed("GPL-3.0-only", "public-tool", "1.0"))
+
+    def test_version_exception(self):
+        self.assertFalse(self.matcher.is_allowed("MIT", "legacy", "1.2"))
+        self.assertTrue(self.matcher.is_allowed("MIT", "legacy", "2.0"))
+        self.assertTrue(self.matcher.is_allowed("MIT", "other", "1.2"))
+
+    def test_regex_rule(self):
+        self.assertTrue(self.matcher.is_allowed("LicenseRef-Acme-Internal"))
+        self.assertFalse(self.matcher.is_allowed("LicenseRef-Other"))
+
+    def test_rules_apply_per_identifier(self):
+        # 式全体ではなく識別子ごとにルールを当てはめ、AND / OR で組み合わせる
+        self.assertFalse(self.matcher.is_allowed("MIT AND GPL-2.0-only"))
+        self.assertTrue(self.matcher.is_allowed("MIT OR GPL-2.0-only"))
+        self.assertTrue(self.matcher.is_allowed("GPL-3.0-only AND MIT", "internal-tool", "1.0"))
+
+    def test_expression_listed_verbatim(self):
+        matcher = checker.LicenseMatcher(["MIT OR GPL-3.0-only"], [{"deny": "GPL-*"}])
+        self.assertTrue(matcher.is_allowed("MIT OR GPL-3.0-only"))
+        self.assertFalse(matcher.is_allowed("GPL-3.0-only AND MIT"))
+
+    def test_is_denied(self):
+        self.assertTrue(self.matcher.is_denied("GPL-2.0-only"))
+        self.assertFalse(self.matcher.is_denied("Apache-2.0"))
+        self.assertFalse(checker.LicenseMatcher(["MIT"]).is_denied("GPL-2.0-only"))
+        # 拒否されているライセンスは許可リストに追加しても許可にならない
+        self.matcher.add("GPL-2.0-only")
+        self.assertFalse(self.matcher.is_allowed("GPL-2.0-only"))
+
+    def test_has_package_rules(self):
+        self.assertTrue(self.matcher.has_package_rules)
+        self.assertFalse(checker.LicenseMatcher(["MIT"], [{"deny": "GPL-*"}]).has_package_rules)
+
+    def test_invalid_rules_are_ignored(self):
+        invalid = [
+            {"allow": "MIT", "deny": "GPL-*"},
+            {"allow": " "},
+            {"allow": "MIT", "version": "1.0"},
+            {"allow": "(?P<name>MIT)", "regex": True},
+            {"deny": "GPL-*", "scope": "all"},
+        ]
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            rules = checker.LicenseRules(invalid + [{"deny": "GPL-*"}])
+        self.assertEqual(len(rules), 1)
+        self.assertEqual(out.getvalue().count("⚠️"), len(invalid))
+
+
+class LoadLicenseRulesTest(unittest.TestCase):
+
+    def test_rules_from_config(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "allowed_licenses.json")
+            with open(path, "w") as f:
+                json.dump({"allowed_licenses": ["MIT"], "rules": [{"deny": "GPL-*"}, "GPL-*"]}, f)
+            with mock.patch.object(checker, "LICENSE_CONFIG_PATH", path), \
+                    mock.patch.object(checker, "_ALLOWLIST_STORE", None):
+                self.assertEqual(checker.load_allowed_licenses(), ["MIT"])
+                self.assertEqual(checker.load_license_rules(), [{"deny": "GPL-*"}])
+
+
+if __name__ == "__main__":
+    unittest.main()
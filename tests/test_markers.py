@@ -0,0 +1,67 @@
+"""Requires-Dist の環境マーカーの評価と、pip を読み込めない環境での動作のテスト
+
+benchmarks/suite.py のワーカーは site-packages を sys.path から外して計測するため、
+pip がなくても依存関係を辿れることもここで確認します。
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+REQUIRES_DIST = [
+    "always>=1",
+    'test-only; extra == "test"',
+    'legacy; python_version < "3"',
+    'windows-only; sys_platform == "win32" and python_version >= "3.8"',
+]
+
+
+class MarkerTest(unittest.TestCase):
+
+    def setUp(self):
+        checker._marker_applies.cache_clear()
+        self.addCleanup(checker._marker_applies.cache_clear)
+
+    def test_current_environment(self):
+        expected = ["always"] + (["windows-only"] if sys.platform == "win32" else [])
+        self.assertEqual(checker._requires_from_metadata(REQUIRES_DIST), expected)
+
+    def test_explicit_environment(self):
+        environment = (("python_version", "2.7"), ("sys_platform", "win32"))
+        self.assertEqual(checker._requires_from_metadata(REQUIRES_DIST, environment), ["always", "legacy"])
+
+    def test_invalid_marker_is_skipped(self):
+        self.assertEqual(checker._requires_from_metadata(["broken; python_version <<< 3"]), [])
+
+    def test_without_pip(self):
+        # pip の packaging を読み込めない場合は extra の依存だけを除き、それ以外は残す
+        with mock.patch.dict(sys.modules, {"pip._vendor.packaging.markers": None}):
+            requires = checker._requires_from_metadata(REQUIRES_DIST)
+        self.assertEqual(requires, ["always", "legacy", "windows-only"])
+
+
+class BenchmarkSuiteTest(unittest.TestCase):
+    """既定のベンチマーク（pip を sys.path から外したワーカー）が全シナリオで完走することを確認します"""
+
+    def test_default_scenarios(self):
+        with tempfile.TemporaryDirectory() as fixtures_dir:
+            process = subprocess.run(
+                [sys.executable, os.path.join(REPO_ROOT, "benchmarks", "suite.py"), "--sizes", "100",
+                 "--runs", "1", "--fixtures-dir", fixtures_dir],
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, timeout=300)
+        self.assertEqual(process.returncode, 0, process.stderr)
+        results = json.loads(process.stdout)["results"]
+        self.assertEqual(sorted(result["scenario"] for result in results), ["check", "record", "scan", "update"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,190 @@
+"""requirements_license.txt の読み書き（LicenseRecord / RequirementsLicenseFile / 1行ずつの書き換え）と
+LicenseStatusIndex によるステータスのその場での書き換えのテスト
+
+    python -m pytest tests
+"""
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TESTS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+DIRECT = checker.INSTALL_TYPE_DIRECT
+DEPENDENCY = checker.INSTALL_TYPE_DEPENDENCY
+
+ENTRIES = (
+    f"✅ alpha==1.0 [MIT] [{DIRECT}]\n"
+    f"❓ beta==2.0 [GPL-3.0-only] [{DEPENDENCY}]\n"
+    "# コメントはそのまま残す\n"
+    f"❓ gamma==0.1 [BSD-3-Clause] [{DIRECT}]\n"
+    f"✅ delta==3.0 [MIT] [{DEPENDENCY}]\n"
+)
+
+
+class _RequirementsFileTestCase(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "requirements_license.txt")
+        self.write(checker.REQUIREMENTS_LICENSE_HEADER + ENTRIES)
+
+    def write(self, text):
+        with open(self.path, "w") as f:
+            f.write(text)
+
+    def read(self):
+        with open(self.path) as f:
+            return f.read()
+
+    def statuses(self):
+        return {record.name: record.status for record in checker.iter_license_records(self.path)}
+
+
+class LicenseRecordTest(unittest.TestCase):
+
+    def test_parse(self):
+        record = checker.LicenseRecord.parse(f"❓ beta==2.0 [GPL-3.0-only] [{DEPENDENCY}]\n")
+        self.assertEqual((record.status, record.name, record.version, record.license, record.install_type),
+                         ("❓", "beta", "2.0", "GPL-3.0-only", DEPENDENCY))
+        self.assertFalse(record.is_direct)
+
+    def test_license_with_brackets(self):
+        record = checker.LicenseRecord.parse(f"✅ alpha==1.0 [MIT [modified]] [{DIRECT}]\n")
+        self.assertEqual(record.license, "MIT [modified]")
+        self.assertTrue(record.is_direct)
+
+    def test_not_an_entry(self):
+        for line in ("# comment\n", "\n", "alpha==1.0\n", "✅ alpha [MIT]\n"):
+            with self.subTest(line=line):
+                self.assertIsNone(checker.LicenseRecord.parse(line))
+
+    def test_format_keeps_unusual_lines(self):
+        line = f"✅  alpha == 1.0 [MIT] [{DIRECT}]\n"
+        record = checker.LicenseRecord.parse(line)
+        self.assertEqual(record.format(), line)
+        # 内容を変更した行だけ整形し直す
+        record.assign("❓", "alpha", "1.0", "MIT", DIRECT)
+        self.assertEqual(record.format(), f"❓ alpha==1.0 [MIT] [{DIRECT}]\n")
+
+
+class RequirementsLicenseFileTest(_RequirementsFileTestCase):
+
+    def test_get_normalizes_names(self):
+        inventory = checker.RequirementsLicenseFile.load(self.path)
+        self.assertEqual(len(inventory), 4)
+        self.assertEqual(inventory.get("Gamma").version, "0.1")
+        self.assertIsNone(inventory.get("missing"))
+
+    def test_upsert_keeps_direct_install_type(self):
+        inventory = checker.RequirementsLicenseFile.load(self.path)
+        inventory.upsert("alpha", "1.1", "MIT", "✅", False)
+        inventory.upsert("epsilon", "1.0", "Apache-2.0", "❓", False)
+        self.assertTrue(inventory.flush())
+        records = {record.name: record for record in checker.iter_license_records(self.path)}
+        self.assertEqual((records["alpha"].version, records["alpha"].install_type), ("1.1", DIRECT))
+        self.assertEqual(records["epsilon"].install_type, DEPENDENCY)
+        self.assertIn("# コメントはそのまま残す\n", self.read())
+
+    def test_flush_without_changes(self):
+        inventory = checker.RequirementsLicenseFile.load(self.path)
+        inventory.upsert("alpha", "1.0", "MIT", "✅", True)
+        self.assertFalse(inventory.flush())
+
+    def test_flush_replays_onto_concurrent_changes(self):
+        inventory = checker.RequirementsLicenseFile.load(self.path)
+        inventory.upsert("epsilon", "1.0", "Apache-2.0", "❓", True)
+        # 読み込んだ後に別のプロセスが追加したエントリーも残す
+        with open(self.path, "a") as f:
+            f.write(f"✅ zeta==1.0 [MIT] [{DIRECT}]\n")
+        inventory.flush()
+        self.assertEqual(set(self.statuses()), {"alpha", "beta", "gamma", "delta", "epsilon", "zeta"})
+
+
+class RewriteRequirementsLicenseTest(_RequirementsFileTestCase):
+
+    def test_update_and_append(self):
+        def update(record):
+            if record.name == "gamma":
+                record.status, record.line = "✅", None
+                return True
+            return False
+
+        def append():
+            return [checker.LicenseRecord("❓", "epsilon", "1.0", "Apache-2.0", DEPENDENCY)]
+
+        self.assertEqual(checker.rewrite_requirements_license(self.path, update, append), 2)
+        text = self.read()
+        self.assertIn(f"✅ gamma==0.1 [BSD-3-Clause] [{DIRECT}]\n", text)
+        self.assertTrue(text.endswith(f"❓ epsilon==1.0 [Apache-2.0] [{DEPENDENCY}]\n"))
+        self.assertIn("# コメントはそのまま残す\n", text)
+
+    def test_unchanged_file_is_not_replaced(self):
+        before = os.stat(self.path)
+        self.assertEqual(checker.rewrite_requirements_license(self.path, lambda record: False), 0)
+        after = os.stat(self.path)
+        self.assertEqual((before.st_ino, before.st_mtime_ns), (after.st_ino, after.st_mtime_ns))
+
+    def test_missing_file_is_created(self):
+        os.remove(self.path)
+        with contextlib.redirect_stdout(io.StringIO()):
+            checker.rewrite_requirements_license(self.path, lambda record: False, lambda: [
+                checker.LicenseRecord("✅", "alpha", "1.0", "MIT", DIRECT)])
+        self.assertEqual(self.read(), checker.REQUIREMENTS_LICENSE_HEADER + f"✅ alpha==1.0 [MIT] [{DIRECT}]\n")
+
+
+class LicenseStatusIndexTest(_RequirementsFileTestCase):
+
+    def build(self, allowed_licenses, rules=()):
+        index = checker.LicenseStatusIndex.build(self.path, checker._allowlist_fingerprint(allowed_licenses, rules))
+        index.save()
+        return index
+
+    def test_groups_entries_by_license(self):
+        index = self.build(["MIT"])
+        self.assertEqual(index.licenses["MIT"]["status"], "✅")
+        self.assertEqual([entry[2] for entry in index.licenses["MIT"]["entries"]], ["alpha==1.0", "delta==3.0"])
+        with open(self.path, "rb") as f:
+            for entry in index.licenses["GPL-3.0-only"]["entries"]:
+                f.seek(entry[0])
+                self.assertEqual(f.read(3), "❓".encode("utf-8"))
+
+    def test_apply_rewrites_in_place(self):
+        self.build(["MIT"])
+        index = checker.LicenseStatusIndex.load(self.path)
+        size = os.path.getsize(self.path)
+        out = io.StringIO()
+        changed = index.apply(checker.LicenseMatcher(["BSD-3-Clause"]), out)
+        self.assertEqual(changed, 3)
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(self.statuses(), {"alpha": "❓", "beta": "❓", "gamma": "✅", "delta": "❓"})
+        self.assertEqual(out.getvalue().count("🔄"), 3)
+        # 書き換えた後の状態で続けて使える
+        self.assertEqual(index.apply(checker.LicenseMatcher(["BSD-3-Clause"]), out), 0)
+
+    def test_apply_with_package_rules(self):
+        index = self.build(["MIT"])
+        matcher = checker.LicenseMatcher(["MIT"], [{"deny": "MIT", "package": "delta"}])
+        self.assertEqual(index.apply(matcher, io.StringIO()), 1)
+        self.assertEqual(self.statuses()["delta"], "❓")
+        self.assertIsNone(index.licenses["MIT"]["status"])
+
+    def test_stale_index(self):
+        index = self.build(["MIT"])
+        with open(self.path, "a") as f:
+            f.write(f"✅ epsilon==1.0 [MIT] [{DIRECT}]\n")
+        self.assertIsNone(checker.LicenseStatusIndex.load(self.path))
+        with self.assertRaises(ValueError):
+            index.apply(checker.LicenseMatcher(["BSD-3-Clause"]), io.StringIO())
+        self.assertEqual(self.statuses()["gamma"], "❓")
+
+
+if __name__ == "__main__":
+    unittest.main()
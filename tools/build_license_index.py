@@ -0,0 +1,76 @@
+"""同梱するライセンス本文の索引（pip_license_checker_data/license-index.json.gz）を生成します
+
+tools/license-texts/ にある `<SPDX ID>.txt` を読み、pip_license_checker の
+license_text_fingerprint と同じ方法で指紋を作って1つのファイルにまとめます。
+同じ SPDX ID の別の表記は `<SPDX ID>@<名前>.txt` として置けます。
+索引にはシングルのハッシュだけを保存し、本文そのものは含めません。
+
+    python tools/build_license_index.py [--texts DIR ...] [--output FILE]
+"""
+import argparse
+import array
+import base64
+import gzip
+import json
+import os
+import sys
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_ROOT = os.path.dirname(TOOLS_DIR)
+sys.path.insert(0, REPO_ROOT)
+
+import pip_license_checker as checker  # noqa: E402
+
+DEFAULT_TEXTS_DIR = os.path.join(TOOLS_DIR, "license-texts")
+
+
+def collect_texts(directories):
+    """(SPDX ID, ファイル名, 本文) をファイル名の順に返します"""
+    texts = []
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            stem, extension = os.path.splitext(name)
+            if extension != ".txt":
+                continue
+            with open(os.path.join(directory, name), encoding="utf-8", errors="replace") as f:
+                texts.append((stem.split("@", 1)[0], name, f.read()))
+    return texts
+
+
+def build_index(texts):
+    """索引ファイルの内容（JSON にできる dict）を返します"""
+    licenses = []
+    for spdx_id, name, text in texts:
+        hashes = array.array("I", sorted(checker.license_text_fingerprint(text)))
+        if not hashes:
+            print(f"⚠️ {name}: 指紋が空のため除外しました", file=sys.stderr)
+            continue
+        if sys.byteorder != "little":
+            hashes.byteswap()
+        licenses.append({"id": spdx_id, "source": name, "hashes": base64.b64encode(hashes.tobytes()).decode()})
+    return {
+        "version": checker.LICENSE_TEXT_INDEX_VERSION,
+        "shingle_size": checker._LICENSE_SHINGLE_SIZE,
+        "winnow_size": checker._LICENSE_WINNOW_SIZE,
+        "licenses": licenses,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ライセンス本文の索引の生成")
+    parser.add_argument("--texts", action="append", default=None, metavar="DIR",
+                        help=f"参照本文のディレクトリ（複数指定可、デフォルト: {DEFAULT_TEXTS_DIR}）")
+    parser.add_argument("--output", default=checker.LICENSE_TEXT_INDEX_PATH, help="索引の出力先")
+    args = parser.parse_args()
+
+    index = build_index(collect_texts(args.texts or [DEFAULT_TEXTS_DIR]))
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    # mtime=0 にして同じ入力からは同じバイト列になるようにする
+    with open(args.output, "wb") as raw, gzip.GzipFile(fileobj=raw, mode="wb", mtime=0) as f:
+        f.write(json.dumps(index, separators=(",", ":"), sort_keys=True).encode("utf-8"))
+    print(f"{len(index['licenses'])} texts -> {args.output} ({os.path.getsize(args.output)} bytes)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())